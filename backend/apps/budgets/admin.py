@@ -0,0 +1,75 @@
+from collections import Counter
+
+from django.contrib import admin
+from django.db import transaction
+
+from apps.budgets import events, rollups
+from apps.budgets.models import Budget, Category, Membership, MonthlySummary, Transaction, TransactionArchive
+
+
+class MembershipInline(admin.TabularInline):
+    model = Membership
+    raw_id_fields = ['user']
+    extra = 0
+
+
+class BudgetAdmin(admin.ModelAdmin):
+    list_display = ['name', 'owner', 'created_at']
+    search_fields = ['name', 'owner__email']
+    raw_id_fields = ['owner']
+    inlines = [MembershipInline]
+
+    def changeform_view(self, *args, **kwargs):
+        # The budget and its inline memberships reach the budget's stream as one event
+        with events.coalesced():
+            return super().changeform_view(*args, **kwargs)
+
+
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ['name', 'budget']
+    search_fields = ['name']
+    raw_id_fields = ['budget']
+
+
+class TransactionAdmin(admin.ModelAdmin):
+    list_display = ['date', 'kind', 'amount', 'category', 'budget']
+    list_filter = ['kind']
+    raw_id_fields = ['budget', 'category', 'created_by']
+    readonly_fields = ['created_at']
+
+    def delete_queryset(self, request, queryset):
+        # Bulk deletes skip Transaction.delete, keep the monthly summaries in step and tell the budgets here
+        with transaction.atomic():
+            rows = list(queryset.select_for_update())
+            rollups.apply(rows, sign=-1)
+            queryset.delete()
+            for budget_id, count in Counter(row.budget_id for row in rows).items():
+                events.changed(budget_id, 'transaction', events.BATCH, count=count)
+
+
+class MonthlySummaryAdmin(admin.ModelAdmin):
+    list_display = ['budget', 'category', 'month', 'income', 'expense', 'count']
+    raw_id_fields = ['budget', 'category']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class TransactionArchiveAdmin(admin.ModelAdmin):
+    list_display = ['month', 'rows', 'path', 'archived_at']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+admin.site.register(Budget, BudgetAdmin)
+admin.site.register(Category, CategoryAdmin)
+admin.site.register(Transaction, TransactionAdmin)
+admin.site.register(MonthlySummary, MonthlySummaryAdmin)
+admin.site.register(TransactionArchive, TransactionArchiveAdmin)
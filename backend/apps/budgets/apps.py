@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+class BudgetsConfig(AppConfig):
+    name = 'apps.budgets'
+    verbose_name = 'Budgets'
+
+    def ready(self):
+        from apps.budgets.signals import create_trigram_index, partition_transactions
+        post_migrate.connect(partition_transactions, sender=self)
+        post_migrate.connect(create_trigram_index, sender=self)
@@ -0,0 +1,56 @@
+"""
+Batch writes of transactions (``POST /api/transactions/batch/``): one bulk_create and one
+bulk_update for the whole batch instead of a save, its summary upsert and its event per row.
+"""
+from collections import Counter
+from copy import copy
+
+from django.db import router
+
+from apps.budgets import events, rollups
+from apps.budgets.models import Transaction
+
+FIELDS = ['budget_id', 'category_id', 'kind', 'amount', 'date', 'description']
+
+
+def save_batch(items, existing, user_id=None, using=None, batch_size=1000):
+    """
+    Writes validated TransactionBatchSerializer items: items with an ``id`` replace the row of
+    ``existing`` (``{id: Transaction}``, locked by the caller), the others are created by
+    ``user_id``. Must run in an atomic block. Returns the rows in item order.
+    """
+    using = using or router.db_for_write(Transaction)
+    # The stored versions, before the items overwrite the rows
+    replaced = [copy(existing[attrs['id']]) for attrs in items if 'id' in attrs]
+    previous_budgets = {tx.budget_id for tx in replaced}
+
+    created, updated, rows = [], [], []
+    for attrs in items:
+        values = {
+            'budget_id': attrs['budget'],
+            'category_id': attrs['category'],
+            'kind': attrs['kind'],
+            'amount': attrs['amount'],
+            'date': attrs['date'],
+            'description': attrs.get('description', ''),
+        }
+        if 'id' in attrs:
+            tx = existing[attrs['id']]
+            for name, value in values.items():
+                setattr(tx, name, value)
+            updated.append(tx)
+        else:
+            tx = Transaction(created_by_id=user_id, **values)
+            created.append(tx)
+        rows.append(tx)
+
+    Transaction.objects.using(using).bulk_create(created, batch_size=batch_size)
+    Transaction.objects.using(using).bulk_update(updated, FIELDS, batch_size=batch_size)
+    # Bulk writes skip Transaction.save: the summaries lose the old versions and gain the new ones,
+    # netted into one key-ordered pass
+    rollups.replace(replaced, rows, using=using)
+    counts = Counter(tx.budget_id for tx in rows)
+    # Rows moved to another budget change the one they left too
+    for budget_id in sorted(previous_budgets | set(counts)):
+        events.changed(budget_id, 'transaction', events.BATCH, using=using, count=counts[budget_id])
+    return rows
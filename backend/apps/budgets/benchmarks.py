@@ -0,0 +1,518 @@
+import csv
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.http import QueryDict
+from django.db.models import Max, Q, Sum
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from apps.budgets import events, imports, partitions, reports, rollups
+from apps.budgets.filters import TransactionFilterSet
+from apps.budgets.models import Budget, Category, Membership, MonthlySummary, Transaction
+from apps.budgets.views import EXPORT_COLUMNS
+from apps.common.benchmarks import Scenario, register, register_micro, timed
+from apps.common import pubsub
+from apps.common.bulk import copy_rows
+from apps.common.exports import stream_export
+from apps.common.sse import format_event, iter_events
+from apps.users.models import User
+from apps.users.tokens import issue_tokens
+
+CATEGORIES = ['Salary', 'Rent', 'Groceries', 'Transport', 'Utilities', 'Health', 'Leisure', 'Other']
+
+
+def seed_ledger(context, budgets=100):
+    """
+    One budget per seeded user (up to ``budgets``) and ``--transactions`` transactions spread
+    over them and the last three years, loaded with COPY and summarised with one rebuild.
+    Shared by all budget scenarios, seeded once per run.
+    """
+    if 'budgets' in context.extra:
+        return context.extra['budgets']
+
+    rng = random.Random(0)
+    now = timezone.now()
+    owners = context.users[:budgets]
+    last_id = Budget.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+    copy_rows(Budget, ['name', 'owner_id', 'created_at', 'updated_at'],
+              ((f'Bench budget {n}', owner['id'], now, now) for n, owner in enumerate(owners)))
+    budget_ids = list(Budget.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True))
+    copy_rows(Membership, ['user_id', 'budget_id', 'role', 'created_at'],
+              ((owner['id'], budget_id, Membership.OWNER, now) for budget_id, owner in zip(budget_ids, owners)))
+    copy_rows(Category, ['budget_id', 'name'], ((budget_id, name) for budget_id in budget_ids for name in CATEGORIES))
+    categories = {}
+    for category_id, budget_id in Category.objects.filter(budget_id__in=budget_ids).values_list('id', 'budget_id'):
+        categories.setdefault(budget_id, []).append(category_id)
+
+    today = now.date()
+
+    def rows():
+        for _ in range(context.extra.get('transactions', 0)):
+            budget_id = rng.choice(budget_ids)
+            kind = Transaction.INCOME if rng.random() < 0.2 else Transaction.EXPENSE
+            yield (budget_id, rng.choice(categories[budget_id]), kind, Decimal(rng.randrange(100, 500000)) / 100,
+                   today - timedelta(days=rng.randrange(3 * 365)), '', now)
+
+    copy_rows(Transaction, ['budget_id', 'category_id', 'kind', 'amount', 'date', 'description', 'created_at'],
+              rows())
+    if partitions.is_partitioned(connection):
+        # COPY put the past months into the default partition
+        partitions.create_partitions(connection)
+    rollups.rebuild(budget_ids)
+
+    context.extra['budgets'] = [
+        {'id': budget_id, 'owner': owner['id'], 'categories': categories[budget_id]}
+        for budget_id, owner in zip(budget_ids, owners)
+    ]
+    return context.extra['budgets']
+
+
+class BudgetScenario(Scenario):
+
+    def setup(self):
+        self.budgets = seed_ledger(self.context)
+        owners = User.objects.in_bulk([budget['owner'] for budget in self.budgets])
+        self.headers = {budget['id']: {'Authorization': 'Bearer ' + issue_tokens(owners[budget['owner']])['access']}
+                        for budget in self.budgets}
+
+    def budget(self, i):
+        budget = self.budgets[i % len(self.budgets)]
+        return budget, self.headers[budget['id']]
+
+
+@register
+class Overview(BudgetScenario):
+    name = 'budgets-overview'
+
+    def request(self, i):
+        budget, headers = self.budget(i)
+        return 'GET', f'/api/budgets/{budget["id"]}/overview/', None, headers
+
+
+@register
+class CreateTransaction(BudgetScenario):
+    name = 'budgets-transaction-create'
+    expected_statuses = (201,)
+
+    def request(self, i):
+        budget, headers = self.budget(i)
+        return 'POST', '/api/transactions/', {
+            'budget': budget['id'],
+            'category': budget['categories'][i % len(budget['categories'])],
+            'kind': Transaction.EXPENSE,
+            'amount': '12.34',
+            'date': (date.today() - timedelta(days=i % 90)).isoformat(),
+        }, headers
+
+
+@register_micro('budgets-rollups')
+def rollup_reads(context, samples=20):
+    """
+    Time to get one budget's per-category monthly totals from MonthlySummary against
+    aggregating its transactions with SUM ... GROUP BY, and whether both agree.
+    """
+    budgets = seed_ledger(context)[:samples]
+
+    def from_rollups():
+        return [sorted(MonthlySummary.objects.filter(budget_id=budget['id'], count__gt=0)
+                       .values_list('category_id', 'month', 'income', 'expense', 'count'))
+                for budget in budgets]
+
+    def live():
+        return [sorted((row['category_id'], row['month'], row['income'], row['expense'], row['count'])
+                       for row in rollups.live_totals(Transaction.objects.filter(budget_id=budget['id'])))
+                for budget in budgets]
+
+    def in_cents(results):
+        # SQLite returns the sums as floats
+        cents = Decimal('0.01')
+        return [[(category, month, Decimal(str(income)).quantize(cents), Decimal(str(expense)).quantize(cents), count)
+                 for category, month, income, expense, count in rows] for rows in results]
+
+    rollup_time, rollup_rows = timed(from_rollups)
+    live_time, live_rows = timed(live)
+    return {
+        'transactions': Transaction.objects.filter(budget_id__in=[budget['id'] for budget in budgets]).count(),
+        'budgets': len(budgets),
+        'rollup_ms_per_budget': round(rollup_time / len(budgets) * 1000, 3),
+        'live_sum_ms_per_budget': round(live_time / len(budgets) * 1000, 3),
+        'speedup': round(live_time / rollup_time, 2),
+        'consistent': in_cents(rollup_rows) == in_cents(live_rows),
+    }
+
+
+@register_micro('budgets-import')
+def statement_import(context):
+    """
+    Imports a ``--transactions`` line CSV statement into a new budget, then imports it again
+    (every line a duplicate) while tracing allocations, to show memory does not grow with the file.
+    """
+    lines = context.extra.get('transactions', 0)
+    rng = random.Random(1)
+    today = date.today()
+    owner = context.users[0]['id']
+    budget = Budget.objects.create(name='Bench import', owner_id=owner)
+
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    try:
+        with os.fdopen(fd, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['Date', 'Amount', 'Description', 'Category'])
+            for n in range(lines):
+                writer.writerow([(today - timedelta(days=rng.randrange(3 * 365))).isoformat(),
+                                 f'{rng.randrange(-500000, 100000) / 100:.2f}', f'Payment {n % 5000}',
+                                 CATEGORIES[n % len(CATEGORIES)]])
+        size = os.path.getsize(path)
+
+        def run():
+            with open(path, 'rb') as f:
+                return imports.import_statement(budget, f, 'csv', user_id=owner)
+
+        import_time, first = timed(run, repeat=1)
+        tracemalloc.start()
+        try:
+            second = run()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    finally:
+        os.remove(path)
+
+    return {
+        'lines': lines,
+        'file_mb': round(size / 2 ** 20, 1),
+        'import_s': round(import_time, 3),
+        'lines_per_s': round(lines / import_time, 1) if import_time else None,
+        'imported': first.imported,
+        'invalid': first.invalid,
+        'reimport_duplicates': second.duplicates,
+        'reimport_peak_python_mb': round(peak / 2 ** 20, 1),
+    }
+
+
+@register_micro('budgets-export')
+def transaction_export(context):
+    """
+    Streams a tenth of the seeded transactions and then all of them as CSV, reporting time to the
+    first chunk, rows/s and traced peak Python memory, which should not grow with the row count.
+    """
+    seed_ledger(context)
+    total = Transaction.objects.count()
+    result = {}
+    for label, rows in [('tenth', total // 10), ('all', total)]:
+        # Primary key order, so the first chunk does not wait for a sort of the whole table
+        queryset = Transaction.objects.order_by('id')[:rows]
+        tracemalloc.start()
+        try:
+            started = time.perf_counter()
+            chunks = iter(stream_export(queryset, EXPORT_COLUMNS, 'csv', 'transactions'))
+            size = len(next(chunks))
+            first_chunk = time.perf_counter() - started
+            size += sum(len(chunk) for chunk in chunks)
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        result.update({
+            f'{label}_rows': rows,
+            f'{label}_mb': round(size / 2 ** 20, 1),
+            f'{label}_first_chunk_ms': round(first_chunk * 1000, 3),
+            f'{label}_rows_per_s': round(rows / elapsed, 1) if elapsed else None,
+            f'{label}_peak_python_mb': round(peak / 2 ** 20, 1),
+        })
+    return result
+
+
+@register_micro('budgets-shared-list')
+def shared_budget_list(context, budgets=500):
+    """
+    Queries and latency of listing the budgets shared with one user, at 50 and at ``budgets``
+    shared budgets. The query count must not depend on the number of budgets.
+    """
+    owner, member = context.users[-1], context.users[0]
+    headers = {'HTTP_AUTHORIZATION': 'Bearer ' + issue_tokens(User.objects.get(pk=member['id']))['access']}
+    client = Client()
+    now = timezone.now()
+    result = {}
+    shared = 0
+    for target in [50, budgets]:
+        last_id = Budget.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        copy_rows(Budget, ['name', 'owner_id', 'created_at', 'updated_at'],
+                  ((f'Bench shared {n}', owner['id'], now, now) for n in range(shared, target)))
+        new_ids = list(Budget.objects.filter(id__gt=last_id).values_list('id', flat=True))
+        copy_rows(Membership, ['user_id', 'budget_id', 'role', 'created_at'],
+                  [(user['id'], budget_id, role, now) for budget_id in new_ids
+                   for user, role in [(owner, Membership.OWNER), (member, Membership.VIEWER)]])
+        shared = target
+
+        with CaptureQueriesContext(connection) as queries:
+            elapsed, response = timed(lambda: client.get(f'/api/budgets/?page_size={budgets}', **headers), repeat=1)
+        result.update({
+            f'shared_{target}_status': response.status_code,
+            f'shared_{target}_rows': len(response.json()['results']),
+            f'shared_{target}_queries': len(queries),
+            f'shared_{target}_ms': round(elapsed * 1000, 3),
+        })
+    return result
+
+
+def explain(queryset):
+    """
+    ``(sequential, indexes)``: whether the plan reads budgets_transaction sequentially and
+    the indexes it uses. On Postgres sequential scans are disabled first, so a remaining one
+    means no index can serve the query, whatever the table size.
+    """
+    sql, params = queryset.query.sql_with_params()
+    table = Transaction._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            nodes, sequential, indexes = [cursor.fetchone()[0][0]['Plan']], False, []
+            while nodes:
+                node = nodes.pop()
+                nodes.extend(node.get('Plans', []))
+                # Partitions (see apps.budgets.partitions) are scanned under their own names
+                if node.get('Relation Name', '').startswith(table) and node['Node Type'] == 'Seq Scan':
+                    sequential = True
+                if 'Index Name' in node:
+                    indexes.append(node['Index Name'])
+            return sequential, sorted(set(indexes))
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        details = [row[-1] for row in cursor.fetchall()]
+        sequential = any(detail == f'SCAN {table}' for detail in details)
+        indexes = [detail.split(' INDEX ')[1].split(' ')[0] for detail in details if ' INDEX ' in detail]
+        return sequential, sorted(set(indexes))
+
+
+@register_micro('budgets-filters')
+def filter_plans(context):
+    """
+    EXPLAIN of the transaction list query (as the API runs it) for every supported filter,
+    reporting sequential scans of the transactions table and the indexes used.
+    """
+    budget = seed_ledger(context)[0]
+    first, second = budget['categories'][:2]
+    cases = {
+        'budget': f'budget={budget["id"]}',
+        'date_range': f'budget={budget["id"]}&date_from=2021-01-01&date_to=2021-03-31',
+        'category': f'category={first},{second}',
+        'amount_range': f'budget={budget["id"]}&amount_min=10&amount_max=20',
+        'income': f'budget={budget["id"]}&kind=income',
+        'search': 'search=payment',
+    }
+    shared = Transaction.objects.filter(budget_id__in=Membership.objects.budget_ids(budget['owner']))
+    result = {'transactions': Transaction.objects.count()}
+    for name, query in cases.items():
+        queryset = TransactionFilterSet(QueryDict(query)).filter_queryset(shared).order_by('-date', '-id')[:50]
+        sequential, indexes = explain(queryset)
+        result[name] = {'sequential_scan': sequential, 'indexes': indexes}
+    result['all_indexed'] = not any(result[name]['sequential_scan'] for name in cases)
+    return result
+
+
+def scanned_partitions(queryset):
+    """
+    Names of the transaction partitions left in the plan of ``queryset`` after pruning.
+    """
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        nodes, names = [cursor.fetchone()[0][0]['Plan']], set()
+    while nodes:
+        node = nodes.pop()
+        nodes.extend(node.get('Plans', []))
+        if node.get('Relation Name', '').startswith(Transaction._meta.db_table):
+            names.add(node['Relation Name'])
+    return sorted(names)
+
+
+@register_micro('budgets-partitions')
+def partition_pruning(context, samples=20):
+    """
+    Partitions read by date-bounded transaction queries, out of all of them, and their
+    latency. Postgres only, elsewhere the table isn't partitioned.
+    """
+    if not partitions.is_partitioned(connection):
+        return {'skipped': 'transactions table not partitioned (PostgreSQL only)'}
+    budget = seed_ledger(context)[0]
+    month = timezone.now().date().replace(day=1)
+    result = {'partitions': len(partitions.partitions(connection)) + 1}
+    for name, months in [('month', 1), ('quarter', 3), ('year', 12)]:
+        start = partitions.add_months(month, 1 - months)
+        end = partitions.add_months(month, 1) - timedelta(days=1)
+        queryset = (Transaction.objects.filter(budget_id=budget['id'], date__gte=start, date__lte=end)
+                    .order_by('-date', '-id')[:50])
+        scanned = scanned_partitions(queryset)
+        elapsed, _ = timed(lambda: list(queryset.all()), repeat=samples)
+        result[name] = {
+            'partitions_scanned': len(scanned),
+            # The default partition may be kept when the range has no partition of its own
+            'pruned': len(scanned) <= months + 1,
+            'ms': round(elapsed * 1000, 3),
+        }
+    return result
+
+
+@register_micro('budgets-events')
+def event_fanout(context, streams=500, published=2000, budgets=50):
+    """
+    Event streams one worker holds and the events it delivers per second: ``streams``
+    subscriptions spread over ``budgets`` budgets, each drained through the SSE encoder by a
+    thread of its own (a greenlet under gevent), while ``published`` transaction changes go
+    through the configured broker (NOTIFY and the listener on Postgres).
+    """
+    budget_ids = [budget['id'] for budget in seed_ledger(context)[:budgets]]
+    hub, broker = pubsub.get_hub()
+    subscriptions = [pubsub.subscribe([events.channel(budget_ids[n % len(budget_ids)])]) for n in range(streams)]
+    subscriptions = [subscription for subscription in subscriptions if subscription is not None]
+    # Notifications sent before the listener's LISTEN are not delivered
+    broker.ready.wait(10)
+    stop = threading.Event()
+    delivered = [0] * len(subscriptions)
+
+    def drain(n, subscription):
+        frames = iter_events(subscription, lambda channel, message: format_event(message['type'], message),
+                             heartbeat=0.2, max_seconds=3600)
+        for chunk in frames:
+            delivered[n] += chunk.count(b'event: transaction')
+            if stop.is_set():
+                frames.close()
+
+    threads = [threading.Thread(target=drain, args=(n, subscription), daemon=True)
+               for n, subscription in enumerate(subscriptions)]
+    for thread in threads:
+        thread.start()
+    held = hub.subscribers
+    listeners = {}
+    for subscription in subscriptions:
+        for channel in subscription.channels:
+            listeners[channel] = listeners.get(channel, 0) + 1
+    expected = sum(listeners.get(events.channel(budget_ids[n % len(budget_ids)]), 0) for n in range(published))
+    dispatched, dropped = hub.dispatched, hub.dropped
+
+    started = time.perf_counter()
+    today = str(timezone.now().date())
+    for n in range(published):
+        events.changed(budget_ids[n % len(budget_ids)], 'transaction', events.SAVED, n, date=today)
+    publish_time = time.perf_counter() - started
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline and (hub.dispatched - dispatched < expected
+                                           or any(subscription.pending for subscription in subscriptions)):
+        time.sleep(0.005)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    return {
+        'streams_held': held,
+        'published': published,
+        'publish_per_second': round(published / publish_time, 1),
+        'deliveries': sum(delivered),
+        'deliveries_expected': expected,
+        'deliveries_per_second': round(sum(delivered) / elapsed, 1),
+        'backlogs_dropped': hub.dropped - dropped,
+        'broker': type(broker).__name__,
+    }
+
+
+@register_micro('budgets-batch')
+def batch_writes(context, sizes=(1, 100, 10000), singles=100):
+    """
+    Items/second creating transactions through POST /api/transactions/batch/ with payloads of
+    each of ``sizes`` items, against ``singles`` POST /api/transactions/ of one item each.
+    """
+    budget = seed_ledger(context)[0]
+    owner = User.objects.get(pk=budget['owner'])
+    headers = {'HTTP_AUTHORIZATION': 'Bearer ' + issue_tokens(owner)['access']}
+    client = Client()
+    today = date.today()
+
+    def item(i):
+        return {
+            'budget': budget['id'],
+            'category': budget['categories'][i % len(budget['categories'])],
+            'kind': Transaction.EXPENSE,
+            'amount': '12.34',
+            'date': (today - timedelta(days=i % 90)).isoformat(),
+        }
+
+    statuses = []
+    started = time.perf_counter()
+    for i in range(singles):
+        statuses.append(client.post('/api/transactions/', item(i), content_type='application/json',
+                                    **headers).status_code)
+    result = {'single_items_per_s': round(singles / (time.perf_counter() - started), 1)}
+    for size in sizes:
+        payload = [item(i) for i in range(size)]
+        elapsed, response = timed(lambda: client.post('/api/transactions/batch/', payload,
+                                                      content_type='application/json', **headers), repeat=1)
+        statuses.append(response.status_code)
+        result[f'batch_{size}_items_per_s'] = round(size / elapsed, 1)
+    result['errors'] = sum(1 for code in statuses if code != 201)
+    return result
+
+
+@register_micro('budgets-reports')
+def report_latency(context, warm=20):
+    """
+    Latency of GET /api/budgets/<id>/reports/ on one budget holding ``--transactions``
+    transactions over three years: cold (nothing cached), warm per bucket, and after one new
+    transaction (only its month aggregated again). Checks the closing balance against a SUM.
+    """
+    rows = context.extra.get('transactions', 0)
+    rng = random.Random(2)
+    owner = User.objects.get(pk=context.users[0]['id'])
+    budget = Budget.objects.create(name='Bench reports', owner=owner)
+    category_ids = [Category.objects.create(budget=budget, name=name).pk for name in CATEGORIES]
+    now = timezone.now()
+    today = now.date()
+    copy_rows(Transaction, ['budget_id', 'category_id', 'kind', 'amount', 'date', 'description', 'created_at'],
+              ((budget.pk, rng.choice(category_ids), Transaction.INCOME if rng.random() < 0.2 else Transaction.EXPENSE,
+                Decimal(rng.randrange(100, 500000)) / 100, today - timedelta(days=rng.randrange(3 * 365)), '', now)
+               for _ in range(rows)))
+    if partitions.is_partitioned(connection):
+        partitions.create_partitions(connection)
+    rollups.rebuild([budget.pk])
+
+    headers = {'HTTP_AUTHORIZATION': 'Bearer ' + issue_tokens(owner)['access']}
+    client = Client()
+
+    def get(bucket='month'):
+        return client.get(f'/api/budgets/{budget.pk}/reports/', {'bucket': bucket}, **headers)
+
+    months = set(MonthlySummary.objects.filter(budget=budget).values_list('budget_id', 'month'))
+    reports.invalidate(months)
+    cold, response = timed(get, repeat=1)
+    result = {'transactions': rows, 'months': len(months), 'cold_ms': round(cold * 1000, 3)}
+    for bucket in reports.BUCKETS:
+        elapsed, response = timed(lambda: get(bucket), repeat=warm)
+        result[f'warm_{bucket}_ms'] = round(elapsed * 1000, 3)
+        result[f'{bucket}_points'] = len(response.json()['periods'])
+    not_modified, _ = timed(lambda: client.get(f'/api/budgets/{budget.pk}/reports/', {'bucket': 'month'},
+                                               HTTP_IF_NONE_MATCH=response['ETag'], **headers), repeat=warm)
+    result['not_modified_ms'] = round(not_modified * 1000, 3)
+
+    Transaction.objects.create(budget=budget, category_id=category_ids[0], kind=Transaction.EXPENSE,
+                               amount=Decimal('12.34'), date=today)
+    after_write, response = timed(get, repeat=1)
+    result['after_write_ms'] = round(after_write * 1000, 3)
+
+    totals = Transaction.objects.filter(budget=budget).aggregate(
+        income=Sum('amount', filter=Q(kind=Transaction.INCOME)),
+        expense=Sum('amount', filter=Q(kind=Transaction.EXPENSE)),
+    )
+    # Quantized, SQLite sums decimals as floats
+    expected = ((totals['income'] or 0) - (totals['expense'] or 0)).quantize(Decimal('0.01'))
+    result['consistent'] = Decimal(response.json()['balance'][-1]) == expected
+    return result
@@ -0,0 +1,8 @@
+from django.conf import settings
+
+from apps.common.cache import VersionedCache
+
+# Report snapshots per budget and their per-month day segments (see apps.budgets.reports),
+# invalidated from rollups whenever a write changes a month's totals
+report_cache = VersionedCache('budgets:report', timeout=settings.REPORT_CACHE_TIMEOUT)
+day_cache = VersionedCache('budgets:report:days', timeout=settings.REPORT_CACHE_TIMEOUT)
@@ -0,0 +1,77 @@
+"""
+Live changes of shared budgets, published on one apps.common.pubsub channel per budget and
+streamed to its members by ``GET /api/budgets/<id>/events/``.
+
+Events are compact (what changed, its id and the few fields a client needs to decide what to
+reload), so NOTIFY payloads stay small and clients refetch from the REST API. Writes of many
+rows publish in a ``coalesced()`` block, one event per budget instead of one per row.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS
+
+from apps.common import pubsub
+
+SAVED = 'saved'
+DELETED = 'deleted'
+IMPORTED = 'imported'
+# Several rows at once, e.g. a batch write: clients reload the budget's data
+BATCH = 'batch'
+
+# Events held back by the coalesced() block of the thread (greenlet under gevent)
+_held = threading.local()
+
+
+def channel(budget_id):
+    return f'budget:{budget_id}'
+
+
+def changed(budget_id, kind, op, pk=None, using=None, **fields):
+    """
+    Publishes a change of ``kind`` (``budget``, ``membership``, ``category``, ``transaction``)
+    once the current transaction commits.
+    """
+    message = {'type': kind, 'op': op, 'budget': budget_id, 'id': pk}
+    message.update(fields)
+    held = getattr(_held, 'messages', None)
+    # Streams close on the events that end access, those go out as they are
+    if held is None or (op == DELETED and kind in ('budget', 'membership')):
+        pubsub.publish(channel(budget_id), message, using=using or DEFAULT_DB_ALIAS)
+    else:
+        held.setdefault((using or DEFAULT_DB_ALIAS, budget_id), []).append(message)
+
+
+@contextmanager
+def coalesced():
+    """
+    Holds back the events published in the block and, if it exits without an error, publishes
+    one per budget: the event itself if the budget got a single one, else a ``batch`` event with
+    their ``count``. Nested blocks publish with the outermost one.
+    """
+    if getattr(_held, 'messages', None) is not None:
+        yield
+        return
+    _held.messages = {}
+    try:
+        yield
+        held = _held.messages
+    finally:
+        _held.messages = None
+    for (using, budget_id), messages in held.items():
+        if len(messages) == 1:
+            message = messages[0]
+        else:
+            kinds = {message['type'] for message in messages}
+            message = {'type': kinds.pop() if len(kinds) == 1 else 'budget', 'op': BATCH, 'budget': budget_id,
+                       'id': None, 'count': sum(message.get('count', 1) for message in messages)}
+        pubsub.publish(channel(budget_id), message, using=using)
+
+
+def ends_access(message, user_id):
+    """
+    Whether the event takes the budget away from the user: it's deleted or the user left it.
+    """
+    if message['op'] != DELETED:
+        return False
+    return message['type'] == 'budget' or (message['type'] == 'membership' and message.get('user') == user_id)
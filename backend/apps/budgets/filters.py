@@ -0,0 +1,31 @@
+from datetime import date
+from decimal import Decimal
+
+from apps.budgets.models import Transaction
+from apps.common.filters import Filter, FilterSet, InFilter, SearchFilter
+
+
+def parse_amount(value):
+    amount = Decimal(value)
+    if not amount.is_finite():
+        raise ValueError(value)
+    return amount
+
+
+class TransactionFilterSet(FilterSet):
+    """
+    Every predicate has an index (see Transaction.Meta and signals.create_trigram_index):
+    budget and dates use (budget, date, id), categories (category, date, id), amounts
+    (budget, amount), income the partial (budget, date, id) WHERE kind = 'income' index and
+    search a trigram index. Queries are always scoped to the user's budgets as well.
+    """
+    budget = Filter('budget_id', parse=int)
+    date_from = Filter('date', lookup='gte', parse=date.fromisoformat)
+    date_to = Filter('date', lookup='lte', parse=date.fromisoformat)
+    category = InFilter('category_id', parse=int)
+    amount_min = Filter('amount', lookup='gte', parse=parse_amount)
+    amount_max = Filter('amount', lookup='lte', parse=parse_amount)
+    kind = Filter('kind', choices=[Transaction.INCOME, Transaction.EXPENSE])
+    search = SearchFilter('description')
+
+    ranges = [('date_from', 'date_to'), ('amount_min', 'amount_max')]
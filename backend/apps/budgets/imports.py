@@ -0,0 +1,265 @@
+"""
+Bank statement import.
+
+Statements are parsed as a stream (CSV rows or OFX ``<STMTTRN>`` blocks), validated and
+resolved to categories in batches, and loaded with COPY (bulk_create off Postgres) into a
+staging table. One ``INSERT ... SELECT ... WHERE NOT EXISTS`` then merges the staged rows
+into Transaction, skipping lines imported before (the budgets_tx_import_uniq index turns away
+any that slip through), and the monthly summaries get the totals of the rows it returns, so
+transactions written meanwhile by others are not counted twice. Memory use depends on the
+batch size, not on the statement size.
+"""
+import csv
+import hashlib
+import io
+import re
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from uuid import uuid4
+
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from apps.budgets import events, rollups
+from apps.budgets.models import Budget, Category, StagedTransaction, Transaction
+from apps.common.bulk import batched, copy_rows
+
+FORMATS = ['csv', 'ofx']
+DEFAULT_CATEGORY = 'Imported'
+MAX_REPORTED_ERRORS = 100
+MAX_AMOUNT = Decimal('9999999999.99')
+DATE_FORMATS = ['%d.%m.%Y', '%Y%m%d']
+OFX_TAG = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+STAGED_FIELDS = ['batch', 'row', 'category_id', 'kind', 'amount', 'date', 'description', 'fingerprint']
+
+
+def detect_format(name):
+    extension = name.rsplit('.', 1)[-1].lower() if '.' in name else ''
+    return extension if extension in FORMATS else 'csv'
+
+
+def text_stream(binary):
+    return io.TextIOWrapper(binary, encoding='utf-8-sig', errors='replace', newline='')
+
+
+def parse_csv(stream):
+    """
+    Yields ``(row, record)`` for a CSV with a header row. Recognised columns (any letter case):
+    date, amount, description, category and kind. Without a kind column, negative amounts are expenses.
+    """
+    reader = csv.reader(stream)
+    try:
+        header = [column.strip().lower() for column in next(reader)]
+    except StopIteration:
+        return
+    for row, values in enumerate(reader, start=2):
+        if values:
+            yield row, dict(zip(header, values))
+
+
+def parse_ofx(stream, chunk_size=64 * 1024):
+    """
+    Yields ``(row, record)`` for every ``<STMTTRN>`` of an OFX statement (SGML or XML flavour),
+    reading ``chunk_size`` characters at a time. ``row`` is the transaction's position.
+    """
+    buffer, record, row = '', None, 0
+    while True:
+        chunk = stream.read(chunk_size)
+        buffer += chunk
+        # Keep an unfinished tag for the next chunk
+        end = len(buffer) if not chunk else buffer.rfind('<')
+        for match in OFX_TAG.finditer(buffer, 0, max(end, 0)):
+            closing, tag, value = match.group(1), match.group(2).upper(), match.group(3).strip()
+            if tag == 'STMTTRN':
+                if closing and record is not None:
+                    row += 1
+                    yield row, {
+                        'date': record.get('DTPOSTED', '')[:8],
+                        'amount': record.get('TRNAMT', ''),
+                        'description': ' '.join(filter(None, [record.get('NAME'), record.get('MEMO')])),
+                        'fitid': record.get('FITID', ''),
+                    }
+                record = None if closing else {}
+            elif record is not None and not closing:
+                record[tag] = value
+        if not chunk:
+            return
+        buffer = buffer[max(end, 0):]
+
+
+def parse_date(value):
+    value = value.strip()
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        pass
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            pass
+    raise ValueError(f'Invalid date "{value}"')
+
+
+def parse_amount(value):
+    try:
+        amount = Decimal(value.strip().replace(' ', '').replace(',', '.')).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError(f'Invalid amount "{value}"')
+    if not amount or abs(amount) > MAX_AMOUNT:
+        raise ValueError(f'Invalid amount "{value}"')
+    return amount
+
+
+def validate(record):
+    """
+    ``(kind, amount, date, description, category name, fingerprint)`` for a parsed record,
+    raises ValueError when it can't be imported.
+    """
+    amount = parse_amount(record.get('amount') or '')
+    day = parse_date(record.get('date') or '')
+    description = (record.get('description') or '').strip()[:255]
+    kind = (record.get('kind') or '').strip().lower()
+    if kind:
+        if kind not in (Transaction.INCOME, Transaction.EXPENSE):
+            raise ValueError(f'Invalid kind "{kind}"')
+    else:
+        kind = Transaction.INCOME if amount > 0 else Transaction.EXPENSE
+    if record.get('fitid'):
+        fingerprint = 'ofx:' + record['fitid'][:60]
+    else:
+        fingerprint = hashlib.sha1(f'{day}|{kind}|{amount}|{description}'.encode('utf-8')).hexdigest()
+    category = (record.get('category') or '').strip()[:100] or DEFAULT_CATEGORY
+    return kind, abs(amount), day, description, category, fingerprint
+
+
+class StatementImport:
+    """
+    One import of ``records`` (from parse_csv or parse_ofx) into ``budget``.
+    After ``run()``: ``imported``, ``duplicates``, ``invalid`` and the first errors.
+    """
+
+    def __init__(self, budget, user_id=None, batch_size=10000):
+        self.budget = budget
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.batch = uuid4()
+        self.categories = {}
+        self.staged = self.imported = self.duplicates = self.invalid = 0
+        self.errors = []
+
+    def run(self, records):
+        using = router.db_for_write(Transaction)
+        connection = connections[using]
+        with transaction.atomic(using=using):
+            # Serializes imports into the same budget, so the duplicate check sees earlier ones
+            Budget.objects.using(using).select_for_update().filter(pk=self.budget.pk).first()
+            self.categories = dict(Category.objects.using(using).filter(budget=self.budget)
+                                   .values_list('name', 'id'))
+            table = self.create_staging_table(connection)
+            self.staged = copy_rows(StagedTransaction, STAGED_FIELDS, self.staged_rows(records),
+                                    batch_size=self.batch_size, table=table, using=using)
+            self.imported = self.merge(connection, table)
+            self.duplicates = self.staged - self.imported
+            if self.imported:
+                events.changed(self.budget.pk, 'transaction', events.IMPORTED, using=using, count=self.imported)
+            if connection.vendor != 'postgresql':
+                StagedTransaction.objects.using(using).filter(batch=self.batch).delete()
+        return self
+
+    def create_staging_table(self, connection):
+        if connection.vendor != 'postgresql':
+            return None
+        table = f'budgets_import_{self.batch.hex}'
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE {table} '
+                f'(LIKE {StagedTransaction._meta.db_table} INCLUDING DEFAULTS) ON COMMIT DROP'
+            )
+        return table
+
+    def staged_rows(self, records):
+        for batch in batched(records, self.batch_size):
+            valid = []
+            for row, record in batch:
+                try:
+                    valid.append((row, validate(record)))
+                except ValueError as error:
+                    self.invalid += 1
+                    if len(self.errors) < MAX_REPORTED_ERRORS:
+                        self.errors.append({'row': row, 'error': str(error)})
+            self.resolve_categories({values[4] for _, values in valid})
+            for row, (kind, amount, day, description, category, fingerprint) in valid:
+                yield (self.batch, row, self.categories[category], kind, amount, day, description, fingerprint)
+
+    def resolve_categories(self, names):
+        missing = names - set(self.categories)
+        if not missing:
+            return
+        Category.objects.bulk_create([Category(budget=self.budget, name=name) for name in missing],
+                                     ignore_conflicts=True)
+        self.categories.update(Category.objects.filter(budget=self.budget, name__in=missing)
+                               .values_list('name', 'id'))
+
+    def merge(self, connection, table):
+        quote = connection.ops.quote_name
+        target = quote(Transaction._meta.db_table)
+        source = quote(table or StagedTransaction._meta.db_table)
+        # Identical lines are told apart by their occurrence number in the statement
+        insert = (
+            f'INSERT INTO {target} (budget_id, category_id, kind, amount, {quote("date")}, description, '
+            f'created_by_id, created_at, import_key, import_seq) '
+            f'SELECT %s, s.category_id, s.kind, s.amount, s.{quote("date")}, s.description, %s, %s, '
+            f's.fingerprint, s.seq '
+            f'FROM (SELECT category_id, kind, amount, {quote("date")}, description, fingerprint, '
+            f'ROW_NUMBER() OVER (PARTITION BY fingerprint ORDER BY {quote("row")}) AS seq '
+            f'FROM {source} WHERE batch = %s) s '
+            f'WHERE NOT EXISTS (SELECT 1 FROM {target} t WHERE t.budget_id = %s '
+            f'AND t.import_key = s.fingerprint AND t.import_seq = s.seq) '
+            f'ON CONFLICT DO NOTHING '
+            f'RETURNING category_id, kind, amount, {quote("date")}'
+        )
+        params = [self.budget.pk, self.user_id, timezone.now(),
+                  StagedTransaction._meta.get_field('batch').get_db_prep_value(self.batch, connection),
+                  self.budget.pk]
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # The inserted rows are summed up where they are, only their totals come back
+                cursor.execute(
+                    f'WITH inserted AS ({insert}) '
+                    f'SELECT category_id, date_trunc(%s, {quote("date")})::date, '
+                    f'COALESCE(SUM(amount) FILTER (WHERE kind = %s), 0), '
+                    f'COALESCE(SUM(amount) FILTER (WHERE kind = %s), 0), COUNT(*) '
+                    f'FROM inserted GROUP BY 1, 2',
+                    params + ['month', Transaction.INCOME, Transaction.EXPENSE],
+                )
+                totals = cursor.fetchall()
+            else:
+                cursor.execute(insert, params)
+                rows = (row for chunk in iter(lambda: cursor.fetchmany(self.batch_size), []) for row in chunk)
+                inserted = rollups.deltas(
+                    Transaction(budget_id=self.budget.pk, category_id=category_id, kind=kind, amount=amount,
+                                date=day if isinstance(day, date) else date.fromisoformat(day))
+                    for category_id, kind, amount, day in rows)
+                totals = [(category_id, month, *delta) for (_, category_id, month), delta in inserted.items()]
+        rollups.apply_totals({'budget_id': self.budget.pk, 'category_id': category_id, 'month': month,
+                              'income': income, 'expense': expense, 'count': count}
+                             for category_id, month, income, expense, count in totals)
+        return sum(count for *_, count in totals)
+
+    def report(self):
+        return {
+            'imported': self.imported,
+            'duplicates': self.duplicates,
+            'invalid': self.invalid,
+            'errors': self.errors,
+        }
+
+
+def import_statement(budget, binary, statement_format, user_id=None, batch_size=10000):
+    """
+    Imports a statement read from the binary file object ``binary`` into ``budget``.
+    """
+    stream = text_stream(binary)
+    records = parse_ofx(stream) if statement_format == 'ofx' else parse_csv(stream)
+    return StatementImport(budget, user_id=user_id, batch_size=batch_size).run(records)
@@ -0,0 +1,65 @@
+import gzip
+import os
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+from django.utils import timezone
+
+from apps.budgets import partitions
+from apps.budgets.models import Transaction, TransactionArchive
+from apps.common.bulk import copy_to
+
+
+class Command(BaseCommand):
+    help = ('Moves the monthly transaction partitions older than the retention period to gzipped CSV files '
+            '(Postgres): each is detached, copied out and dropped. Monthly summaries are kept. '
+            'To restore one, COPY the file back into the transactions table and delete its TransactionArchive')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=settings.TRANSACTION_RETENTION_MONTHS,
+                            help='Months to keep before the current one (default: TRANSACTION_RETENTION_MONTHS)')
+        parser.add_argument('--dir', default=settings.TRANSACTION_ARCHIVE_DIR,
+                            help='Archive directory (default: TRANSACTION_ARCHIVE_DIR)')
+        parser.add_argument('--dry-run', action='store_true', help='List the partitions that would be archived')
+
+    def handle(self, *args, **options):
+        connection = connections[router.db_for_write(Transaction)]
+        if not partitions.is_partitioned(connection):
+            raise CommandError('The transactions table is not partitioned (PostgreSQL only, created by migrate)')
+        cutoff = partitions.add_months(timezone.localdate().replace(day=1), -max(options['months'], 0))
+        # Tables left detached by an interrupted run first, they are no longer visible to the API
+        names = partitions.detached(connection)
+        names += [name for month, name in sorted(partitions.partitions(connection).items()) if month < cutoff]
+        if options['dry_run']:
+            for name in names:
+                self.stdout.write(name)
+            return
+
+        os.makedirs(options['dir'], exist_ok=True)
+        for name in names:
+            if name not in partitions.detached(connection):
+                partitions.detach(connection, name)
+            path, rows = self.dump(connection, name, options['dir'])
+            with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+                TransactionArchive.objects.using(connection.alias).create(
+                    month=partitions.month_of(name), path=path, rows=rows)
+                cursor.execute(f'DROP TABLE {connection.ops.quote_name(name)}')
+            self.stdout.write(f'{name}: {rows} rows archived to {path}')
+        if not names:
+            self.stdout.write(f'Nothing to archive before {cutoff:%Y-%m}')
+
+    def dump(self, connection, name, directory):
+        quote = connection.ops.quote_name
+        path = os.path.join(directory, f'{name}-{timezone.now():%Y%m%d%H%M%S}.csv.gz')
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {quote(name)}')
+            rows, = cursor.fetchone()
+            # Written under a temporary name, a file with the final name is always complete
+            with open(path + '.part', 'wb') as f:
+                with gzip.GzipFile(filename=os.path.basename(path)[:-3], mode='wb', compresslevel=6,
+                                   fileobj=f) as gz:
+                    copy_to(connection, name, gz)
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(path + '.part', path)
+        return path, rows
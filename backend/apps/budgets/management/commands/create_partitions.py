@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router
+
+from apps.budgets import partitions
+from apps.budgets.models import Transaction
+
+
+class Command(BaseCommand):
+    help = ('Creates the monthly transaction partitions for the coming months and moves rows out of '
+            'the default partition (Postgres). With --interval it repeats, as the partitions service '
+            'runs it')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--months', type=int, default=3, help='Months ahead of the current one (default: 3)')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Run again every INTERVAL seconds instead of exiting')
+
+    def handle(self, *args, **options):
+        connection = connections[router.db_for_write(Transaction)]
+        if not partitions.is_partitioned(connection):
+            raise CommandError('The transactions table is not partitioned (PostgreSQL only, created by migrate)')
+        try:
+            while True:
+                created = partitions.create_partitions(connection, months=options['months'])
+                for name in created:
+                    self.stdout.write(f'Created {name}')
+                if not created:
+                    self.stdout.write('Partitions up to date')
+                if options['interval'] is None:
+                    break
+                # Not held between runs
+                connection.close()
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
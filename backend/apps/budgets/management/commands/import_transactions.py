@@ -0,0 +1,29 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.budgets import imports
+from apps.budgets.models import Budget
+
+
+class Command(BaseCommand):
+    help = 'Imports a CSV or OFX bank statement into a budget, skipping lines imported before'
+
+    def add_arguments(self, parser):
+        parser.add_argument('budget', type=int, help='Budget id')
+        parser.add_argument('path', help='Statement file')
+        parser.add_argument('--format', choices=imports.FORMATS, help='Default: from the file extension')
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        budget = Budget.objects.filter(pk=options['budget']).first()
+        if budget is None:
+            raise CommandError(f'Budget {options["budget"]} does not exist')
+
+        started = time.perf_counter()
+        with open(options['path'], 'rb') as f:
+            result = imports.import_statement(budget, f, options['format'] or imports.detect_format(options['path']),
+                                              user_id=budget.owner_id, batch_size=options['batch_size'])
+        self.stderr.write(f'{result.staged} rows in {time.perf_counter() - started:.1f}s')
+        self.stdout.write(json.dumps(result.report(), indent=2))
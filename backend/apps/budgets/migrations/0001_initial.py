@@ -0,0 +1,117 @@
+# Generated by Django 3.2.25 on 2026-10-18 21:52
+
+from decimal import Decimal
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Budget',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Name')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created at')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated at')),
+            ],
+            options={
+                'verbose_name': 'Budget',
+                'verbose_name_plural': 'Budgets',
+            },
+        ),
+        migrations.CreateModel(
+            name='Category',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='Name')),
+            ],
+            options={
+                'verbose_name': 'Category',
+                'verbose_name_plural': 'Categories',
+            },
+        ),
+        migrations.CreateModel(
+            name='Membership',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[['owner', 'Owner'], ['editor', 'Editor'], ['viewer', 'Viewer']], default='viewer', max_length=6, verbose_name='Role')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created at')),
+            ],
+            options={
+                'verbose_name': 'Membership',
+                'verbose_name_plural': 'Memberships',
+            },
+        ),
+        migrations.CreateModel(
+            name='MonthlySummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='Month')),
+                ('income', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Income')),
+                ('expense', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Expense')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Transactions')),
+            ],
+            options={
+                'verbose_name': 'Monthly summary',
+                'verbose_name_plural': 'Monthly summaries',
+            },
+        ),
+        migrations.CreateModel(
+            name='StagedTransaction',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch', models.UUIDField(verbose_name='Batch')),
+                ('row', models.PositiveIntegerField(verbose_name='Row')),
+                ('kind', models.CharField(choices=[['income', 'Income'], ['expense', 'Expense']], max_length=7, verbose_name='Kind')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Amount')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('description', models.CharField(blank=True, max_length=255, verbose_name='Description')),
+                ('fingerprint', models.CharField(max_length=64, verbose_name='Fingerprint')),
+            ],
+            options={
+                'verbose_name': 'Staged transaction',
+                'verbose_name_plural': 'Staged transactions',
+            },
+        ),
+        migrations.CreateModel(
+            name='TransactionArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='Month')),
+                ('path', models.CharField(max_length=500, verbose_name='File')),
+                ('rows', models.PositiveIntegerField(verbose_name='Rows')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='Archived at')),
+            ],
+            options={
+                'verbose_name': 'Transaction archive',
+                'verbose_name_plural': 'Transaction archives',
+            },
+        ),
+        migrations.CreateModel(
+            name='Transaction',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[['income', 'Income'], ['expense', 'Expense']], max_length=7, verbose_name='Kind')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12, validators=[django.core.validators.MinValueValidator(Decimal('0.01'))], verbose_name='Amount')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('description', models.CharField(blank=True, max_length=255, verbose_name='Description')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created at')),
+                ('import_key', models.CharField(blank=True, editable=False, max_length=64, null=True, verbose_name='Import key')),
+                ('import_seq', models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Import sequence')),
+                ('budget', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to='budgets.budget', verbose_name='Budget')),
+                ('category', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='transactions', to='budgets.category', verbose_name='Category')),
+            ],
+            options={
+                'verbose_name': 'Transaction',
+                'verbose_name_plural': 'Transactions',
+            },
+        ),
+    ]
@@ -0,0 +1,102 @@
+# Generated by Django 3.2.25 on 2026-10-18 21:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('budgets', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='created_by',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Created by'),
+        ),
+        migrations.AddField(
+            model_name='stagedtransaction',
+            name='category',
+            field=models.ForeignKey(db_constraint=False, db_index=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='budgets.category', verbose_name='Category'),
+        ),
+        migrations.AddField(
+            model_name='monthlysummary',
+            name='budget',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='summaries', to='budgets.budget', verbose_name='Budget'),
+        ),
+        migrations.AddField(
+            model_name='monthlysummary',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='budgets.category', verbose_name='Category'),
+        ),
+        migrations.AddField(
+            model_name='membership',
+            name='budget',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='budgets.budget', verbose_name='Budget'),
+        ),
+        migrations.AddField(
+            model_name='membership',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to=settings.AUTH_USER_MODEL, verbose_name='User'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='budget',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='categories', to='budgets.budget', verbose_name='Budget'),
+        ),
+        migrations.AddField(
+            model_name='budget',
+            name='owner',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='owned_budgets', to=settings.AUTH_USER_MODEL, verbose_name='Owner'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['budget', 'date', 'id'], name='budgets_tx_budget_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['category', 'date', 'id'], name='budgets_tx_category_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['budget', 'amount'], name='budgets_tx_budget_amount_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('kind', 'income')), fields=['budget', 'date', 'id'], name='budgets_tx_income_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='transaction',
+            constraint=models.UniqueConstraint(condition=models.Q(('import_key__isnull', False)), fields=('budget', 'import_key', 'import_seq', 'date'), name='budgets_tx_import_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='stagedtransaction',
+            index=models.Index(fields=['batch', 'fingerprint', 'row'], name='budgets_staged_batch_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlysummary',
+            constraint=models.UniqueConstraint(fields=('budget', 'category', 'month'), name='budgets_summary_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='membership',
+            index=models.Index(fields=['user'], include=('budget', 'role'), name='budgets_membership_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='membership',
+            index=models.Index(fields=['budget'], include=('user', 'role'), name='budgets_membership_budget_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='membership',
+            constraint=models.UniqueConstraint(fields=('user', 'budget'), name='budgets_membership_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='category',
+            constraint=models.UniqueConstraint(fields=('budget', 'name'), name='budgets_category_name_uniq'),
+        ),
+    ]
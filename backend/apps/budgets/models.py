@@ -0,0 +1,268 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.validators import MinValueValidator
+from django.db import models, transaction
+from django.utils import timezone
+
+from apps.budgets import events, reports, rollups
+
+
+class Budget(models.Model):
+    name = models.CharField(verbose_name='Name', max_length=100)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, verbose_name='Owner', on_delete=models.CASCADE,
+                              related_name='owned_budgets')
+    created_at = models.DateTimeField(verbose_name='Created at', auto_now_add=True)
+    # Also moved by membership changes, which change the requester's role
+    updated_at = models.DateTimeField(verbose_name='Updated at', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Budget'
+        verbose_name_plural = 'Budgets'
+
+    def __str__(self):
+        return self.name
+
+    def save(self, *args, **kwargs):
+        # Access goes through memberships only, the owner gets one with the budget
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                Membership.objects.create(user_id=self.owner_id, budget=self, role=Membership.OWNER)
+            events.changed(self.pk, 'budget', events.SAVED, self.pk, using=self._state.db)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            events.changed(self.pk, 'budget', events.DELETED, self.pk, using=self._state.db)
+            return super().delete(*args, **kwargs)
+
+
+class MembershipManager(models.Manager):
+
+    def budget_ids(self, user_id):
+        """
+        Subquery of the ids of budgets shared with the user, for ``budget_id__in=`` semi-joins.
+        """
+        return self.filter(user_id=user_id).values('budget_id')
+
+
+class Membership(models.Model):
+    OWNER = 'owner'
+    EDITOR = 'editor'
+    VIEWER = 'viewer'
+    ROLE_CHOICES = [
+        [OWNER, 'Owner'],
+        [EDITOR, 'Editor'],
+        [VIEWER, 'Viewer'],
+    ]
+    WRITE_ROLES = [OWNER, EDITOR]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, verbose_name='User', on_delete=models.CASCADE,
+                             related_name='memberships', db_index=False)
+    budget = models.ForeignKey(Budget, verbose_name='Budget', on_delete=models.CASCADE, related_name='memberships',
+                               db_index=False)
+    role = models.CharField(verbose_name='Role', max_length=6, choices=ROLE_CHOICES, default=VIEWER)
+    created_at = models.DateTimeField(verbose_name='Created at', auto_now_add=True)
+
+    objects = MembershipManager()
+
+    class Meta:
+        verbose_name = 'Membership'
+        verbose_name_plural = 'Memberships'
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'budget'], name='budgets_membership_uniq'),
+        ]
+        # Covering (Postgres): a user's budgets and roles, and a budget's members, are read from the index alone
+        indexes = [
+            models.Index(fields=['user'], include=['budget', 'role'], name='budgets_membership_user_idx'),
+            models.Index(fields=['budget'], include=['user', 'role'], name='budgets_membership_budget_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} in {self.budget_id} ({self.role})'
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.touch_budget()
+            self.publish(events.SAVED)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            self.touch_budget()
+            self.publish(events.DELETED)
+            return super().delete(*args, **kwargs)
+
+    def publish(self, op):
+        events.changed(self.budget_id, 'membership', op, self.pk, using=self._state.db,
+                       user=self.user_id, role=self.role)
+
+    def touch_budget(self):
+        Budget.objects.filter(pk=self.budget_id).update(updated_at=timezone.now())
+
+
+class Category(models.Model):
+    budget = models.ForeignKey(Budget, verbose_name='Budget', on_delete=models.CASCADE, related_name='categories')
+    name = models.CharField(verbose_name='Name', max_length=100)
+
+    class Meta:
+        verbose_name = 'Category'
+        verbose_name_plural = 'Categories'
+        constraints = [
+            models.UniqueConstraint(fields=['budget', 'name'], name='budgets_category_name_uniq'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            events.changed(self.budget_id, 'category', events.SAVED, self.pk, using=self._state.db)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            events.changed(self.budget_id, 'category', events.DELETED, self.pk, using=self._state.db)
+            # Its transactions and summaries go with it by cascade, bypassing rollups
+            months = MonthlySummary.objects.filter(category=self).values_list('month', flat=True)
+            reports.invalidate(((self.budget_id, month) for month in months), using=self._state.db)
+            return super().delete(*args, **kwargs)
+
+
+class Transaction(models.Model):
+    INCOME = 'income'
+    EXPENSE = 'expense'
+    KIND_CHOICES = [
+        [INCOME, 'Income'],
+        [EXPENSE, 'Expense'],
+    ]
+
+    budget = models.ForeignKey(Budget, verbose_name='Budget', on_delete=models.CASCADE, related_name='transactions',
+                               db_index=False)
+    category = models.ForeignKey(Category, verbose_name='Category', on_delete=models.CASCADE,
+                                 related_name='transactions', db_index=False)
+    kind = models.CharField(verbose_name='Kind', max_length=7, choices=KIND_CHOICES)
+    amount = models.DecimalField(verbose_name='Amount', max_digits=12, decimal_places=2,
+                                 validators=[MinValueValidator(Decimal('0.01'))])
+    date = models.DateField(verbose_name='Date')
+    description = models.CharField(verbose_name='Description', max_length=255, blank=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, verbose_name='Created by', null=True, blank=True,
+                                   on_delete=models.SET_NULL, related_name='+')
+    created_at = models.DateTimeField(verbose_name='Created at', auto_now_add=True)
+    # Set for imported rows (see apps.budgets.imports): the statement line fingerprint and its
+    # occurrence number among identical lines, so importing the same statement again adds nothing
+    import_key = models.CharField(verbose_name='Import key', max_length=64, null=True, blank=True, editable=False)
+    import_seq = models.PositiveIntegerField(verbose_name='Import sequence', null=True, blank=True, editable=False)
+
+    class Meta:
+        verbose_name = 'Transaction'
+        verbose_name_plural = 'Transactions'
+        # Partitioned by month on Postgres, see apps.budgets.partitions
+        # One per TransactionFilterSet filter, the text search index is added by signals.create_trigram_index
+        indexes = [
+            models.Index(fields=['budget', 'date', 'id'], name='budgets_tx_budget_date_idx'),
+            models.Index(fields=['category', 'date', 'id'], name='budgets_tx_category_date_idx'),
+            models.Index(fields=['budget', 'amount'], name='budgets_tx_budget_amount_idx'),
+            # Income is the minority, expenses are served well enough by budgets_tx_budget_date_idx
+            models.Index(fields=['budget', 'date', 'id'], name='budgets_tx_income_idx',
+                         condition=models.Q(kind='income')),
+        ]
+        constraints = [
+            # Backs the import duplicate check; the date is part of every unique index of the partitioned table
+            models.UniqueConstraint(fields=['budget', 'import_key', 'import_seq', 'date'],
+                                    name='budgets_tx_import_uniq', condition=models.Q(import_key__isnull=False)),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.amount} ({self.date})'
+
+    def save(self, *args, **kwargs):
+        # The monthly summary is updated in the same database transaction as the row itself
+        with transaction.atomic():
+            previous = self._stored()
+            super().save(*args, **kwargs)
+            rollups.replace([previous] if previous else [], [self])
+            self.publish(events.SAVED)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = self._stored()
+            if previous:
+                rollups.apply([previous], sign=-1)
+            self.publish(events.DELETED)
+            return super().delete(*args, **kwargs)
+
+    def publish(self, op):
+        # The date tells clients which month's totals to reload
+        events.changed(self.budget_id, 'transaction', op, self.pk, using=self._state.db, date=str(self.date))
+
+    def _stored(self):
+        # The version of the row the summaries count, locked so a concurrent update can't retract it twice
+        if self.pk is None:
+            return None
+        return Transaction.objects.select_for_update().filter(pk=self.pk).first()
+
+
+class MonthlySummary(models.Model):
+    """
+    Pre-aggregated transactions per (budget, category, month), maintained by apps.budgets.rollups
+    on every write and rebuilt from scratch by the rebuild_rollups command.
+    """
+    budget = models.ForeignKey(Budget, verbose_name='Budget', on_delete=models.CASCADE, related_name='summaries')
+    category = models.ForeignKey(Category, verbose_name='Category', on_delete=models.CASCADE, related_name='+')
+    month = models.DateField(verbose_name='Month')
+    income = models.DecimalField(verbose_name='Income', max_digits=14, decimal_places=2, default=0)
+    expense = models.DecimalField(verbose_name='Expense', max_digits=14, decimal_places=2, default=0)
+    count = models.PositiveIntegerField(verbose_name='Transactions', default=0)
+
+    class Meta:
+        verbose_name = 'Monthly summary'
+        verbose_name_plural = 'Monthly summaries'
+        constraints = [
+            models.UniqueConstraint(fields=['budget', 'category', 'month'], name='budgets_summary_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.budget_id}/{self.category_id} {self.month:%Y-%m}'
+
+
+class TransactionArchive(models.Model):
+    """
+    A month of transactions moved off the database by the archive_transactions command
+    (Postgres): the detached partition's rows, as gzipped CSV. The month's summaries are kept.
+    """
+    month = models.DateField(verbose_name='Month')
+    path = models.CharField(verbose_name='File', max_length=500)
+    rows = models.PositiveIntegerField(verbose_name='Rows')
+    archived_at = models.DateTimeField(verbose_name='Archived at', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Transaction archive'
+        verbose_name_plural = 'Transaction archives'
+
+    def __str__(self):
+        return f'{self.month:%Y-%m} ({self.rows} rows)'
+
+
+class StagedTransaction(models.Model):
+    """
+    Parsed statement rows on their way into Transaction. On Postgres the rows are COPied into a
+    temporary table with the same columns and this table stays empty.
+    """
+    batch = models.UUIDField(verbose_name='Batch')
+    row = models.PositiveIntegerField(verbose_name='Row')
+    category = models.ForeignKey(Category, verbose_name='Category', on_delete=models.DO_NOTHING,
+                                 db_constraint=False, db_index=False, related_name='+')
+    kind = models.CharField(verbose_name='Kind', max_length=7, choices=Transaction.KIND_CHOICES)
+    amount = models.DecimalField(verbose_name='Amount', max_digits=12, decimal_places=2)
+    date = models.DateField(verbose_name='Date')
+    description = models.CharField(verbose_name='Description', max_length=255, blank=True)
+    fingerprint = models.CharField(verbose_name='Fingerprint', max_length=64)
+
+    class Meta:
+        verbose_name = 'Staged transaction'
+        verbose_name_plural = 'Staged transactions'
+        indexes = [
+            models.Index(fields=['batch', 'fingerprint', 'row'], name='budgets_staged_batch_idx'),
+        ]
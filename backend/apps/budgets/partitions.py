@@ -0,0 +1,196 @@
+"""
+Monthly range partitions of the transactions table (Postgres).
+
+Django creates budgets_transaction as a plain table; the first post_migrate (see signals)
+rebuilds it as ``PARTITION BY RANGE (date)`` with one partition per month plus a default
+partition, and moves the rows over. Its primary key becomes ``(id, date)``, as Postgres wants
+the partition key in every unique constraint; ``id`` stays unique through its sequence and
+remains the model's primary key. Queries bounded by date only read the partitions of their
+months, old months can be detached whole (see the archive_transactions command) and each
+partition keeps indexes the size of a month.
+
+Rows dated outside every monthly partition land in the default one, create_partitions moves
+them to partitions of their own. On other databases the table stays as Django creates it and
+these functions do nothing.
+"""
+import re
+from datetime import date
+
+from django.apps import apps
+from django.db import connections, transaction
+from django.utils import timezone
+
+NAME_RE = re.compile(r'_p(\d{4})(\d{2})$')
+
+
+def table_name():
+    return apps.get_model('budgets', 'Transaction')._meta.db_table
+
+
+def partition_name(month):
+    return f'{table_name()}_p{month:%Y%m}'
+
+
+def default_name():
+    return f'{table_name()}_default'
+
+
+def month_of(name):
+    """
+    First day of the month a partition name stands for, None for other names.
+    """
+    match = NAME_RE.search(name)
+    return date(int(match[1]), int(match[2]), 1) if match else None
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def is_partitioned(connection):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table_name()])
+        row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def partitions(connection):
+    """
+    ``{month: name}`` of the attached monthly partitions.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = %s::regclass', [table_name()]
+        )
+        names = [name for name, in cursor.fetchall()]
+    return {month_of(name): name for name in names if month_of(name)}
+
+
+def detached(connection):
+    """
+    Names of monthly partition tables no longer attached, i.e. archivals that didn't finish.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relname FROM pg_class WHERE relkind = 'r' AND relname LIKE %s AND NOT relispartition "
+            "AND relnamespace = 'public'::regnamespace", [table_name().replace('_', r'\_') + r'\_p%']
+        )
+        return sorted(name for name, in cursor.fetchall() if month_of(name))
+
+
+def partition(connection):
+    """
+    Rebuilds the plain transactions table as a partitioned one, keeping its rows, columns,
+    defaults, constraints and indexes. Runs in a single transaction holding an exclusive lock.
+    """
+    table = table_name()
+    old = f'{table}_unpartitioned'
+    quote = connection.ops.quote_name
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {quote(table)} RENAME TO {quote(old)}')
+        cursor.execute("SELECT conname FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'p'", [old])
+        primary_key, = cursor.fetchone()
+        cursor.execute(
+            'SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint '
+            "WHERE conrelid = %s::regclass AND contype = 'f'", [old]
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(
+            'SELECT i.relname, pg_get_indexdef(i.oid) FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid '
+            'WHERE x.indrelid = %s::regclass AND NOT x.indisprimary', [old]
+        )
+        indexes = cursor.fetchall()
+        cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [old, 'id'])
+        sequence, = cursor.fetchone()
+        # Index names are unique per schema, the new table takes them over
+        cursor.execute(f'ALTER TABLE {quote(old)} DROP CONSTRAINT {quote(primary_key)}')
+        for name, _ in indexes:
+            cursor.execute(f'DROP INDEX {quote(name)}')
+
+        cursor.execute(
+            f'CREATE TABLE {quote(table)} (LIKE {quote(old)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            f'PARTITION BY RANGE ({quote("date")})'
+        )
+        cursor.execute(f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(primary_key)} '
+                       f'PRIMARY KEY (id, {quote("date")})')
+        for name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} {definition}')
+        for name, definition in indexes:
+            cursor.execute(definition.replace(f' ON public.{old} ', f' ON {quote(table)} ', 1)
+                           .replace(f' ON {old} ', f' ON {quote(table)} ', 1))
+        if sequence:
+            cursor.execute(f'ALTER SEQUENCE {sequence} OWNED BY {quote(table)}.id')
+
+        cursor.execute(f'CREATE TABLE {quote(default_name())} PARTITION OF {quote(table)} DEFAULT')
+        cursor.execute(f'SELECT DISTINCT date_trunc(%s, {quote("date")})::date FROM {quote(old)}', ['month'])
+        for month, in cursor.fetchall():
+            _create(cursor, connection, month)
+        cursor.execute(f'INSERT INTO {quote(table)} SELECT * FROM {quote(old)}')
+        cursor.execute(f'DROP TABLE {quote(old)}')
+
+
+def create_partitions(connection, months=3, today=None):
+    """
+    Partitions for the current month and ``months`` ahead, and for any month with rows in the
+    default partition. Returns the names created.
+    """
+    quote = connection.ops.quote_name
+    first = (today or timezone.localdate()).replace(day=1)
+    existing = partitions(connection)
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT DISTINCT date_trunc(%s, {quote("date")})::date FROM {quote(default_name())}',
+                       ['month'])
+        wanted = {month for month, in cursor.fetchall()}
+    wanted.update(add_months(first, n) for n in range(months + 1))
+    created = []
+    for month in sorted(wanted - set(existing)):
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            created.append(_create(cursor, connection, month))
+    return created
+
+
+def _create(cursor, connection, month):
+    """
+    Creates (or splits out of the default partition) the partition of ``month``.
+    """
+    quote = connection.ops.quote_name
+    table, default, name = table_name(), default_name(), partition_name(month)
+    # As plain literals, which is what partition bounds accept
+    bounds = [month.isoformat(), add_months(month, 1).isoformat()]
+    cursor.execute(f'SELECT 1 FROM {quote(default)} WHERE {quote("date")} >= %s AND {quote("date")} < %s LIMIT 1',
+                   bounds)
+    if cursor.fetchone() is None:
+        cursor.execute(f'CREATE TABLE {quote(name)} PARTITION OF {quote(table)} FOR VALUES FROM (%s) TO (%s)',
+                       bounds)
+        return name
+    # Postgres refuses a partition for rows the default partition holds: they are moved
+    # into the new table first, which is then attached
+    cursor.execute(f'LOCK TABLE {quote(table)} IN SHARE ROW EXCLUSIVE MODE')
+    cursor.execute(f'CREATE TABLE {quote(name)} (LIKE {quote(table)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    cursor.execute(
+        f'WITH moved AS (DELETE FROM {quote(default)} WHERE {quote("date")} >= %s AND {quote("date")} < %s '
+        f'RETURNING *) INSERT INTO {quote(name)} SELECT * FROM moved', bounds
+    )
+    cursor.execute(f'ALTER TABLE {quote(table)} ATTACH PARTITION {quote(name)} FOR VALUES FROM (%s) TO (%s)',
+                   bounds)
+    return name
+
+
+def detach(connection, name):
+    quote = connection.ops.quote_name
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {quote(table_name())} DETACH PARTITION {quote(name)}')
+
+
+def ensure(using):
+    """
+    post_migrate: partitions the transactions table once. The monthly partitions are kept ahead
+    by the create_partitions command (the ``partitions`` service), not on every migrate.
+    """
+    connection = connections[using]
+    if connection.vendor == 'postgresql' and not is_partitioned(connection):
+        partition(connection)
@@ -0,0 +1,45 @@
+from rest_framework.permissions import SAFE_METHODS, IsAuthenticated
+
+from apps.budgets.models import Budget, Membership
+
+
+def budget_roles(request):
+    """
+    ``{budget_id: role}`` for every budget shared with the requesting user. Loaded with one
+    query the first time it is needed and kept on the request.
+    """
+    if not hasattr(request, '_budget_roles'):
+        request._budget_roles = dict(Membership.objects.filter(user_id=request.user.pk)
+                                     .values_list('budget_id', 'role'))
+    return request._budget_roles
+
+
+class IsBudgetMember(IsAuthenticated):
+    """
+    Object access by the user's role in the object's budget: any member reads, owners and
+    editors write, and only owners run the view's ``owner_actions``.
+    """
+
+    def has_object_permission(self, request, view, obj):
+        budget_id = obj.pk if isinstance(obj, Budget) else obj.budget_id
+        role = budget_roles(request).get(budget_id)
+        if role is None:
+            return False
+        if view.action in getattr(view, 'owner_actions', ()):
+            return role == Membership.OWNER
+        if request.method in SAFE_METHODS:
+            return True
+        return role in Membership.WRITE_ROLES
+
+
+class CanManageMembership(IsBudgetMember):
+    """
+    IsBudgetMember, plus members may delete their own membership (leave), except the owner.
+    """
+
+    def has_object_permission(self, request, view, obj):
+        if obj.role == Membership.OWNER and view.action in getattr(view, 'owner_actions', ()):
+            return False
+        if view.action == 'destroy' and obj.user_id == request.user.pk:
+            return True
+        return super().has_object_permission(request, view, obj)
@@ -0,0 +1,188 @@
+"""
+Running balances and income/expense series of a budget, for ``GET /api/budgets/<id>/reports/``.
+
+A budget's report is built from two sources:
+
+* its monthly totals, read from MonthlySummary with a window function that adds up the running
+  balance at the end of every month, so each month's opening balance comes without reading
+  any transaction;
+* one segment per month, the month's ``(day, income, expense)`` totals, aggregated from the
+  transactions of that month only (a single partition on Postgres).
+
+The result is cached as a snapshot per budget, a day-by-day list with running balances, from
+which the day, week and month series are cut. Segments are cached on their own: rollups
+invalidates the ``(budget, month)`` pairs a write touched, so rebuilding a snapshot after a
+write aggregates the changed months again and takes the others from the cache.
+
+Days without transactions are left out (the balance carries over). Archived months (see
+TransactionArchive) have no transactions left, their totals are reported on the first of the month.
+"""
+from bisect import bisect_left
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from django.db.models import DecimalField, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from apps.budgets.cache import day_cache, report_cache
+from apps.budgets.partitions import add_months
+
+BUCKETS = ['day', 'week', 'month']
+ZERO = Decimal('0.00')
+CENT = Decimal('0.01')
+
+
+def segment_key(budget_id, month):
+    return f'{budget_id}:{month:%Y%m}'
+
+
+def invalidate(months, using=None):
+    """
+    Drops the cached reports of the ``(budget_id, month)`` pairs once the current transaction
+    commits. Segments go first: a snapshot rebuilt in between must not pick up a stale one.
+    """
+    months = set(months)
+    if not months:
+        return
+
+    def bump():
+        for budget_id, month in sorted(months):
+            day_cache.bump(segment_key(budget_id, month))
+        for budget_id in sorted({budget_id for budget_id, _ in months}):
+            report_cache.bump(budget_id)
+    transaction.on_commit(bump, using=using or DEFAULT_DB_ALIAS)
+
+
+def version(budget_id):
+    """
+    The version of the budget's snapshot, moved by every write to its transactions.
+    """
+    return report_cache.get_version(budget_id)
+
+
+def snapshot(budget_id):
+    """
+    ``{'days': [(day, income, expense, balance), ...]}`` of the budget, ordered by day.
+    """
+    return report_cache.get_or_set(budget_id, lambda: build(budget_id))
+
+
+def build(budget_id):
+    months = monthly(budget_id)
+    keys = {segment_key(budget_id, month): month for month, *_ in months}
+    segments = day_cache.get_many_or_set(
+        list(keys), lambda missing: {segment_key(budget_id, month): days
+                                     for month, days in daily(budget_id, [keys[key] for key in missing]).items()})
+    result = []
+    for month, income, expense, balance in months:
+        running = balance - income + expense
+        # No rows left for an archived month, its totals stand in for the days
+        for day, day_income, day_expense in segments[segment_key(budget_id, month)] or [(month, income, expense)]:
+            running += day_income - day_expense
+            result.append((day, day_income, day_expense, running))
+    return {'days': result}
+
+
+def monthly(budget_id):
+    """
+    ``[(month, income, expense, balance)]`` of the budget, ``balance`` being the running
+    balance at the end of the month.
+    """
+    summary = apps.get_model('budgets', 'MonthlySummary')
+    connection = connections[router.db_for_read(summary)]
+    quote = connection.ops.quote_name
+    table = quote(summary._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT month, income, expense, SUM(income - expense) OVER (ORDER BY month) FROM ('
+            f'SELECT month, SUM(income) AS income, SUM(expense) AS expense FROM {table} '
+            f'WHERE budget_id = %s GROUP BY month HAVING SUM({quote("count")}) > 0) AS totals ORDER BY month',
+            [budget_id],
+        )
+        rows = cursor.fetchall()
+    return [(_date(month), _money(income), _money(expense), _money(balance))
+            for month, income, expense, balance in rows]
+
+
+def daily(budget_id, months):
+    """
+    ``{month: [(day, income, expense), ...]}`` aggregated from the transactions, one
+    date-bounded query per run of consecutive months.
+    """
+    model = apps.get_model('budgets', 'Transaction')
+    money = DecimalField(max_digits=14, decimal_places=2)
+    result = {month: [] for month in months}
+    for first, last in _runs(sorted(months)):
+        rows = (model.objects.filter(budget_id=budget_id, date__gte=first, date__lt=add_months(last, 1))
+                .values('date')
+                .annotate(income=Coalesce(Sum('amount', filter=Q(kind=model.INCOME)), Value(ZERO), output_field=money),
+                          expense=Coalesce(Sum('amount', filter=Q(kind=model.EXPENSE)), Value(ZERO),
+                                           output_field=money))
+                .order_by('date')
+                .values_list('date', 'income', 'expense'))
+        for day, income, expense in rows:
+            result[day.replace(day=1)].append((day, _money(income), _money(expense)))
+    return result
+
+
+def series(snapshot, bucket='month', start=None, end=None):
+    """
+    Chart-ready series of a snapshot between ``start`` and ``end`` (inclusive): period starts
+    (weeks start on Monday), and per period the income, the expense and the balance at its end.
+    """
+    days = snapshot['days']
+    first = bisect_left(days, (start,)) if start else 0
+    last = bisect_left(days, (end + timedelta(days=1),)) if end else len(days)
+    periods, income, expense, balance = [], [], [], []
+    for day, day_income, day_expense, day_balance in days[first:last]:
+        period = period_of(day, bucket)
+        if not periods or periods[-1] != period:
+            periods.append(period)
+            income.append(ZERO)
+            expense.append(ZERO)
+            balance.append(ZERO)
+        income[-1] += day_income
+        expense[-1] += day_expense
+        balance[-1] = day_balance
+    return {
+        'bucket': bucket,
+        'opening_balance': str(days[first - 1][3] if first else ZERO),
+        'periods': [period.isoformat() for period in periods],
+        'income': [str(value) for value in income],
+        'expense': [str(value) for value in expense],
+        'balance': [str(value) for value in balance],
+        'totals': {'income': str(sum(income, ZERO)), 'expense': str(sum(expense, ZERO))},
+    }
+
+
+def period_of(day, bucket):
+    if bucket == 'month':
+        return day.replace(day=1)
+    if bucket == 'week':
+        return day - timedelta(days=day.weekday())
+    return day
+
+
+def _runs(months):
+    """
+    ``(first, last)`` of each run of consecutive months in a sorted list.
+    """
+    runs = []
+    for month in months:
+        if runs and add_months(runs[-1][1], 1) == month:
+            runs[-1][1] = month
+        else:
+            runs.append([month, month])
+    return runs
+
+
+def _date(value):
+    # SQLite returns dates of raw queries as strings
+    return value if isinstance(value, date) else date.fromisoformat(value)
+
+
+def _money(value):
+    # and sums of decimal columns as floats, or decimals with float noise
+    return Decimal(str(value)).quantize(CENT)
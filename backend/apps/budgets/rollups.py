@@ -0,0 +1,156 @@
+"""
+Incremental maintenance of MonthlySummary.
+
+Every transaction write adds its delta to the ``(budget, category, month)`` row with a single
+``INSERT ... ON CONFLICT DO UPDATE``, inside the writer's database transaction. The increment
+happens in the database, so concurrent writers never lose each other's updates, and rows are
+touched in key order. An update nets what it takes from the old row's key and what it adds to
+the new one into a single set of deltas, so two writers covering the same keys (e.g. moving rows
+between two months in opposite directions) lock them in the same order and cannot deadlock. The
+cached reports of the months touched are invalidated on commit (see apps.budgets.reports).
+"""
+from decimal import Decimal
+from itertools import groupby
+
+from django.apps import apps
+from django.db import connections, router, transaction
+from django.db.models import Count, DecimalField, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+
+from apps.budgets import reports
+from apps.common.bulk import batched
+
+ZERO = Decimal('0.00')
+UPSERT_BATCH_SIZE = 1000
+
+
+def month_of(day):
+    return day.replace(day=1)
+
+
+def deltas(transactions, sign=1, into=None):
+    """
+    ``{(budget_id, category_id, month): [income, expense, count]}`` for the given transactions,
+    added to the ``into`` deltas if given.
+    """
+    result = {} if into is None else into
+    for tx in transactions:
+        key = (tx.budget_id, tx.category_id, month_of(tx.date))
+        delta = result.setdefault(key, [ZERO, ZERO, 0])
+        amount = Decimal(str(tx.amount)) * sign
+        if tx.kind == tx.INCOME:
+            delta[0] += amount
+        else:
+            delta[1] += amount
+        delta[2] += sign
+    return result
+
+
+def apply(transactions, sign=1, using=None):
+    """
+    Adds (``sign=1``) or subtracts (``sign=-1``) the transactions from their summary rows.
+    Must run in the same atomic block as the write it accounts for.
+    """
+    _update(deltas(transactions, sign), using)
+
+
+def replace(old, new, using=None):
+    """
+    Subtracts the stored versions ``old`` of updated transactions and adds their ``new`` ones,
+    in one key-ordered pass. Must run in the same atomic block as the write it accounts for.
+    """
+    _update(deltas(new, into=deltas(old, sign=-1)), using)
+
+
+def apply_totals(totals, using=None):
+    """
+    Adds rows shaped like ``live_totals`` output, for writes that bypass Transaction.save
+    (e.g. imports merged with INSERT ... SELECT).
+    """
+    changes = {(row['budget_id'], row['category_id'], row['month']): [row['income'], row['expense'], row['count']]
+               for row in totals}
+    _update(changes, using)
+
+
+def _update(changes, using):
+    model = apps.get_model('budgets', 'MonthlySummary')
+    if not changes:
+        return
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    table = quote(model._meta.db_table)
+    count = quote('count')
+    # Also the months whose totals net out: their days changed (see reports)
+    reports.invalidate(((budget_id, month) for budget_id, _, month in changes), using)
+    rows = [(key, delta) for key, delta in sorted(changes.items()) if any(delta)]
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        # One statement per run of keys that only lose rows or that gain some, in key order
+        for retract, run in groupby(rows, key=lambda row: row[1][2] < 0):
+            if retract:
+                # The rows exist (the transactions were counted when written), and a negative count
+                # in an INSERT would trip the count >= 0 check before ON CONFLICT is considered
+                cursor.executemany(
+                    f'UPDATE {table} SET income = income + %s, expense = expense + %s, {count} = {count} + %s '
+                    f'WHERE budget_id = %s AND category_id = %s AND month = %s',
+                    [(income, expense, delta, *key) for key, (income, expense, delta) in run],
+                )
+                continue
+            for batch in batched(run, UPSERT_BATCH_SIZE):
+                placeholders = ', '.join(['(%s, %s, %s, %s, %s, %s)'] * len(batch))
+                cursor.execute(
+                    f'INSERT INTO {table} (budget_id, category_id, month, income, expense, {count}) '
+                    f'VALUES {placeholders} '
+                    f'ON CONFLICT (budget_id, category_id, month) DO UPDATE SET '
+                    f'income = {table}.income + EXCLUDED.income, '
+                    f'expense = {table}.expense + EXCLUDED.expense, '
+                    f'{count} = {table}.{count} + EXCLUDED.{count}',
+                    [value for key, delta in batch for value in (*key, *delta)],
+                )
+
+
+def live_totals(transactions):
+    """
+    The summary rows computed from scratch, as ``.values()`` dicts, for rebuilds and comparisons.
+    """
+    model = apps.get_model('budgets', 'Transaction')
+    money = DecimalField(max_digits=14, decimal_places=2)
+    return (transactions.annotate(month=TruncMonth('date'))
+            .values('budget_id', 'category_id', 'month')
+            .annotate(income=Coalesce(Sum('amount', filter=Q(kind=model.INCOME)), Value(ZERO), output_field=money),
+                      expense=Coalesce(Sum('amount', filter=Q(kind=model.EXPENSE)), Value(ZERO), output_field=money),
+                      count=Count('id'))
+            .order_by())
+
+
+def rebuild(budget_ids=None, using=None, batch_size=5000):
+    """
+    Recomputes summary rows from the transactions table, for all budgets or the given ones.
+    On Postgres the transactions table is locked against writes for the duration, so no
+    concurrent increment lands between the aggregate and the insert. Archived months
+    (see TransactionArchive) have no rows left to count, their summaries are kept as they are.
+    Returns the number of summary rows written.
+    """
+    summary = apps.get_model('budgets', 'MonthlySummary')
+    model = apps.get_model('budgets', 'Transaction')
+    archive = apps.get_model('budgets', 'TransactionArchive')
+    using = using or router.db_for_write(summary)
+    connection = connections[using]
+
+    with transaction.atomic(using=using):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f'LOCK TABLE {connection.ops.quote_name(model._meta.db_table)} IN SHARE MODE')
+        transactions = model.objects.using(using).all()
+        summaries = summary.objects.using(using).all()
+        if budget_ids is not None:
+            transactions = transactions.filter(budget_id__in=budget_ids)
+            summaries = summaries.filter(budget_id__in=budget_ids)
+        archived = list(archive.objects.using(using).values_list('month', flat=True).distinct())
+        summaries = summaries.exclude(month__in=archived)
+        months = set(summaries.values_list('budget_id', 'month'))
+        summaries.delete()
+        rows = [summary(**row) for row in live_totals(transactions).exclude(month__in=archived)]
+        summary.objects.using(using).bulk_create(rows, batch_size=batch_size)
+        reports.invalidate(months | {(row.budget_id, row.month) for row in rows}, using)
+    return len(rows)
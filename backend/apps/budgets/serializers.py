@@ -0,0 +1,136 @@
+from rest_framework import serializers
+
+from apps.budgets.models import Budget, Category, Membership, MonthlySummary, Transaction
+from apps.budgets.permissions import budget_roles
+from apps.common.serializers import TimedListSerializer, TimedSerializerMixin
+from apps.users.models import User
+
+
+class MemberBudgetField(serializers.PrimaryKeyRelatedField):
+    """
+    Accepts only budgets in which the requesting user has one of ``roles``.
+    """
+
+    def __init__(self, roles=Membership.WRITE_ROLES, **kwargs):
+        self.roles = roles
+        super().__init__(**kwargs)
+
+    def get_queryset(self):
+        roles = budget_roles(self.context['request'])
+        return Budget.objects.filter(pk__in=[budget_id for budget_id, role in roles.items() if role in self.roles])
+
+
+class BudgetSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    role = serializers.SerializerMethodField(read_only=True)
+
+    def get_role(self, obj):
+        return budget_roles(self.context['request']).get(obj.pk)
+
+    class Meta:
+        model = Budget
+        fields = ['id', 'name', 'owner', 'role', 'created_at']
+        read_only_fields = ['owner', 'created_at']
+        list_serializer_class = TimedListSerializer
+
+
+class MembershipSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    budget = MemberBudgetField(roles=[Membership.OWNER])
+    email = serializers.EmailField(write_only=True)
+    user_email = serializers.EmailField(source='user.email', read_only=True)
+    role = serializers.ChoiceField(choices=[Membership.EDITOR, Membership.VIEWER], default=Membership.VIEWER)
+
+    class Meta:
+        model = Membership
+        fields = ['id', 'budget', 'user', 'email', 'user_email', 'role', 'created_at']
+        read_only_fields = ['user', 'created_at']
+        list_serializer_class = TimedListSerializer
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.instance is not None:
+            # Only the role of an existing membership can change
+            fields['budget'].read_only = True
+            fields['email'].required = False
+        return fields
+
+    def validate(self, attrs):
+        if self.instance is not None:
+            if self.instance.role == Membership.OWNER:
+                raise serializers.ValidationError({'role': 'The owner\'s role can\'t change.'})
+            attrs.pop('email', None)
+            return attrs
+        user = User.objects.filter_email(attrs.pop('email')).first()
+        if user is None:
+            raise serializers.ValidationError({'email': 'No user with this email.'})
+        if Membership.objects.filter(user=user, budget=attrs['budget']).exists():
+            raise serializers.ValidationError({'email': 'The budget is already shared with this user.'})
+        attrs['user'] = user
+        return attrs
+
+
+class CategorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    budget = MemberBudgetField()
+
+    class Meta:
+        model = Category
+        fields = ['id', 'budget', 'name']
+        list_serializer_class = TimedListSerializer
+
+
+class TransactionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    budget = MemberBudgetField()
+
+    class Meta:
+        model = Transaction
+        fields = ['id', 'budget', 'category', 'kind', 'amount', 'date', 'description', 'created_at']
+        read_only_fields = ['created_at']
+        list_serializer_class = TimedListSerializer
+
+    def validate(self, attrs):
+        budget = attrs.get('budget', getattr(self.instance, 'budget', None))
+        category = attrs.get('category', getattr(self.instance, 'category', None))
+        if budget and category and category.budget_id != budget.pk:
+            raise serializers.ValidationError({'category': 'Category belongs to another budget.'})
+        return attrs
+
+
+class TransactionBatchSerializer(serializers.ModelSerializer):
+    """
+    One item of a transactions batch (TransactionViewSet.batch): created without ``id``,
+    replaced with one. Budgets, categories and existing rows are checked against maps loaded
+    once for the whole batch (``context``) instead of a query per item.
+    """
+    id = serializers.IntegerField(required=False)
+    budget = serializers.IntegerField()
+    category = serializers.IntegerField()
+
+    class Meta:
+        model = Transaction
+        fields = ['id', 'budget', 'category', 'kind', 'amount', 'date', 'description']
+
+    def validate(self, attrs):
+        if 'id' in attrs:
+            if attrs['id'] not in self.context['existing']:
+                raise serializers.ValidationError({'id': 'Not found.'})
+            if attrs['id'] in self.context['seen']:
+                raise serializers.ValidationError({'id': 'Duplicate id in this batch.'})
+            self.context['seen'].add(attrs['id'])
+        if attrs['budget'] not in self.context['budgets']:
+            raise serializers.ValidationError({'budget': f'Invalid pk "{attrs["budget"]}" - object does not exist.'})
+        category_budget = self.context['categories'].get(attrs['category'])
+        if category_budget is None:
+            raise serializers.ValidationError(
+                {'category': f'Invalid pk "{attrs["category"]}" - object does not exist.'})
+        if category_budget != attrs['budget']:
+            raise serializers.ValidationError({'category': 'Category belongs to another budget.'})
+        return attrs
+
+
+class MonthlySummarySerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    month = serializers.DateField(format='%Y-%m')
+    category_name = serializers.CharField(source='category.name')
+
+    class Meta:
+        model = MonthlySummary
+        fields = ['month', 'category', 'category_name', 'income', 'expense', 'count']
+        list_serializer_class = TimedListSerializer
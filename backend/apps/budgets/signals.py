@@ -0,0 +1,26 @@
+from django.db import connections
+
+from apps.budgets import partitions
+
+
+def create_trigram_index(sender, using, **kwargs):
+    """
+    Trigram index for the ``search`` filter, matching the ``UPPER(description::text) LIKE``
+    that icontains compiles to. Postgres only, Django 3.2 can't declare opclass expression indexes.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS budgets_tx_description_trgm_idx ON budgets_transaction '
+            'USING gin (UPPER(description::text) gin_trgm_ops)'
+        )
+
+
+def partition_transactions(sender, using, **kwargs):
+    """
+    Monthly partitions of the transactions table, see apps.budgets.partitions. Postgres only.
+    """
+    partitions.ensure(using)
@@ -0,0 +1,747 @@
+import csv
+import gzip
+import io
+import os
+import tempfile
+import threading
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock, skipUnless
+
+from psycopg2 import extensions, extras
+
+from django.contrib import admin
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import QuerySet
+from django.http import QueryDict, StreamingHttpResponse
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+
+from apps.budgets import batches, events, imports, partitions, reports, rollups
+from apps.budgets.admin import TransactionAdmin
+from apps.budgets.benchmarks import explain
+from apps.budgets.cache import day_cache, report_cache
+from apps.budgets.filters import TransactionFilterSet
+from apps.budgets.models import Budget, Category, Membership, MonthlySummary, Transaction, TransactionArchive
+from apps.common import pubsub
+from apps.common.bulk import copy_to
+from apps.users.models import User
+from apps.users.tokens import issue_tokens
+
+CENT = Decimal('0.01')
+
+
+def cents(value):
+    # SQLite hands back sums of decimal columns as floats
+    return Decimal(str(value)).quantize(CENT)
+
+
+class RollupsMixin:
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='rollups@example.com', password='secret-pw')
+        self.budget = Budget.objects.create(name='Home', owner=self.user)
+        self.food = Category.objects.create(budget=self.budget, name='Food')
+        self.rent = Category.objects.create(budget=self.budget, name='Rent')
+
+    def add(self, amount, day, category=None, kind=Transaction.EXPENSE):
+        return Transaction.objects.create(budget=self.budget, category=category or self.food, kind=kind,
+                                          amount=Decimal(amount), date=day)
+
+    def assertRollupsMatch(self):
+        summaries = MonthlySummary.objects.filter(budget=self.budget)
+        # Rows whose transactions all left stay behind, emptied
+        for income, expense in summaries.filter(count=0).values_list('income', 'expense'):
+            self.assertEqual((cents(income), cents(expense)), (0, 0))
+        stored = sorted((row.category_id, row.month, cents(row.income), cents(row.expense), row.count)
+                        for row in summaries.filter(count__gt=0))
+        live = sorted((row['category_id'], row['month'], cents(row['income']), cents(row['expense']), row['count'])
+                      for row in rollups.live_totals(Transaction.objects.filter(budget=self.budget)))
+        self.assertEqual(stored, live)
+        return stored
+
+
+class RollupTests(RollupsMixin, TransactionTestCase):
+    """
+    MonthlySummary must match the live aggregates of the transactions after every write.
+    """
+
+    def test_create(self):
+        self.add('10.10', date(2021, 1, 5))
+        self.add('0.20', date(2021, 1, 31))
+        self.add('100.00', date(2021, 2, 1), kind=Transaction.INCOME)
+        self.add('5.55', date(2021, 1, 1), category=self.rent)
+        self.assertEqual(self.assertRollupsMatch(), sorted([
+            (self.food.pk, date(2021, 1, 1), Decimal('0.00'), Decimal('10.30'), 2),
+            (self.food.pk, date(2021, 2, 1), Decimal('100.00'), Decimal('0.00'), 1),
+            (self.rent.pk, date(2021, 1, 1), Decimal('0.00'), Decimal('5.55'), 1),
+        ]))
+
+    def test_update_moves_month_and_category(self):
+        tx = self.add('10.10', date(2021, 1, 5))
+        self.add('1.00', date(2021, 1, 6))
+
+        tx.date = date(2021, 3, 1)
+        tx.save()
+        self.assertRollupsMatch()
+
+        tx.category = self.rent
+        tx.kind = Transaction.INCOME
+        tx.amount = Decimal('20.02')
+        tx.save()
+        self.assertEqual(self.assertRollupsMatch(), sorted([
+            (self.food.pk, date(2021, 1, 1), Decimal('0.00'), Decimal('1.00'), 1),
+            (self.rent.pk, date(2021, 3, 1), Decimal('20.02'), Decimal('0.00'), 1),
+        ]))
+
+    def test_update_of_a_stale_instance(self):
+        # The stored row is retracted, not the instance's copy of it
+        tx = self.add('10.00', date(2021, 1, 5))
+        stale = Transaction.objects.get(pk=tx.pk)
+        tx.date = date(2021, 2, 5)
+        tx.save()
+        stale.amount = Decimal('3.00')
+        stale.save()
+        self.assertEqual(self.assertRollupsMatch(), [(self.food.pk, date(2021, 1, 1), Decimal('0.00'),
+                                                      Decimal('3.00'), 1)])
+
+    def test_batch(self):
+        moved = self.add('10.00', date(2021, 1, 5))
+        kept = self.add('1.00', date(2021, 1, 6))
+        items = [
+            {'id': moved.pk, 'budget': self.budget.pk, 'category': self.rent.pk, 'kind': Transaction.EXPENSE,
+             'amount': Decimal('4.00'), 'date': date(2021, 2, 1)},
+            {'id': kept.pk, 'budget': self.budget.pk, 'category': self.food.pk, 'kind': Transaction.EXPENSE,
+             'amount': Decimal('2.00'), 'date': date(2021, 1, 6)},
+            {'budget': self.budget.pk, 'category': self.food.pk, 'kind': Transaction.EXPENSE,
+             'amount': Decimal('3.00'), 'date': date(2021, 1, 7)},
+        ]
+        with transaction.atomic():
+            existing = {tx.pk: tx for tx in Transaction.objects.select_for_update().filter(pk__in=[moved.pk, kept.pk])}
+            with CaptureQueriesContext(connection) as queries:
+                batches.save_batch(items, existing, user_id=self.user.pk)
+        # The old and new versions net into one upsert, no separate retraction
+        writes = [query['sql'] for query in queries if 'budgets_monthlysummary' in query['sql']
+                  and not query['sql'].startswith('SELECT')]
+        self.assertEqual(len(writes), 1, writes)
+        self.assertEqual(self.assertRollupsMatch(), sorted([
+            (self.food.pk, date(2021, 1, 1), Decimal('0.00'), Decimal('5.00'), 2),
+            (self.rent.pk, date(2021, 2, 1), Decimal('0.00'), Decimal('4.00'), 1),
+        ]))
+
+    def test_delete(self):
+        tx = self.add('10.10', date(2021, 1, 5))
+        self.add('2.00', date(2021, 1, 6))
+        tx.delete()
+        self.assertRollupsMatch()
+        Transaction.objects.get(budget=self.budget).delete()
+        self.assertEqual(self.assertRollupsMatch(), [])
+
+    def test_rolled_back_write(self):
+        self.add('1.00', date(2021, 1, 5))
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.add('5.00', date(2021, 1, 6))
+            raise RuntimeError
+        self.assertRollupsMatch()
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_concurrent_writers(self):
+        """
+        Threads create, update (the same rows, across months and categories) and delete at once.
+        """
+        shared = [self.add('1.00', date(2021, 1, day)) for day in range(1, 11)]
+        threads, errors = 8, []
+        barrier = threading.Barrier(threads)
+
+        def write(n):
+            try:
+                barrier.wait()
+                for i, tx in enumerate(shared):
+                    with transaction.atomic():
+                        tx = Transaction.objects.get(pk=tx.pk)
+                        tx.amount += n
+                        tx.date = date(2021, 1 + (n + i) % 3, tx.date.day)
+                        tx.category = self.rent if (n + i) % 2 else self.food
+                        tx.save()
+                    extra = self.add(str(n + 1), date(2021, 2, 1 + n), category=self.rent)
+                    if i % 2:
+                        extra.delete()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=write, args=(n,)) for n in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(Transaction.objects.filter(budget=self.budget).count(), len(shared) + threads * 5)
+        self.assertRollupsMatch()
+
+    @skipUnlessDBFeature('has_select_for_update')
+    def test_opposite_moves(self):
+        """
+        Two writers move rows between the same two summaries in opposite directions, each update
+        takes from one summary and adds to the other.
+        """
+        food = [self.add('1.00', date(2021, 1, day)) for day in range(1, 11)]
+        rent = [self.add('2.00', date(2021, 1, day), category=self.rent) for day in range(1, 11)]
+        errors, barrier = [], threading.Barrier(2)
+
+        def move(rows):
+            try:
+                barrier.wait()
+                # Both flip their rows back and forth, always in opposite directions
+                for _ in range(4):
+                    for tx in rows:
+                        with transaction.atomic():
+                            tx = Transaction.objects.get(pk=tx.pk)
+                            tx.category = self.rent if tx.category_id == self.food.pk else self.food
+                            tx.save()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=move, args=(rows,)) for rows in (food, rent)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(errors, [])
+        self.assertRollupsMatch()
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Monthly partitions are Postgres only')
+class PartitionTests(RollupsMixin, TransactionTestCase):
+    """
+    migrate partitions the transactions table by month, old months are archived whole.
+    """
+
+    def rows(self):
+        return list(Transaction.objects.filter(budget=self.budget).order_by('pk').values_list(
+            'pk', 'category_id', 'kind', 'amount', 'date', 'description', 'created_by_id', 'created_at',
+            'import_key'))
+
+    def default_count(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM {connection.ops.quote_name(partitions.default_name())}')
+            return cursor.fetchone()[0]
+
+    def test_partitioned(self):
+        self.assertTrue(partitions.is_partitioned(connection))
+        # Once: migrate leaves the monthly partitions to create_partitions
+        existing = partitions.partitions(connection)
+        partitions.ensure(connection.alias)
+        self.assertEqual(partitions.partitions(connection), existing)
+
+        month = timezone.localdate().replace(day=1)
+        partitions.create_partitions(connection)
+        self.assertLessEqual({partitions.add_months(month, n) for n in range(4)},
+                             set(partitions.partitions(connection)))
+        tx = self.add('1.00', month)
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT tableoid::regclass::text FROM {Transaction._meta.db_table} WHERE id = %s',
+                           [tx.pk])
+            self.assertEqual(cursor.fetchone()[0], partitions.partition_name(month))
+
+    def test_split_from_default(self):
+        # No partition for these months: the rows land in the default one
+        old = [self.add('1.00', date(1999, 5, day)) for day in (1, 31)]
+        self.add('2.00', date(1999, 6, 15))
+        self.assertEqual(self.default_count(), 3)
+        before = self.rows()
+
+        created = partitions.create_partitions(connection, months=0, today=date(1999, 5, 20))
+        self.assertEqual(created, [partitions.partition_name(date(1999, 5, 1)),
+                                   partitions.partition_name(date(1999, 6, 1))])
+        self.assertEqual(self.default_count(), 0)
+        self.assertEqual(self.rows(), before)
+        self.assertEqual(Transaction.objects.filter(date__month=5, date__year=1999).count(), len(old))
+        self.assertEqual(partitions.create_partitions(connection, months=0, today=date(1999, 5, 20)), [])
+        self.assertRollupsMatch()
+
+    def test_archive_and_restore(self):
+        for day, description in [(1, ''), (2, 'Shop, "corner"'), (3, 'Line\nbreak')]:
+            tx = self.add('1.50', date(1999, 3, day))
+            Transaction.objects.filter(pk=tx.pk).update(description=description)
+        Transaction.objects.filter(pk=tx.pk).update(created_by=self.user, import_key='k' * 64)
+        partitions.create_partitions(connection, months=0, today=date(1999, 3, 1))
+        name, before = partitions.partition_name(date(1999, 3, 1)), self.rows()
+        summaries = self.assertRollupsMatch()
+
+        # psycopg2 running green (gevent) can't COPY, the fallback writes the same file
+        copied, green = io.BytesIO(), io.BytesIO()
+        copy_to(connection, name, copied)
+        extensions.set_wait_callback(extras.wait_select)
+        try:
+            copy_to(connection, name, green)
+        finally:
+            extensions.set_wait_callback(None)
+        self.assertEqual(green.getvalue(), copied.getvalue())
+
+        with tempfile.TemporaryDirectory() as directory:
+            call_command('archive_transactions', months=0, dir=directory, stdout=io.StringIO())
+            archive = TransactionArchive.objects.get(month=date(1999, 3, 1))
+            self.assertEqual(archive.rows, 3)
+            self.assertNotIn(name, partitions.partitions(connection).values())
+            self.assertNotIn(name, partitions.detached(connection))
+            self.assertEqual(self.rows(), [])
+            # The month's summaries stay
+            self.assertEqual(sorted((row.category_id, row.month, cents(row.income), cents(row.expense), row.count)
+                                    for row in MonthlySummary.objects.filter(budget=self.budget, count__gt=0)),
+                             summaries)
+
+            # As the command's help says: COPY the file back and delete the archive
+            with gzip.open(archive.path, 'rb') as f, connection.cursor() as cursor:
+                cursor.copy_expert(f'COPY {Transaction._meta.db_table} FROM STDIN WITH (FORMAT csv, HEADER)', f)
+            archive.delete()
+        partitions.create_partitions(connection, months=0, today=date(1999, 3, 1))
+        self.assertEqual(self.rows(), before)
+        self.assertEqual(self.default_count(), 0)
+        self.assertRollupsMatch()
+
+
+class ImportTests(RollupsMixin, TransactionTestCase):
+    """
+    Imports add the totals of the rows they insert, and nothing when a statement comes again.
+    """
+    statement = (b'Date,Amount,Description,Category\n2021-05-01,-10.50,Shop,Food\n2021-05-01,-10.50,Shop,Food\n'
+                 b'2021-05-03,2000,Pay,Salary\n2021-06-01,-3,,\nbad,1,x,\n')
+
+    def run_import(self):
+        return imports.import_statement(self.budget, io.BytesIO(self.statement), 'csv', user_id=self.user.pk)
+
+    def test_import_and_reimport(self):
+        self.add('1.00', date(2021, 5, 2))
+        result = self.run_import()
+        self.assertEqual((result.imported, result.duplicates, result.invalid), (4, 0, 1))
+        # Food and Salary in May (the manual row included), Imported in June
+        self.assertEqual(len(self.assertRollupsMatch()), 3)
+
+        result = self.run_import()
+        self.assertEqual((result.imported, result.duplicates), (0, 4))
+        self.assertEqual(Transaction.objects.filter(budget=self.budget).count(), 5)
+        self.assertRollupsMatch()
+
+    def test_import_key_is_unique(self):
+        self.run_import()
+        tx = Transaction.objects.filter(budget=self.budget, import_key__isnull=False).first()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Transaction.objects.create(budget=self.budget, category_id=tx.category_id, kind=tx.kind, amount=tx.amount,
+                                       date=tx.date, import_key=tx.import_key, import_seq=tx.import_seq)
+
+
+@override_settings(EXPORT_CHUNK_SIZE=500)
+class ExportTests(RollupsMixin, TestCase):
+    """
+    Exports stream the rows a chunk at a time, read through ``iterator()`` once the body is consumed.
+    """
+    rows = 3000
+
+    def setUp(self):
+        super().setUp()
+        Transaction.objects.bulk_create(
+            Transaction(budget=self.budget, category=self.food, kind=Transaction.EXPENSE, amount=Decimal('1.25'),
+                        date=date(2021, 1, 1) + timedelta(days=i % 365), description=f'Row {i}')
+            for i in range(self.rows))
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + issue_tokens(self.user)['access'])
+
+    def export(self, output):
+        with mock.patch.object(QuerySet, 'iterator', autospec=True, side_effect=QuerySet.iterator) as iterator:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(f'/api/transactions/export/?budget={self.budget.pk}&output={output}')
+            self.assertIsInstance(response, StreamingHttpResponse)
+            # Nothing read yet, the rows are fetched while the body is sent
+            self.assertFalse(any('budgets_transaction' in query['sql'] for query in queries.captured_queries))
+            chunks = list(response.streaming_content)
+        iterator.assert_called_once()
+        self.assertEqual(iterator.call_args.kwargs, {'chunk_size': 500})
+        return [chunk for chunk in chunks if chunk]
+
+    def test_csv(self):
+        chunks = self.export('csv')
+        self.assertEqual(len(chunks), self.rows // 500)
+        lines = list(csv.reader(io.StringIO(b''.join(chunks).decode('utf-8'))))
+        self.assertEqual(lines[0], ['id', 'budget', 'date', 'kind', 'amount', 'category', 'description', 'created_at'])
+        self.assertEqual(len(lines), self.rows + 1)
+        self.assertEqual(lines[1][2:7], ['2021-01-01', 'expense', '1.25', 'Food', 'Row 0'])
+
+    def test_ndjson(self):
+        chunks = self.export('ndjson')
+        self.assertEqual(len(chunks), self.rows // 500)
+        self.assertTrue(all(chunk.count(b'\n') == 500 for chunk in chunks))
+
+
+class EventTests(RollupsMixin, TestCase):
+    """
+    Writes of many rows reach a budget's stream as one event per budget, except the events that end access.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.other = Budget.objects.create(name='Office', owner=self.user)
+        # Delivered on commit within the process, which captureOnCommitCallbacks stands in for
+        hub = pubsub.Hub()
+        patcher = mock.patch.dict(pubsub._hubs, {os.getpid(): (hub, pubsub.LocalBroker(hub))})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.subscription = pubsub.subscribe([events.channel(self.budget.pk), events.channel(self.other.pk)])
+        self.addCleanup(self.subscription.close)
+
+    def received(self):
+        messages, overflowed = self.subscription.get(timeout=0)
+        self.assertFalse(overflowed)
+        return [message for _, message in messages]
+
+    def test_one_event_per_budget(self):
+        with self.captureOnCommitCallbacks(execute=True), events.coalesced():
+            for day in range(1, 4):
+                self.add('10.00', date(2021, 5, day))
+            desk = Category.objects.create(budget=self.other, name='Desk')
+        self.assertEqual(sorted(self.received(), key=lambda message: message['budget']), [
+            {'type': 'transaction', 'op': events.BATCH, 'budget': self.budget.pk, 'id': None, 'count': 3},
+            {'type': 'category', 'op': events.SAVED, 'budget': self.other.pk, 'id': desk.pk},
+        ])
+
+    def test_mixed_kinds(self):
+        with self.captureOnCommitCallbacks(execute=True), events.coalesced():
+            self.add('10.00', date(2021, 5, 1))
+            self.food.save()
+        self.assertEqual(self.received(), [
+            {'type': 'budget', 'op': events.BATCH, 'budget': self.budget.pk, 'id': None, 'count': 2},
+        ])
+
+    def test_access_ending_events_go_out(self):
+        member = User.objects.create_user(email='member@example.com', password='secret-pw')
+        membership = Membership.objects.create(user=member, budget=self.budget, role=Membership.VIEWER)
+        with self.captureOnCommitCallbacks(execute=True), events.coalesced():
+            self.add('10.00', date(2021, 5, 1))
+            membership.delete()
+        messages = self.received()
+        self.assertEqual([(message['type'], message['op']) for message in messages],
+                         [('membership', events.DELETED), ('transaction', events.SAVED)])
+        self.assertTrue(events.ends_access(messages[0], member.pk))
+
+    def test_failed_block_publishes_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), events.coalesced():
+                self.add('10.00', date(2021, 5, 1))
+                raise RuntimeError
+            self.add('20.00', date(2021, 5, 2))
+        self.assertEqual([message['op'] for message in self.received()], [events.SAVED])
+
+    def test_admin_bulk_delete(self):
+        for day in range(1, 4):
+            self.add('10.00', date(2021, 5, day))
+        self.received()
+        with self.captureOnCommitCallbacks(execute=True):
+            TransactionAdmin(Transaction, admin.site).delete_queryset(None, Transaction.objects.all())
+        self.assertEqual(self.received(), [
+            {'type': 'transaction', 'op': events.BATCH, 'budget': self.budget.pk, 'id': None, 'count': 3},
+        ])
+        self.assertRollupsMatch()
+
+
+class ReportTests(RollupsMixin, TestCase):
+    """
+    Report series are cut from the cached snapshot, which must follow the live transactions; a
+    write rebuilds the segments of the months it touched and nothing else.
+    """
+
+    def setUp(self):
+        report_cache.cache.clear()
+        super().setUp()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + issue_tokens(self.user)['access'])
+        self.url = f'/api/budgets/{self.budget.pk}/reports/'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add('1000.00', date(2021, 1, 4), category=self.rent, kind=Transaction.INCOME)
+            self.add('10.50', date(2021, 1, 4))
+            # A Sunday, then a Monday
+            self.add('5.25', date(2021, 1, 31))
+            self.add('20.00', date(2021, 2, 1))
+            # A Wednesday and a Thursday: one week, two months
+            self.add('300.00', date(2021, 3, 31), category=self.rent)
+            self.add('50.00', date(2021, 4, 1), kind=Transaction.INCOME)
+
+    def report(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def live_days(self):
+        days, balance = [], Decimal('0.00')
+        for day in Transaction.objects.filter(budget=self.budget).dates('date', 'day'):
+            rows = list(Transaction.objects.filter(budget=self.budget, date=day))
+            income = sum((tx.amount for tx in rows if tx.kind == Transaction.INCOME), Decimal('0.00'))
+            expense = sum((tx.amount for tx in rows if tx.kind == Transaction.EXPENSE), Decimal('0.00'))
+            balance += income - expense
+            days.append((day, cents(income), cents(expense), cents(balance)))
+        return days
+
+    def test_running_balance(self):
+        self.assertEqual(reports.snapshot(self.budget.pk)['days'], self.live_days())
+        with self.captureOnCommitCallbacks(execute=True):
+            tx = Transaction.objects.get(date=date(2021, 1, 31))
+            tx.date, tx.amount = date(2021, 3, 15), Decimal('7.00')
+            tx.save()
+            self.add('2.00', date(2021, 2, 10))
+            Transaction.objects.get(date=date(2021, 4, 1)).delete()
+        self.assertEqual(reports.snapshot(self.budget.pk)['days'], self.live_days())
+
+    def test_buckets(self):
+        self.assertEqual(self.report(bucket='week'), {
+            'bucket': 'week',
+            'opening_balance': '0.00',
+            'periods': ['2021-01-04', '2021-01-25', '2021-02-01', '2021-03-29'],
+            'income': ['1000.00', '0.00', '0.00', '50.00'],
+            'expense': ['10.50', '5.25', '20.00', '300.00'],
+            'balance': ['989.50', '984.25', '964.25', '714.25'],
+            'totals': {'income': '1050.00', 'expense': '335.75'},
+        })
+        self.assertEqual(self.report(), {
+            'bucket': 'month',
+            'opening_balance': '0.00',
+            'periods': ['2021-01-01', '2021-02-01', '2021-03-01', '2021-04-01'],
+            'income': ['1000.00', '0.00', '0.00', '50.00'],
+            'expense': ['15.75', '20.00', '300.00', '0.00'],
+            'balance': ['984.25', '964.25', '664.25', '714.25'],
+            'totals': {'income': '1050.00', 'expense': '335.75'},
+        })
+
+    def test_slicing(self):
+        self.assertEqual(self.report(bucket='day', **{'from': '2021-01-05', 'to': '2021-03-31'}), {
+            'bucket': 'day',
+            'opening_balance': '989.50',
+            'periods': ['2021-01-31', '2021-02-01', '2021-03-31'],
+            'income': ['0.00', '0.00', '0.00'],
+            'expense': ['5.25', '20.00', '300.00'],
+            'balance': ['984.25', '964.25', '664.25'],
+            'totals': {'income': '0.00', 'expense': '325.25'},
+        })
+        sliced = self.report(**{'from': '2021-02-01'})
+        self.assertEqual((sliced['opening_balance'], sliced['periods'][0]), ('984.25', '2021-02-01'))
+        self.assertEqual(self.report(to='2020-12-31')['periods'], [])
+        for params in [{'bucket': 'year'}, {'from': '2021-02'}]:
+            with self.subTest(params):
+                self.assertEqual(self.client.get(self.url, params).status_code, 400)
+
+    def test_write_invalidates_its_month(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        months = [date(2021, month, 1) for month in range(1, 5)]
+        segments = [day_cache.get_version(reports.segment_key(self.budget.pk, month)) for month in months]
+        version = reports.version(self.budget.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add('1.00', date(2021, 2, 14))
+        self.assertNotEqual(reports.version(self.budget.pk), version)
+        self.assertEqual([month for month, segment in zip(months, segments)
+                          if day_cache.get_version(reports.segment_key(self.budget.pk, month)) != segment],
+                         [date(2021, 2, 1)])
+
+        with mock.patch.object(reports, 'daily', wraps=reports.daily) as daily:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        daily.assert_called_once_with(self.budget.pk, [date(2021, 2, 1)])
+        self.assertEqual(response.data['expense'], ['15.75', '21.00', '300.00', '0.00'])
+
+    def test_archived_month(self):
+        # What archiving leaves of January: its summaries, no transactions
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {Transaction._meta.db_table} WHERE date < %s', [date(2021, 2, 1)])
+        self.assertEqual(reports.snapshot(self.budget.pk)['days'], [
+            (date(2021, 1, 1), Decimal('1000.00'), Decimal('15.75'), Decimal('984.25')),
+            (date(2021, 2, 1), Decimal('0.00'), Decimal('20.00'), Decimal('964.25')),
+            (date(2021, 3, 31), Decimal('0.00'), Decimal('300.00'), Decimal('664.25')),
+            (date(2021, 4, 1), Decimal('50.00'), Decimal('0.00'), Decimal('714.25')),
+        ])
+
+    def test_overview_per_category(self):
+        response = self.client.get(f'/api/budgets/{self.budget.pk}/overview/', {'from': '2021-01', 'to': '2021-03'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['income'], response.data['expense'], response.data['count']),
+                         ('1000.00', '335.75', 5))
+        self.assertEqual([(row['month'], row['category_name'], row['income'], row['expense'], row['count'])
+                          for row in response.data['results']], [
+            ('2021-01', 'Food', '0.00', '15.75', 2),
+            ('2021-01', 'Rent', '1000.00', '0.00', 1),
+            ('2021-02', 'Food', '0.00', '20.00', 1),
+            ('2021-03', 'Rent', '0.00', '300.00', 1),
+        ])
+
+
+class PermissionTests(TestCase):
+    """
+    Access by role: members read, owners and editors write, owners delete and manage members.
+    Budgets of others are not found, including after the membership is removed.
+    """
+
+    def setUp(self):
+        self.users = {role: User.objects.create_user(email=f'{role}@example.com', password='secret-pw')
+                      for role in ['owner', 'editor', 'viewer', 'outsider']}
+        self.budget = Budget.objects.create(name='Shared', owner=self.users['owner'])
+        self.memberships = {role: Membership.objects.create(user=self.users[role], budget=self.budget, role=role)
+                            for role in [Membership.EDITOR, Membership.VIEWER]}
+        self.category = Category.objects.create(budget=self.budget, name='Food')
+        self.tx = Transaction.objects.create(budget=self.budget, category=self.category, kind=Transaction.EXPENSE,
+                                             amount=Decimal('5.00'), date=date(2021, 1, 1))
+
+    def client_for(self, role):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Bearer ' + issue_tokens(self.users[role])['access'])
+        return client
+
+    def assertStatuses(self, request, expected):
+        statuses = {role: request(self.client_for(role)).status_code for role in expected}
+        self.assertEqual(statuses, expected)
+
+    def test_read(self):
+        self.assertStatuses(lambda client: client.get(f'/api/budgets/{self.budget.pk}/'),
+                            {'owner': 200, 'editor': 200, 'viewer': 200, 'outsider': 404})
+        self.assertStatuses(lambda client: client.get(f'/api/transactions/{self.tx.pk}/'),
+                            {'owner': 200, 'editor': 200, 'viewer': 200, 'outsider': 404})
+        response = self.client_for('outsider').get(f'/api/transactions/?budget={self.budget.pk}')
+        self.assertEqual(response.data['results'], [])
+
+    def test_write(self):
+        self.assertStatuses(lambda client: client.patch(f'/api/budgets/{self.budget.pk}/', {'name': 'Renamed'}),
+                            {'owner': 200, 'editor': 200, 'viewer': 403, 'outsider': 404})
+        self.assertStatuses(lambda client: client.patch(f'/api/transactions/{self.tx.pk}/', {'amount': '6.00'}),
+                            {'owner': 200, 'editor': 200, 'viewer': 403, 'outsider': 404})
+        # The budget must be one the user writes to
+        data = {'budget': self.budget.pk, 'category': self.category.pk, 'kind': 'expense', 'amount': '1.00',
+                'date': '2021-01-02'}
+        self.assertStatuses(lambda client: client.post('/api/transactions/', data),
+                            {'owner': 201, 'editor': 201, 'viewer': 400, 'outsider': 400})
+
+    def test_delete(self):
+        self.assertStatuses(lambda client: client.delete(f'/api/budgets/{self.budget.pk}/'),
+                            {'editor': 403, 'viewer': 403, 'outsider': 404})
+        self.assertEqual(self.client_for('owner').delete(f'/api/budgets/{self.budget.pk}/').status_code, 204)
+        self.assertFalse(Budget.objects.exists())
+
+    def test_memberships(self):
+        editor = self.memberships[Membership.EDITOR]
+        self.assertStatuses(lambda client: client.patch(f'/api/memberships/{editor.pk}/', {'role': 'viewer'}),
+                            {'editor': 403, 'viewer': 403, 'outsider': 404, 'owner': 200})
+        owner = Membership.objects.get(budget=self.budget, role=Membership.OWNER)
+        # Anyone leaves, except the owner
+        self.assertEqual(self.client_for('owner').delete(f'/api/memberships/{owner.pk}/').status_code, 403)
+        viewer = self.memberships[Membership.VIEWER]
+        self.assertEqual(self.client_for('viewer').delete(f'/api/memberships/{viewer.pk}/').status_code, 204)
+
+    def test_removed_member(self):
+        client = self.client_for('editor')
+        self.assertEqual(client.get(f'/api/budgets/{self.budget.pk}/').status_code, 200)
+        editor = self.memberships[Membership.EDITOR]
+        self.assertEqual(self.client_for('owner').delete(f'/api/memberships/{editor.pk}/').status_code, 204)
+        # The same token, the roles are read per request
+        self.assertEqual(client.get(f'/api/budgets/{self.budget.pk}/').status_code, 404)
+        self.assertEqual(client.patch(f'/api/transactions/{self.tx.pk}/', {'amount': '7.00'}).status_code, 404)
+        self.assertEqual(client.get('/api/budgets/').data['results'], [])
+
+    def test_list_queries_do_not_grow_with_budgets(self):
+        viewer = self.users['viewer']
+        client = self.client_for('viewer')
+        counts = []
+        for total in [10, 500]:
+            # Without Budget.save, the viewer is the only member
+            Budget.objects.bulk_create(Budget(name=f'Budget {i}', owner=self.users['owner'])
+                                       for i in range(total - Budget.objects.count()))
+            Membership.objects.bulk_create(Membership(user=viewer, budget=budget)
+                                           for budget in Budget.objects.exclude(memberships__user=viewer))
+            with CaptureQueriesContext(connection) as queries:
+                response = client.get('/api/budgets/?page_size=500')
+            self.assertEqual(len(response.data['results']), total)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+class FilterTests(RollupsMixin, TestCase):
+    """
+    Every supported filter is served by an index (on Postgres with sequential scans disabled,
+    so the plan doesn't depend on the table size), and unservable or invalid ones are a 400.
+    """
+    cases = {
+        'budget': 'budget={budget}',
+        'date_range': 'budget={budget}&date_from=2021-01-01&date_to=2021-03-31',
+        'category': 'category={food},{rent}',
+        'amount_range': 'budget={budget}&amount_min=10&amount_max=20',
+        'income': 'budget={budget}&kind=income',
+        'search': 'search=payment',
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.add('12.00', date(2021, 2, 1))
+        self.add('100.00', date(2021, 5, 1), category=self.rent, kind=Transaction.INCOME)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + issue_tokens(self.user)['access'])
+
+    def query(self, name):
+        return self.cases[name].format(budget=self.budget.pk, food=self.food.pk, rent=self.rent.pk)
+
+    # The index of budgets_transaction each filter is meant to use
+    indexes = {
+        'budget': 'budgets_tx_budget_date_idx',
+        'date_range': 'budgets_tx_budget_date_idx',
+        'category': 'budgets_tx_category_date_idx',
+        'amount_range': 'budgets_tx_budget_amount_idx',
+        'income': 'budgets_tx_income_idx',
+        'search': 'budgets_tx_description_trgm_idx',
+    }
+
+    def plan(self, name):
+        shared = Transaction.objects.filter(budget_id__in=Membership.objects.budget_ids(self.user.pk))
+        queryset = TransactionFilterSet(QueryDict(self.query(name))).filter_queryset(shared)
+        return explain(queryset.order_by('-date', '-id')[:50])
+
+    def test_filters_use_indexes(self):
+        for name in self.cases:
+            with self.subTest(name):
+                sequential, indexes = self.plan(name)
+                self.assertFalse(sequential)
+                self.assertTrue(indexes)
+
+    @skipUnless(connection.vendor == 'postgresql', 'The plans of Postgres')
+    def test_filter_indexes(self):
+        # Statistics of a budget whose rows mostly match none of the narrower filters
+        Transaction.objects.bulk_create(
+            Transaction(budget=self.budget, category=self.food, kind=Transaction.EXPENSE, amount=Decimal('1.00'),
+                        date=date(2020, 1, 1) + timedelta(days=n % 730), description=f'Shop {n}')
+            for n in range(5000))
+        # Partitions scan their own copies of the indexes, named after the columns
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {Transaction._meta.db_table}')
+            cursor.execute(
+                "SELECT c.relname, p.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent WHERE c.relkind = 'i'"
+            )
+            parents = dict(cursor.fetchall())
+        for name, index in self.indexes.items():
+            with self.subTest(name):
+                self.assertIn(index, {parents.get(used, used) for used in self.plan(name)[1]})
+
+    def test_filter_results(self):
+        expected = {'budget': 2, 'date_range': 1, 'category': 2, 'amount_range': 1, 'income': 1, 'search': 0}
+        for name, count in expected.items():
+            with self.subTest(name):
+                response = self.client.get('/api/transactions/?' + self.query(name))
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.data['results']), count)
+
+    def test_rejected(self):
+        for query in ['date_from=2021-02-01&date_to=2021-01-01', 'amount_min=5&amount_max=1', 'search=ab',
+                      'date_from=yesterday', 'amount_min=NaN', 'category=x', 'kind=refund']:
+            with self.subTest(query):
+                self.assertEqual(self.client.get('/api/transactions/?' + query).status_code, 400)
@@ -0,0 +1,211 @@
+from datetime import datetime
+
+from django.db import transaction
+
+from rest_framework import viewsets, status
+from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from apps.budgets import batches, events, imports, reports
+from apps.budgets.filters import TransactionFilterSet
+from apps.budgets.models import Budget, Category, Membership, MonthlySummary, Transaction
+from apps.budgets.permissions import CanManageMembership, IsBudgetMember, budget_roles
+from apps.budgets.rollups import ZERO
+from apps.budgets.serializers import (
+    BudgetSerializer, CategorySerializer, MembershipSerializer, MonthlySummarySerializer, TransactionBatchSerializer,
+    TransactionSerializer,
+)
+from apps.common import exports, pubsub
+from apps.common.mixins import ConditionalGetMixin, ReplicaReadMixin
+from apps.common.serializers import batch_items, item_ids
+from apps.common.sse import EventStreamRenderer, event_stream_response, format_event
+from apps.users.tokens import QueryTokenAuthentication
+
+EXPORT_COLUMNS = ['id', 'budget_id', 'date', 'kind', 'amount', 'category__name', 'description', 'created_at']
+EXPORT_HEADERS = ['id', 'budget', 'date', 'kind', 'amount', 'category', 'description', 'created_at']
+
+
+def parse_month(value):
+    return datetime.strptime(value, '%Y-%m').date()
+
+
+def parse_day(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def shared_budget_ids(request):
+    # By id, token users (ClaimsUser) are not model instances
+    return Membership.objects.budget_ids(request.user.pk)
+
+
+class BudgetViewSet(ConditionalGetMixin, ReplicaReadMixin, viewsets.ModelViewSet):
+    serializer_class = BudgetSerializer
+    permission_classes = [IsBudgetMember]
+    owner_actions = ['destroy']
+
+    def get_queryset(self):
+        # A semi-join on the membership index; per-object access is checked against budget_roles
+        return Budget.objects.filter(pk__in=shared_budget_ids(self.request))
+
+    def perform_create(self, serializer):
+        serializer.save(owner_id=self.request.user.pk)
+
+    @action(methods=['GET'], detail=True)
+    def overview(self, request, pk=None):
+        """
+        Per-category monthly totals read from the rollup table,
+        optionally limited with ``?from=YYYY-MM&to=YYYY-MM``.
+        """
+        budget = self.get_object()
+        summaries = MonthlySummary.objects.filter(budget=budget, count__gt=0).select_related('category')
+        try:
+            if request.query_params.get('from'):
+                summaries = summaries.filter(month__gte=parse_month(request.query_params['from']))
+            if request.query_params.get('to'):
+                summaries = summaries.filter(month__lte=parse_month(request.query_params['to']))
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        summaries = list(summaries.order_by('month', 'category__name'))
+        return Response({
+            'income': str(sum((summary.income for summary in summaries), ZERO)),
+            'expense': str(sum((summary.expense for summary in summaries), ZERO)),
+            'count': sum(summary.count for summary in summaries),
+            'results': MonthlySummarySerializer(summaries, many=True).data,
+        })
+
+    @action(methods=['POST'], detail=True, url_path='import', parser_classes=[MultiPartParser])
+    def import_statement(self, request, pk=None):
+        """
+        Imports a CSV or OFX statement uploaded as ``file`` (``format`` defaults to the file extension).
+        Lines imported before are skipped.
+        """
+        budget = self.get_object()
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        statement_format = request.data.get('format') or imports.detect_format(upload.name)
+        if statement_format not in imports.FORMATS:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        result = imports.import_statement(budget, upload.file, statement_format, user_id=request.user.pk)
+        return Response(result.report(), status=status.HTTP_200_OK)
+
+    @action(methods=['GET'], detail=True)
+    def reports(self, request, pk=None):
+        """
+        Income, expense and running balance series per ``?bucket=day|week|month`` (default month),
+        optionally limited with ``?from=YYYY-MM-DD&to=YYYY-MM-DD``. Cut from the budget's cached
+        report snapshot (see apps.budgets.reports), whose version makes the ETag.
+        """
+        budget = self.get_object()
+        bucket = request.query_params.get('bucket', 'month')
+        if bucket not in reports.BUCKETS:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        try:
+            start = parse_day(request.query_params['from']) if request.query_params.get('from') else None
+            end = parse_day(request.query_params['to']) if request.query_params.get('to') else None
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        etag = self.make_etag(budget.pk, reports.version(budget.pk), request.get_full_path())
+        return self.conditional(
+            (etag, None), lambda request: Response(reports.series(reports.snapshot(budget.pk), bucket, start, end)),
+            request,
+        )
+
+    @action(methods=['GET'], detail=True, renderer_classes=[EventStreamRenderer],
+            authentication_classes=[QueryTokenAuthentication, *api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    def events(self, request, pk=None):
+        """
+        Server-Sent Events stream of the budget's changes (see apps.budgets.events), ending when
+        the budget is deleted or the user leaves it. EventSource can't send an Authorization
+        header, the access token may be passed as ``?token=``.
+        """
+        budget = self.get_object()
+        subscription = pubsub.subscribe([events.channel(budget.pk)])
+        if subscription is None:
+            return Response(status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '10'})
+        user_id = request.user.pk
+        return event_stream_response(subscription, lambda channel, message: format_event(message['type'], message),
+                                     last=lambda message: events.ends_access(message, user_id))
+
+
+class MembershipViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
+    """
+    Members of the user's budgets. Owners share (by email), change roles and remove members,
+    anyone can leave a budget they don't own.
+    """
+    serializer_class = MembershipSerializer
+    permission_classes = [CanManageMembership]
+    owner_actions = ['update', 'partial_update', 'destroy']
+
+    def get_queryset(self):
+        queryset = Membership.objects.filter(budget_id__in=shared_budget_ids(self.request)).select_related('user')
+        if self.request.query_params.get('budget', '').isdigit():
+            queryset = queryset.filter(budget_id=self.request.query_params['budget'])
+        return queryset
+
+
+class CategoryViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
+    serializer_class = CategorySerializer
+    permission_classes = [IsBudgetMember]
+
+    def get_queryset(self):
+        queryset = Category.objects.filter(budget_id__in=shared_budget_ids(self.request))
+        if self.request.query_params.get('budget', '').isdigit():
+            queryset = queryset.filter(budget_id=self.request.query_params['budget'])
+        return queryset
+
+
+class TransactionViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
+    serializer_class = TransactionSerializer
+    permission_classes = [IsBudgetMember]
+    filterset_class = TransactionFilterSet
+    keyset_ordering = ('-date', '-id')
+
+    def get_queryset(self):
+        return Transaction.objects.filter(budget_id__in=shared_budget_ids(self.request))
+
+    def perform_create(self, serializer):
+        serializer.save(created_by_id=self.request.user.pk)
+
+    @action(methods=['GET'], detail=False)
+    def export(self, request):
+        """
+        All matching transactions streamed as ``?output=csv`` (default) or ``?output=ndjson``.
+        """
+        output = request.query_params.get('output', 'csv')
+        if output not in exports.FORMATS:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        queryset = self.filter_queryset(self.get_queryset()).order_by('date', 'id')
+        return exports.stream_export(queryset, EXPORT_COLUMNS, output, 'transactions', headers=EXPORT_HEADERS)
+
+    @action(methods=['POST'], detail=False)
+    def batch(self, request):
+        """
+        Creates (items without ``id``) and replaces (items with one) up to API_MAX_BATCH_SIZE
+        transactions in one database transaction. Nothing is written unless every item is
+        valid, otherwise 400 with the errors in item order (``{}`` for valid items). Returns the
+        ids in item order, null for created rows where the database doesn't return them (SQLite).
+        """
+        items = batch_items(request.data)
+        writable = [budget_id for budget_id, role in budget_roles(request).items() if role in Membership.WRITE_ROLES]
+        with transaction.atomic():
+            # Locked in id order, as Transaction.save would lock them one by one
+            existing = {tx.pk: tx for tx in Transaction.objects.select_for_update()
+                        .filter(pk__in=item_ids(items, 'id'), budget_id__in=writable).order_by('pk')}
+            categories = dict(Category.objects.filter(pk__in=item_ids(items, 'category'), budget_id__in=writable)
+                              .values_list('id', 'budget_id'))
+            serializer = TransactionBatchSerializer(data=items, many=True, context={
+                'request': request, 'budgets': set(writable), 'categories': categories, 'existing': existing,
+                'seen': set(),
+            })
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            rows = batches.save_batch(serializer.validated_data, existing, user_id=request.user.pk)
+        created = any('id' not in attrs for attrs in serializer.validated_data)
+        return Response({'ids': [tx.pk for tx in rows]},
+                        status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
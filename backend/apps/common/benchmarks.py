@@ -0,0 +1,381 @@
+"""
+Benchmark scenarios for ``manage.py benchmark``.
+
+Apps describe their endpoints in a ``benchmarks.py`` module by subclassing Scenario
+and decorating it with ``@register``; the command autodiscovers those modules.
+In-process measurements that are not HTTP requests (e.g. serializer throughput)
+are plain functions taking the Context, registered with ``@register_micro``.
+"""
+import json
+import math
+import os
+import shutil
+import socket
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import quote
+from uuid import uuid4
+
+import requests
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.db import DatabaseError, connection
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from apps.common.bulk import copy_rows
+from apps.users.models import User
+
+SCENARIOS = {}
+MICRO_BENCHMARKS = {}
+
+BENCHMARK_PASSWORD = 'benchmark-password'
+BENCHMARK_EMAIL_DOMAIN = 'benchmark.invalid'
+
+
+def register(scenario_class):
+    SCENARIOS[scenario_class.name] = scenario_class
+    return scenario_class
+
+
+def register_micro(name):
+    def decorator(function):
+        MICRO_BENCHMARKS[name] = function
+        return function
+    return decorator
+
+
+def timed(function, repeat=3):
+    """
+    Best wall time of ``repeat`` calls, and the last return value.
+    """
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+class Scenario:
+    """
+    One benchmarked endpoint. ``setup`` runs once before the clients start,
+    ``request`` returns ``(method, path, data, headers)`` for the i-th request.
+    """
+    name = None
+    expected_statuses = (200,)
+
+    def __init__(self, context):
+        self.context = context
+
+    def setup(self):
+        pass
+
+    def request(self, i):
+        raise NotImplementedError
+
+
+class Context:
+    """
+    Data shared by scenarios: the seeded users and anything scenarios stash between runs.
+    """
+
+    def __init__(self):
+        self.users = []
+        self.extra = {}
+
+    def seed_users(self, count, batch_size=1000):
+        # One PBKDF2 round for the whole run instead of one per user
+        password = make_password(BENCHMARK_PASSWORD)
+        run = uuid4().hex[:8]
+        now = timezone.now()
+        # Every NOT NULL column: model defaults aren't database defaults
+        fields = ['email', 'password', 'first_name', 'last_name', 'avatar', 'avatar_thumbnails', 'avatar_pending',
+                  'token', 'is_superuser', 'is_admin', 'is_active', 'is_staff', 'registered_at', 'updated_at']
+        rows = ((f'bench-{run}-{i}@{BENCHMARK_EMAIL_DOMAIN}', password, 'Bench', f'User{i}', '', {}, False, uuid4(),
+                 False, False, True, False, now, now) for i in range(count))
+        copy_rows(User, fields, rows, batch_size=batch_size)
+        self.users = list(User.objects.filter(email__startswith=f'bench-{run}-')
+                          .order_by('id').values('id', 'email', 'token'))
+
+    def cleanup(self):
+        User.objects.filter(email__endswith=f'@{BENCHMARK_EMAIL_DOMAIN}').delete()
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(name, samples, wall_time, expected_statuses):
+    latencies = sorted(latency for latency, _ in samples)
+    statuses = {}
+    for _, code in samples:
+        statuses[str(code)] = statuses.get(str(code), 0) + 1
+
+    def ms(value):
+        return round(value * 1000, 3) if value is not None else None
+
+    return {
+        'scenario': name,
+        'requests': len(samples),
+        'errors': sum(count for code, count in statuses.items() if int(code) not in expected_statuses),
+        'statuses': statuses,
+        'wall_time_s': round(wall_time, 3),
+        'throughput_rps': round(len(samples) / wall_time, 2) if wall_time else None,
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 0.50)),
+        'p95_ms': ms(percentile(latencies, 0.95)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+    }
+
+
+class InProcessClient:
+    """
+    Drives the WSGI handler directly (full middleware stack, no network or server).
+    """
+
+    def __init__(self):
+        self.client = Client(raise_request_exception=False)
+
+    def send(self, method, path, data=None, headers=None):
+        extra = {f'HTTP_{key.upper().replace("-", "_")}': value for key, value in (headers or {}).items()}
+        start = time.perf_counter()
+        response = self.client.generic(method, path, data=_json(data), content_type='application/json', **extra)
+        return time.perf_counter() - start, response.status_code
+
+
+class HttpClient:
+    """
+    Drives a running server (e.g. gunicorn started by scripts/gunicorn.sh).
+    """
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def send(self, method, path, data=None, headers=None):
+        start = time.perf_counter()
+        response = self.session.request(method, self.base_url + path, data=_json(data),
+                                        headers=dict(headers or {}, **{'Content-Type': 'application/json'}))
+        return time.perf_counter() - start, response.status_code
+
+
+def _json(data):
+    return json.dumps(data) if data is not None else ''
+
+
+@register_micro('db-pool')
+def connection_pool(context, requests=2000, queries=3):
+    """
+    ``concurrency`` clients each run their share of ``requests`` simulated requests: connect,
+    ``queries`` queries of 1 ms, close, as Django does at the end of a request. Once with a
+    connection per request (Django's postgresql backend) and once through the pool of
+    DATABASE_POOL_SIZE connections. Reports latency, connections opened and the peak of server
+    connections. Threads stand in for greenlets, the pool waits on the same (patched) locks.
+    """
+    if connection.vendor != 'postgresql':
+        return {'skipped': 'needs PostgreSQL'}
+    from django.db.backends.postgresql.base import DatabaseWrapper as DirectWrapper
+
+    from apps.common.db.pool import get_pool
+    from apps.common.db.postgresql.base import DatabaseWrapper as PooledWrapper
+
+    concurrency = context.extra.get('concurrency', 8)
+    # The test database when the command isolates the run
+    settings_dict = dict(connection.settings_dict)
+    result = {'pool_size': settings.DATABASE_POOL_SIZE}
+    for label, wrapper_class in [('direct', DirectWrapper), ('pooled', PooledWrapper)]:
+        alias = f'benchmark-{label}'
+        latencies, errors = [], []
+        monitor = ServerConnections(DirectWrapper(settings_dict, 'benchmark-monitor'))
+
+        def client(count):
+            wrapper = wrapper_class(settings_dict, alias)
+            try:
+                for _ in range(count):
+                    start = time.perf_counter()
+                    try:
+                        with wrapper.cursor() as cursor:
+                            for _ in range(queries):
+                                cursor.execute('SELECT pg_sleep(0.001)')
+                        wrapper.close()
+                    except DatabaseError:
+                        errors.append(1)
+                        continue
+                    latencies.append(time.perf_counter() - start)
+            finally:
+                wrapper.close()
+
+        monitor.start()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(client, [len(range(n, requests, concurrency)) for n in range(concurrency)]))
+        wall_time = time.perf_counter() - started
+        monitor.stop()
+
+        latencies.sort()
+        result.update({
+            f'{label}_throughput_rps': round(len(latencies) / wall_time, 2),
+            f'{label}_p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            f'{label}_p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            f'{label}_p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+            f'{label}_errors': len(errors),
+            f'{label}_connections_opened': len(latencies) if wrapper_class is DirectWrapper else get_pool(alias).opened,
+            f'{label}_peak_server_connections': monitor.peak,
+        })
+        if wrapper_class is PooledWrapper:
+            get_pool(alias).close()
+    return result
+
+
+@register_micro('instrumentation')
+def instrumentation(context, requests=2000, rates=(0.0, 0.01, 1.0)):
+    """
+    Per-request cost of InstrumentationMiddleware: mean and p50 latency of user list and
+    retrieve requests without the middleware and with it at each INSTRUMENTATION_SAMPLE_RATE
+    of ``rates``. The setups take turns in rounds of 50 requests so that drift (caches, the
+    database warming up) is spread over all of them; the overhead is the difference of the
+    p50s, means move with the odd garbage collection.
+    """
+    path = 'apps.common.middleware.InstrumentationMiddleware'
+    without = [middleware for middleware in settings.MIDDLEWARE if middleware != path]
+    setups = {'off': {'MIDDLEWARE': without}}
+    setups.update({f'rate_{rate:g}': {'MIDDLEWARE': [path] + without, 'INSTRUMENTATION_SAMPLE_RATE': rate}
+                   for rate in rates})
+    paths = ['/api/users?page_size=20'] + [f'/api/users/{user["id"]}/' for user in context.users[:50]]
+    clients, latencies, statuses = {}, {label: [] for label in setups}, set()
+    for label, overrides in setups.items():
+        with override_settings(**overrides):
+            clients[label] = InProcessClient()
+            # Loads the middleware chain under the overridden settings
+            clients[label].send('GET', paths[0])
+
+    for start in range(0, requests, 50):
+        for label, overrides in setups.items():
+            with override_settings(**overrides):
+                for i in range(start, min(start + 50, requests)):
+                    elapsed, code = clients[label].send('GET', paths[i % len(paths)])
+                    latencies[label].append(elapsed)
+                    statuses.add(code)
+
+    result = {'requests': requests, 'statuses': sorted(statuses)}
+    baseline = percentile(sorted(latencies['off']), 0.50)
+    for label, values in latencies.items():
+        values.sort()
+        p50 = percentile(values, 0.50)
+        result.update({
+            f'{label}_mean_ms': round(sum(values) / requests * 1000, 3),
+            f'{label}_p50_ms': round(p50 * 1000, 3),
+        })
+        if label != 'off':
+            result[f'{label}_overhead_us'] = round((p50 - baseline) * 1e6, 1)
+    return result
+
+
+class ServerConnections(threading.Thread):
+    """
+    Samples the number of other connections to the database until stopped, keeping the peak.
+    """
+
+    def __init__(self, wrapper, interval=0.005):
+        super().__init__(daemon=True)
+        self.wrapper = wrapper
+        self.interval = interval
+        self.peak = 0
+        self._stopped = threading.Event()
+
+    def run(self):
+        # Used by this thread only
+        self.wrapper.inc_thread_sharing()
+        try:
+            with self.wrapper.cursor() as cursor:
+                while not self._stopped.wait(self.interval):
+                    cursor.execute('SELECT count(*) FROM pg_stat_activity '
+                                   'WHERE datname = current_database() AND pid <> pg_backend_pid()')
+                    self.peak = max(self.peak, cursor.fetchone()[0])
+        finally:
+            self.wrapper.close()
+            self.wrapper.dec_thread_sharing()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+@register_micro('cold-start')
+def cold_start(context, workers=4, timeout=60):
+    """
+    Seconds from starting gunicorn to the first 200 from /metrics, with every worker importing
+    the application (as scripts/gunicorn.sh used to) and with config/gunicorn_conf.py, where the
+    workers fork from a master that has preloaded it.
+    """
+    if shutil.which('gunicorn') is None:
+        return {'skipped': 'gunicorn not on PATH'}
+    arguments = {
+        'per_worker': ['--worker-class', 'gevent'],
+        'preload': ['--config', 'config/gunicorn_conf.py'],
+    }
+    result = {'workers': workers}
+    for label, args in arguments.items():
+        with gunicorn(args + ['--workers', str(workers)], timeout=timeout) as (_, first_200):
+            result[f'{label}_first_200_s'] = first_200
+    return result
+
+
+@contextmanager
+def gunicorn(args, env=None, timeout=60):
+    """
+    Runs ``gunicorn config.wsgi`` with ``args`` on a free local port until the block exits.
+    Yields its base URL and the seconds to its first 200 from /metrics (None if it never came up).
+    """
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    started = time.perf_counter()
+    process = subprocess.Popen(['gunicorn', 'config.wsgi'] + args + ['--bind', f'127.0.0.1:{port}'],
+                               cwd=str(settings.ROOT_DIR), env=dict(os.environ, **(env or {})),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        base_url = f'http://127.0.0.1:{port}'
+        yield base_url, _first_200(f'{base_url}/metrics', started, timeout)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def server_database_url():
+    """
+    DATABASE_URL of the benchmark database for a server run in another process, None when
+    only this process can reach it (in-memory SQLite, the default test database).
+    """
+    settings_dict = connection.settings_dict
+    if connection.vendor == 'sqlite':
+        return None if connection.is_in_memory_db() else f'sqlite:///{settings_dict["NAME"]}'
+    if connection.vendor == 'postgresql':
+        credentials = f'{quote(settings_dict["USER"] or "", safe="")}:{quote(settings_dict["PASSWORD"] or "", safe="")}'
+        return (f'postgres://{credentials}@{settings_dict["HOST"] or "localhost"}:{settings_dict["PORT"] or 5432}'
+                f'/{settings_dict["NAME"]}')
+    return None
+
+
+def _first_200(url, started, timeout):
+    while time.perf_counter() - started < timeout:
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return round(time.perf_counter() - started, 3)
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.01)
+    return None
@@ -0,0 +1,102 @@
+import io
+from itertools import islice
+
+from django.db import connections, router
+
+# Rows per INSERT statement when COPY can't be used
+INSERT_BATCH_SIZE = 1000
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def copy_rows(model, fields, rows, batch_size=10000, table=None, using=None):
+    """
+    Streams ``rows`` (tuples in ``fields`` order) into the model's table, ``batch_size`` at a time.
+    Uses COPY FROM STDIN on Postgres (a multi-row INSERT when COPY can't be used, see
+    ``can_copy``) and bulk_create elsewhere. ``table`` overrides the destination on Postgres
+    (e.g. a staging table with the same columns). Returns the number of rows written.
+    """
+    using = using or router.db_for_write(model)
+    connection = connections[using]
+    columns = [model._meta.get_field(name).column for name in fields]
+    quote = connection.ops.quote_name
+    target = f'{quote(table or model._meta.db_table)} ({", ".join(quote(column) for column in columns)})'
+    written = 0
+
+    for batch in batched(rows, batch_size):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                if can_copy(connection):
+                    buffer = io.BytesIO(b''.join(_csv_line([_copy_value(value) for value in row]) for row in batch))
+                    cursor.copy_expert(f'COPY {target} FROM STDIN WITH (FORMAT csv)', buffer)
+                else:
+                    placeholders = '(' + ', '.join(['%s'] * len(columns)) + ')'
+                    for chunk in batched(batch, INSERT_BATCH_SIZE):
+                        cursor.execute(f'INSERT INTO {target} VALUES {", ".join([placeholders] * len(chunk))}',
+                                       [value for row in chunk for value in row])
+        else:
+            model.objects.using(using).bulk_create([model(**dict(zip(fields, row))) for row in batch],
+                                                   batch_size=batch_size)
+        written += len(batch)
+    return written
+
+
+def copy_to(connection, table, file):
+    """
+    Writes the rows of ``table`` to the binary ``file`` as CSV with a header line, the format of
+    ``COPY ... TO STDOUT WITH (FORMAT csv, HEADER)`` (Postgres). Without COPY (see ``can_copy``),
+    the rows are read as text through a server-side cursor and quoted the way COPY does.
+    """
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        if can_copy(connection):
+            cursor.copy_expert(f'COPY {quote(table)} TO STDOUT WITH (FORMAT csv, HEADER)', file)
+            return
+        columns = [column.name for column in connection.introspection.get_table_description(cursor, table)]
+    file.write(_csv_line(columns))
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(f'SELECT {", ".join(f"{quote(column)}::text" for column in columns)} FROM {quote(table)}')
+        for row in cursor:
+            file.write(_csv_line(row))
+
+
+def _csv_line(values):
+    # COPY's CSV: NULL is an empty unquoted field, so empty strings are quoted
+    fields = []
+    for value in values:
+        if value is None:
+            fields.append('')
+        elif value == '' or value == '\\.' or any(char in value for char in ',"\r\n'):
+            fields.append('"' + value.replace('"', '""') + '"')
+        else:
+            fields.append(value)
+    return (','.join(fields) + '\n').encode('utf-8')
+
+
+def can_copy(connection):
+    """
+    Whether ``copy_expert`` works on the connection: only on Postgres, and not when psycopg2
+    runs green (the gevent wait callback installed by apps.common.db.pool), it refuses COPY then.
+    """
+    if connection.vendor != 'postgresql':
+        return False
+    from psycopg2 import extensions
+
+    return extensions.get_wait_callback() is None
+
+
+def _copy_value(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
@@ -0,0 +1,102 @@
+import threading
+import time
+
+from django.core.cache import caches
+
+from apps.common.routers import read_from
+
+
+class VersionedCache:
+    """
+    Read-through cache for per-object payloads.
+
+    Every object has a version counter; payloads are stored under ``<namespace>:<pk>:<version>``,
+    so bumping the version makes all older payloads unreachable without deleting them
+    (they age out through the cache's own eviction). Call ``bump`` after the write is
+    committed, otherwise a concurrent reader could store pre-commit data under the new version.
+
+    A missing counter is seeded from the clock instead of 1, so a counter evicted from the
+    cache can never come back pointing at a stale payload. ``compute`` reads from the primary
+    database: a lagging replica could otherwise store old data under the current version.
+    """
+
+    def __init__(self, namespace, timeout=3600, alias='default'):
+        self.namespace = namespace
+        self.timeout = timeout
+        self.alias = alias
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0}
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def version_key(self, pk):
+        return f'{self.namespace}:{pk}:version'
+
+    def get_version(self, pk):
+        version = self.cache.get(self.version_key(pk))
+        if version is None:
+            version = self._seed()
+            if not self.cache.add(self.version_key(pk), version, timeout=None):
+                version = self.cache.get(self.version_key(pk), version)
+        return version
+
+    def bump(self, pk):
+        try:
+            return self.cache.incr(self.version_key(pk))
+        except ValueError:
+            version = self._seed()
+            self.cache.set(self.version_key(pk), version, timeout=None)
+            return version
+
+    def get_or_set(self, pk, compute):
+        key = f'{self.namespace}:{pk}:{self.get_version(pk)}'
+        value = self.cache.get(key)
+        if value is not None:
+            self._count('hits')
+            return value
+
+        self._count('misses')
+        with read_from(None):
+            value = compute()
+        self.cache.set(key, value, timeout=self.timeout)
+        return value
+
+    def get_many_or_set(self, pks, compute):
+        """
+        ``{pk: payload}`` for several objects with one ``get_many`` for the versions and one
+        for the payloads. ``compute(missing)`` returns ``{pk: payload}`` for the pks not cached.
+        """
+        versions = self.cache.get_many([self.version_key(pk) for pk in pks])
+        keys = {}
+        for pk in pks:
+            version = versions.get(self.version_key(pk))
+            if version is None:
+                version = self.get_version(pk)
+            keys[pk] = f'{self.namespace}:{pk}:{version}'
+        cached = self.cache.get_many(list(keys.values()))
+        result = {pk: cached[key] for pk, key in keys.items() if cached.get(key) is not None}
+        missing = [pk for pk in pks if pk not in result]
+        self._count('hits', len(result))
+        if not missing:
+            return result
+
+        self._count('misses', len(missing))
+        with read_from(None):
+            computed = compute(missing)
+        self.cache.set_many({keys[pk]: value for pk, value in computed.items()}, timeout=self.timeout)
+        result.update(computed)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._stats[name] += n
+
+    @staticmethod
+    def _seed():
+        return int(time.time() * 1000000)
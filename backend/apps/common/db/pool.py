@@ -0,0 +1,246 @@
+"""
+Per-process database connection pools.
+
+Django opens a connection per thread (per greenlet under gevent) and closes it at the end of
+every request, so each request pays a connect and a busy gevent worker can hold as many
+connections as it has greenlets. A pool keeps up to DATABASE_POOL_SIZE connections per alias
+and worker process: requests check one out, and hand it back instead of closing it. When all
+of them are in use, requests wait (cooperatively, threading is monkey patched under gevent) up
+to DATABASE_POOL_TIMEOUT seconds. Pool state is exported on /metrics.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+from django.conf import settings
+
+from apps.common import metrics
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    pass
+
+
+class ConnectionPool:
+    """
+    At most ``max_size`` open connections. Idle ones are reused newest first, so the others
+    age out after ``max_idle`` seconds when load drops.
+    """
+
+    def __init__(self, alias, max_size=10, timeout=10.0, max_idle=300.0, max_lifetime=3600.0,
+                 check_after=5.0):
+        self.alias = alias
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.check_after = check_after
+        self._condition = threading.Condition()
+        # (connection, opened at, returned at), most recently returned last
+        self._idle = deque()
+        self._opened_at = {}
+        self.size = self.in_use = self.waiting = 0
+        self.opened = self.timeouts = 0
+
+    @property
+    def idle(self):
+        return len(self._idle)
+
+    def acquire(self, connect):
+        """
+        An idle connection in autocommit mode, or a new one from ``connect()``.
+        Raises PoolTimeout when the pool is full and nothing frees up in time.
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+        with self._condition:
+            self._close_idle(started)
+            self.waiting += 1
+            try:
+                while not self._idle and self.size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(f'No connection to "{self.alias}" freed up in {self.timeout}s')
+                    self._condition.wait(remaining)
+            finally:
+                self.waiting -= 1
+            item = self._idle.pop() if self._idle else None
+            if item is None:
+                self.size += 1
+            self.in_use += 1
+        POOL_WAIT_SECONDS.observe((self.alias,), time.monotonic() - started)
+
+        try:
+            if item is not None:
+                connection = self._checked(*item)
+                if connection is not None:
+                    return connection
+            return self._open(connect)
+        except BaseException:
+            with self._condition:
+                self.size -= 1
+                self.in_use -= 1
+                self._condition.notify()
+            raise
+
+    def release(self, connection):
+        """
+        Takes back a connection checked out with ``acquire``. An open transaction is rolled back,
+        broken or expired connections are closed.
+        """
+        now = time.monotonic()
+        reusable = not connection.closed and now - self._opened_at.get(connection, now) < self.max_lifetime
+        if reusable and connection.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                reusable = False
+        if reusable and not connection.autocommit:
+            connection.autocommit = True
+        with self._condition:
+            self.in_use -= 1
+            if reusable:
+                self._idle.append((connection, self._opened_at[connection], now))
+            else:
+                self._discard(connection)
+            self._condition.notify()
+
+    def close(self):
+        """
+        Closes the idle connections, checked out ones are closed when released.
+        """
+        with self._condition:
+            while self._idle:
+                self._discard(self._idle.popleft()[0])
+            self.max_lifetime = 0
+
+    def _open(self, connect):
+        connection = connect()
+        with self._condition:
+            self._opened_at[connection] = time.monotonic()
+            self.opened += 1
+        return connection
+
+    def _checked(self, connection, opened_at, returned_at):
+        # A connection idle for a while may have been dropped by the server or a proxy
+        now = time.monotonic()
+        usable = not connection.closed and now - opened_at < self.max_lifetime
+        if usable and now - returned_at >= self.check_after:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+            except psycopg2.Error:
+                usable = False
+        if usable:
+            return connection
+        with self._condition:
+            self._opened_at.pop(connection, None)
+        _close_quietly(connection)
+        return None
+
+    def _close_idle(self, now):
+        while self._idle and now - self._idle[0][2] >= self.max_idle:
+            self._discard(self._idle.popleft()[0])
+
+    def _discard(self, connection):
+        self.size -= 1
+        self._opened_at.pop(connection, None)
+        _close_quietly(connection)
+
+
+def _close_quietly(connection):
+    try:
+        connection.close()
+    except psycopg2.Error:
+        pass
+
+
+def gevent_wait_callback(connection, timeout=None):
+    """
+    Lets other greenlets run while psycopg2 waits for the server.
+    """
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        state = connection.poll()
+        if state == extensions.POLL_OK:
+            return
+        if state == extensions.POLL_READ:
+            wait_read(connection.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(connection.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f'Bad result from poll: {state}')
+
+
+def _make_green():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return
+    if monkey.is_module_patched('socket') and extensions.get_wait_callback() is None:
+        extensions.set_wait_callback(gevent_wait_callback)
+
+
+def get_pool(alias):
+    """
+    The pool of ``alias`` in this process. A forked worker starts with empty pools,
+    the parent's connections can't be shared.
+    """
+    key = (os.getpid(), alias)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                for stale in [other for other in _pools if other[0] != os.getpid()]:
+                    del _pools[stale]
+                _make_green()
+                pool = _pools[key] = ConnectionPool(
+                    alias,
+                    max_size=settings.DATABASE_POOL_SIZE,
+                    timeout=settings.DATABASE_POOL_TIMEOUT,
+                    max_idle=settings.DATABASE_POOL_MAX_IDLE,
+                    max_lifetime=settings.DATABASE_POOL_MAX_LIFETIME,
+                )
+    return pool
+
+
+def close_pool(alias):
+    """
+    Closes and forgets the pool of ``alias`` in this process, e.g. before the database it
+    connects to is dropped or replaced. The next connection starts a new pool.
+    """
+    with _pools_lock:
+        pool = _pools.pop((os.getpid(), alias), None)
+    if pool is not None:
+        pool.close()
+
+
+def collect(field):
+    def values():
+        return {(pool.alias,): getattr(pool, field) for (pid, _), pool in list(_pools.items()) if pid == os.getpid()}
+    return values
+
+
+POOL_WAIT_SECONDS = metrics.registry.histogram(
+    'db_pool_wait_seconds', 'Time spent waiting for a pooled database connection', ['alias'])
+metrics.registry.gauge('db_pool_connections', 'Open pooled database connections', ['alias'], collect('size'))
+metrics.registry.gauge('db_pool_connections_in_use', 'Pooled database connections checked out', ['alias'],
+                       collect('in_use'))
+metrics.registry.gauge('db_pool_connections_idle', 'Pooled database connections ready for reuse', ['alias'],
+                       collect('idle'))
+metrics.registry.gauge('db_pool_waiting', 'Requests waiting for a pooled database connection', ['alias'],
+                       collect('waiting'))
+metrics.registry.gauge('db_pool_opened_total', 'Database connections opened by the pool', ['alias'],
+                       collect('opened'), kind='counter')
+metrics.registry.gauge('db_pool_timeouts_total', 'Requests that gave up waiting for a pooled connection',
+                       ['alias'], collect('timeouts'), kind='counter')
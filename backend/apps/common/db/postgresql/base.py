@@ -0,0 +1,32 @@
+"""
+PostgreSQL backend that checks connections out of a per-process pool (apps.common.db.pool)
+and returns them on close, instead of connecting for every request.
+"""
+import weakref
+
+from django.db.backends.postgresql import base
+
+from apps.common.db.pool import get_pool
+from apps.common.db.postgresql.creation import DatabaseCreation
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_new_connection(self, conn_params):
+        pool = get_pool(self.alias)
+        connection = pool.acquire(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+        self.isolation_level = self.settings_dict['OPTIONS'].get('isolation_level', connection.isolation_level)
+        # Gives the connection back if the thread or greenlet ends without closing it
+        self._pool_release = weakref.finalize(self, pool.release, connection)
+        return connection
+
+    def _close(self):
+        if self.connection is None:
+            return
+        if self.in_atomic_block:
+            # The wrapper holds on to the connection until the atomic block exits,
+            # so it must not be handed out meanwhile
+            with self.wrap_database_errors:
+                self.connection.close()
+        self._pool_release()
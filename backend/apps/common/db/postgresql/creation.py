@@ -0,0 +1,18 @@
+from django.db.backends.postgresql import creation
+
+from apps.common.db.pool import close_pool
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+    """
+    Test databases replace the configured one under the same alias: the pooled connections
+    must not outlive the switch, nor keep the test database from being dropped.
+    """
+
+    def create_test_db(self, *args, **kwargs):
+        close_pool(self.connection.alias)
+        return super().create_test_db(*args, **kwargs)
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        close_pool(self.connection.alias)
+        super()._destroy_test_db(test_database_name, verbosity)
@@ -0,0 +1,134 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import (
+    override_settings, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+from django.utils import timezone
+from django.utils.module_loading import autodiscover_modules
+
+from apps.common.benchmarks import MICRO_BENCHMARKS, SCENARIOS, Context, HttpClient, InProcessClient, summarize
+
+
+class Command(BaseCommand):
+    help = ('Seeds users and drives concurrent clients against the API, '
+            'reporting throughput and p50/p95/p99 latency per endpoint as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help='Scenario names (default: all)')
+        parser.add_argument('--list', action='store_true', help='List available scenarios and exit')
+        parser.add_argument('--users', type=int, default=1000, help='Number of users to seed')
+        parser.add_argument('--transactions', type=int, default=100000,
+                            help='Budget transactions to seed (spread over the first 100 users\' budgets)')
+        parser.add_argument('--requests', type=int, default=500, help='Requests per scenario')
+        parser.add_argument('--concurrency', type=int, default=8,
+                            help='Concurrent clients (SQLite serializes writes, prefer Postgres above 1)')
+        parser.add_argument('--warmup', type=int, default=20, help='Unmeasured requests per scenario')
+        parser.add_argument('--url', help='Benchmark a running server at this base URL instead of in-process. '
+                                          'Seeds into the configured database and removes the data afterwards')
+        parser.add_argument('--no-isolate', action='store_true',
+                            help='In-process mode: use the configured database instead of a throwaway test one')
+        parser.add_argument('--without-middleware', action='append', default=[],
+                            help='In-process mode: drop this middleware, to measure its overhead')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        autodiscover_modules('benchmarks')
+        available = set(SCENARIOS) | set(MICRO_BENCHMARKS)
+        if options['list']:
+            for name in sorted(available):
+                self.stdout.write(name)
+            return
+
+        names = options['scenarios'] or sorted(available)
+        unknown = set(names) - available
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+
+        isolate = not options['url'] and not options['no_isolate']
+        if isolate:
+            setup_test_environment()
+            old_config = setup_databases(verbosity=0, interactive=False)
+
+        context = Context()
+        context.extra['transactions'] = options['transactions']
+        context.extra['concurrency'] = options['concurrency']
+        middleware = [path for path in settings.MIDDLEWARE if path not in options['without_middleware']]
+        try:
+            with override_settings(MIDDLEWARE=middleware):
+                started = time.perf_counter()
+                context.seed_users(options['users'])
+                seed_time = time.perf_counter() - started
+                results = [self.run_scenario(SCENARIOS[name](context), options) if name in SCENARIOS
+                           else self.run_micro(name, context) for name in names]
+        finally:
+            if isolate:
+                teardown_databases(old_config, verbosity=0)
+                teardown_test_environment()
+            else:
+                context.cleanup()
+
+        report = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'mode': 'http' if options['url'] else 'in-process',
+                'url': options['url'],
+                'database': connection.vendor,
+                'users': options['users'],
+                'transactions': options['transactions'],
+                'seed_time_s': round(seed_time, 3),
+                'requests': options['requests'],
+                'concurrency': options['concurrency'],
+                'without_middleware': options['without_middleware'],
+            },
+            'results': results,
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+    def run_scenario(self, scenario, options):
+        scenario.setup()
+
+        def client():
+            return HttpClient(options['url']) if options['url'] else InProcessClient()
+
+        def worker(indexes):
+            http = client()
+            samples = []
+            try:
+                for i in indexes:
+                    samples.append(http.send(*scenario.request(i)))
+            finally:
+                # Runs in pool threads only, the main thread keeps the (possibly in-memory) test database
+                connections.close_all()
+            return samples
+
+        concurrency = max(1, options['concurrency'])
+        # Request i goes to client i % concurrency, so scenarios can rely on distinct indexes.
+        # Warm-up indexes follow the measured ones so one-shot data (e.g. reset tokens) stays unused.
+        chunks = [range(n, options['requests'], concurrency) for n in range(concurrency)]
+        warmup = range(options['requests'], options['requests'] + options['warmup'])
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            executor.submit(worker, warmup).result()
+            started = time.perf_counter()
+            samples = [sample for chunk in executor.map(worker, chunks) for sample in chunk]
+            wall_time = time.perf_counter() - started
+
+        result = summarize(scenario.name, samples, wall_time, scenario.expected_statuses)
+        self.stderr.write(f'{scenario.name}: {result["throughput_rps"]} req/s, '
+                          f'p50 {result["p50_ms"]} ms, p99 {result["p99_ms"]} ms, {result["errors"]} errors')
+        return result
+
+    def run_micro(self, name, context):
+        result = dict(scenario=name, **MICRO_BENCHMARKS[name](context))
+        self.stderr.write(f'{name}: {result}')
+        return result
@@ -0,0 +1,133 @@
+import random
+import time
+from datetime import datetime, time as dt_time, timedelta
+from decimal import Decimal
+from uuid import UUID
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from apps.budgets import rollups
+from apps.budgets.models import Budget, Category, Membership, Transaction
+from apps.common.bulk import copy_rows
+from apps.users.models import User
+
+FIXTURES_PASSWORD = 'fixtures-password'
+FIRST_NAMES = ['Anna', 'Piotr', 'Maria', 'Jan', 'Katarzyna', 'Tomasz', 'Agnieszka', 'Pawel', 'Ewa', 'Michal']
+LAST_NAMES = ['Nowak', 'Kowalski', 'Wisniewski', 'Wojcik', 'Kowalczyk', 'Kaminski', 'Lewandowski', 'Zielinski']
+CATEGORY_NAMES = ['Salary', 'Rent', 'Groceries', 'Transport', 'Utilities', 'Health', 'Leisure', 'Clothes',
+                  'Education', 'Gifts', 'Savings', 'Other']
+
+
+class Command(BaseCommand):
+    help = ('Streams deterministic synthetic users, budgets and transactions into the database with '
+            'COPY (Postgres) or bulk_create, for benchmarks and staging. Every user has the password '
+            f'"{FIXTURES_PASSWORD}".')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--categories', type=int, default=8, help='Categories per budget (one budget per user)')
+        parser.add_argument('--shares', type=int, default=2, help='Other users each budget is shared with')
+        parser.add_argument('--transactions', type=int, default=10000,
+                            help='Transactions spread over all generated budgets')
+        parser.add_argument('--seed', type=int, default=0, help='Same seed, same data')
+        parser.add_argument('--until', type=lambda value: datetime.strptime(value, '%Y-%m-%d').date(),
+                            default=timezone.now().date(),
+                            help='Last day covered by generated dates (YYYY-MM-DD, default today)')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--email-prefix', default='user',
+                            help='Emails are <prefix><n>@fixtures.invalid, change it to add more users later')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.options = options
+        self.now = timezone.make_aware(datetime.combine(options['until'], dt_time.max.replace(microsecond=0)))
+
+        with transaction.atomic():
+            self.step('Users', self.generate_users)
+            self.step('Budgets', self.generate_budgets)
+            self.step('Memberships', self.generate_memberships)
+            self.step('Categories', self.generate_categories)
+            self.step('Transactions', self.generate_transactions)
+            # Loaded with COPY, bypassing Transaction.save, so the summaries are built in one pass
+            self.step('Monthly summaries', rollups.rebuild)
+
+    def step(self, label, generate):
+        started = time.perf_counter()
+        count = generate()
+        self.stdout.write(f'{label}: {count} rows in {time.perf_counter() - started:.1f}s')
+
+    def generate_users(self):
+        # Hashed once with a seed-derived salt, PBKDF2 per row would dominate the run
+        password = make_password(FIXTURES_PASSWORD, salt=f'fixtures{self.options["seed"]}')
+        prefix = self.options['email_prefix']
+        fields = ['password', 'last_login', 'is_superuser', 'email', 'first_name', 'last_name', 'avatar',
+                  'avatar_thumbnails', 'avatar_pending', 'token', 'is_admin', 'is_active', 'is_staff',
+                  'registered_at', 'updated_at']
+
+        def rows():
+            for n in range(self.options['users']):
+                registered_at = self.now - timedelta(seconds=self.rng.randrange(3 * 365 * 24 * 3600))
+                yield (password, None, False, f'{prefix}{n}@fixtures.invalid',
+                       self.rng.choice(FIRST_NAMES), self.rng.choice(LAST_NAMES), '', {}, False,
+                       UUID(int=self.rng.getrandbits(128), version=4), False, True, False, registered_at, self.now)
+
+        self.user_ids = self.copy(User, fields, rows())
+        return len(self.user_ids)
+
+    def generate_budgets(self):
+        rows = ((f'Home budget {n}', owner_id, self.now, self.now) for n, owner_id in enumerate(self.user_ids))
+        self.budget_ids = self.copy(Budget, ['name', 'owner_id', 'created_at', 'updated_at'], rows)
+        return len(self.budget_ids)
+
+    def generate_memberships(self):
+        # Budget n is shared with the owners of the next --shares budgets, alternately as editor and viewer
+        count = len(self.user_ids)
+        shares = min(self.options['shares'], count - 1)
+
+        def rows():
+            for n, (budget_id, owner_id) in enumerate(zip(self.budget_ids, self.user_ids)):
+                yield owner_id, budget_id, Membership.OWNER, self.now
+                for share in range(1, shares + 1):
+                    role = Membership.EDITOR if share % 2 else Membership.VIEWER
+                    yield self.user_ids[(n + share) % count], budget_id, role, self.now
+
+        return copy_rows(Membership, ['user_id', 'budget_id', 'role', 'created_at'], rows(),
+                         batch_size=self.options['batch_size'])
+
+    def generate_categories(self):
+        names = CATEGORY_NAMES[:self.options['categories']]
+        rows = ((budget_id, name) for budget_id in self.budget_ids for name in names)
+        ids = self.copy(Category, ['budget_id', 'name'], rows)
+        # Same order as the rows above: consecutive ids per budget
+        self.categories = {budget_id: ids[n * len(names):(n + 1) * len(names)]
+                           for n, budget_id in enumerate(self.budget_ids)}
+        return len(ids)
+
+    def generate_transactions(self):
+        if not self.budget_ids or not self.options['categories']:
+            return 0
+        fields = ['budget_id', 'category_id', 'kind', 'amount', 'date', 'description', 'created_by_id',
+                  'created_at']
+        owners = dict(zip(self.budget_ids, self.user_ids))
+        today = self.now.date()
+
+        def rows():
+            for _ in range(self.options['transactions']):
+                budget_id = self.rng.choice(self.budget_ids)
+                kind = Transaction.INCOME if self.rng.random() < 0.2 else Transaction.EXPENSE
+                amount = Decimal(self.rng.randrange(100, 500000)) / 100
+                day = today - timedelta(days=self.rng.randrange(3 * 365))
+                yield (budget_id, self.rng.choice(self.categories[budget_id]), kind, amount, day, '',
+                       owners[budget_id], self.now)
+
+        return copy_rows(Transaction, fields, rows(), batch_size=self.options['batch_size'])
+
+    def copy(self, model, fields, rows):
+        # Ids are assigned in insertion order, the new rows are the ones past the old maximum
+        last_id = model.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        copy_rows(model, fields, rows, batch_size=self.options['batch_size'])
+        return list(model.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True))
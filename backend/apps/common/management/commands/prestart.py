@@ -0,0 +1,66 @@
+import hashlib
+import os
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.staticfiles.finders import get_finders
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
+
+MANIFEST_NAME = '.collectstatic-manifest'
+
+
+def pending_migrations(using=DEFAULT_DB_ALIAS):
+    executor = MigrationExecutor(connections[using])
+    return executor.migration_plan(executor.loader.graph.leaf_nodes())
+
+
+def static_manifest():
+    """
+    Digest of the paths and contents of every file collectstatic would copy.
+    """
+    ignore_patterns = apps.get_app_config('staticfiles').ignore_patterns
+    found = {}
+    for finder in get_finders():
+        for path, storage in finder.list(ignore_patterns):
+            prefix = getattr(storage, 'prefix', None)
+            # The first finder that has a path wins, as in collectstatic
+            found.setdefault(os.path.join(prefix, path) if prefix else path, (storage, path))
+    digest = hashlib.sha1()
+    for prefixed_path, (storage, path) in sorted(found.items()):
+        digest.update(prefixed_path.encode('utf-8') + b'\0')
+        with storage.open(path) as f:
+            for chunk in iter(lambda: f.read(64 * 1024), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Command(BaseCommand):
+    help = ('Container start: applies pending migrations and collects static files, '
+            'skipping either step when there is nothing to do')
+
+    def handle(self, *args, **options):
+        # The post_migrate handlers (search indexes, partitioning the transactions table) run with
+        # the migrations that create their tables; the monthly partitions come from create_partitions
+        if pending_migrations():
+            call_command('migrate', interactive=False, verbosity=options['verbosity'])
+        else:
+            self.stdout.write('No migrations to apply')
+
+        manifest_path = os.path.join(settings.STATIC_ROOT, MANIFEST_NAME)
+        manifest = static_manifest()
+        try:
+            with open(manifest_path) as f:
+                unchanged = f.read() == manifest
+        except FileNotFoundError:
+            unchanged = False
+        if unchanged:
+            self.stdout.write('Static files unchanged')
+            return
+        call_command('collectstatic', interactive=False, verbosity=0)
+        # Written last, an interrupted collectstatic runs again on the next start
+        with open(manifest_path, 'w') as f:
+            f.write(manifest)
+        self.stdout.write('Static files collected')
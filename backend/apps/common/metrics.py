@@ -0,0 +1,149 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Greenlet-local under gevent (threading.local is monkey patched)
+_local = threading.local()
+
+
+def _label_set(pairs):
+    # No braces at all for a series without labels
+    pairs = ','.join(f'{name}="{value}"' for name, value in pairs)
+    return f'{{{pairs}}}' if pairs else ''
+
+
+class Histogram:
+    """
+    Cumulative histogram with Prometheus semantics, one series per label set.
+    """
+
+    def __init__(self, name, documentation, labelnames, buckets=TIME_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((labels, [list(counts), total, count])
+                            for labels, (counts, total, count) in self._series.items())
+        for labels, (counts, total, count) in series:
+            pairs = list(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_label_set(pairs + [("le", bound)])} {cumulative}')
+            lines.append(f'{self.name}_sum{_label_set(pairs)} {total}')
+            lines.append(f'{self.name}_count{_label_set(pairs)} {count}')
+        return '\n'.join(lines)
+
+
+class Gauge:
+    """
+    Values read at render time: ``collect()`` returns ``{labels: value}``.
+    ``kind`` is the Prometheus type, ``gauge`` or ``counter``.
+    """
+
+    def __init__(self, name, documentation, labelnames, collect, kind='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+        self.kind = kind
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for labels, value in sorted(self.collect().items()):
+            lines.append(f'{self.name}{_label_set(zip(self.labelnames, labels))} {value}')
+        return '\n'.join(lines)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def histogram(self, *args, **kwargs):
+        histogram = Histogram(*args, **kwargs)
+        self.metrics.append(histogram)
+        return histogram
+
+    def gauge(self, *args, **kwargs):
+        gauge = Gauge(*args, **kwargs)
+        self.metrics.append(gauge)
+        return gauge
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+
+registry = Registry()
+
+LABELS = ['route', 'method']
+REQUEST_SECONDS = registry.histogram('http_request_duration_seconds', 'Total time spent handling a request', LABELS)
+SERIALIZE_SECONDS = registry.histogram('http_request_serialize_seconds', 'Time spent in serializers', LABELS)
+DB_SECONDS = registry.histogram('http_request_db_seconds', 'Time spent in SQL (sampled requests)', LABELS)
+DB_QUERIES = registry.histogram('http_request_db_queries', 'SQL queries per request (sampled requests)', LABELS,
+                                buckets=COUNT_BUCKETS)
+
+
+class RequestRecord:
+    """
+    Timings collected for the request currently handled by this thread/greenlet.
+    """
+
+    def __init__(self, sampled):
+        self.sampled = sampled
+        self.db_time = 0.0
+        self.db_queries = 0
+        self.spans = {}
+
+    def db_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.db_queries += 1
+
+
+def start_record(sampled):
+    _local.record = RequestRecord(sampled)
+    return _local.record
+
+
+def end_record():
+    _local.record = None
+
+
+@contextmanager
+def span(name):
+    """
+    Adds the duration of the block to the current request's ``name`` timing.
+    A no-op outside of a request handled by InstrumentationMiddleware.
+    """
+    record = getattr(_local, 'record', None)
+    if record is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record.spans[name] = record.spans.get(name, 0.0) + time.perf_counter() - start
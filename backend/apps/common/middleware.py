@@ -0,0 +1,55 @@
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from apps.common import metrics
+
+
+class InstrumentationMiddleware:
+    """
+    Records total, serializer and (for sampled requests) SQL time and query count per
+    DRF route, exposes them as histograms on /metrics and in a Server-Timing header.
+
+    INSTRUMENTATION_SAMPLE_RATE controls how many requests get the per-query
+    execute_wrapper; total and serializer timings are recorded for every request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.INSTRUMENTATION_SAMPLE_RATE
+        self.server_timing = settings.SERVER_TIMING
+
+    def __call__(self, request):
+        sampled = self.sample_rate >= 1 or random.random() < self.sample_rate
+        record = metrics.start_record(sampled)
+        start = time.perf_counter()
+        try:
+            if sampled:
+                with ExitStack() as stack:
+                    for connection in connections.all():
+                        stack.enter_context(connection.execute_wrapper(record.db_wrapper))
+                    response = self.get_response(request)
+            else:
+                response = self.get_response(request)
+        finally:
+            metrics.end_record()
+        total = time.perf_counter() - start
+
+        match = request.resolver_match
+        labels = ((match.url_name or match.view_name) if match else 'unmatched', request.method)
+        serialize = record.spans.get('serialize', 0.0)
+        metrics.REQUEST_SECONDS.observe(labels, total)
+        metrics.SERIALIZE_SECONDS.observe(labels, serialize)
+        if sampled:
+            metrics.DB_SECONDS.observe(labels, record.db_time)
+            metrics.DB_QUERIES.observe(labels, record.db_queries)
+
+        if self.server_timing:
+            timings = [f'serialize;dur={serialize * 1000:.2f}', f'total;dur={total * 1000:.2f}']
+            if sampled:
+                timings.insert(0, f'db;dur={record.db_time * 1000:.2f};desc="{record.db_queries} queries"')
+            response['Server-Timing'] = ', '.join(timings)
+        return response
@@ -0,0 +1,128 @@
+import calendar
+import hashlib
+
+from django.conf import settings
+from django.db import InterfaceError, OperationalError
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.response import Response
+
+from apps.common.metrics import span
+from apps.common.routers import PIN_COOKIE, choose_replica, mark_unhealthy, read_from
+
+
+class FastListMixin:
+    """
+    Opt-in read path for ``list``: rows are fetched with ``.values(*columns)`` and turned
+    into dicts by ``fast_serializer_class`` instead of going through the serializer field
+    machinery. The fast serializer must produce the same output as ``serializer_class``.
+    """
+    fast_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        if self.fast_serializer_class is None:
+            return super().list(request, *args, **kwargs)
+
+        serializer = self.fast_serializer_class()
+        queryset = self.filter_queryset(self.get_queryset()).values(*serializer.columns)
+        page = self.paginate_queryset(queryset)
+        with span('serialize'):
+            data = serializer.serialize(page if page is not None else queryset)
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+
+class ReplicaReadMixin:
+    """
+    Serves safe-method requests from a read replica (see apps.common.routers) unless the
+    client wrote recently, and pins the client to the primary after a successful write.
+    A safe request whose replica fails is retried once on the primary.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in SAFE_METHODS:
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code < 400:
+                response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True,
+                                    samesite='Lax')
+            return response
+
+        alias = None if PIN_COOKIE in request.COOKIES else choose_replica()
+        if alias is None:
+            return super().dispatch(request, *args, **kwargs)
+        try:
+            with read_from(alias):
+                return super().dispatch(request, *args, **kwargs)
+        except (OperationalError, InterfaceError):
+            mark_unhealthy(alias)
+            return super().dispatch(request, *args, **kwargs)
+
+
+class ConditionalGetMixin:
+    """
+    Answers ``If-None-Match`` / ``If-Modified-Since`` on ``retrieve`` and ``list`` with a 304
+    before anything is loaded or serialized. ``retrieve`` validators come from a query of the
+    object's ``modified_field`` alone, ``list`` ones from the ids and ``modified_field`` of the
+    rows on the requested page (the paginator's own slice, so the cost doesn't grow with the
+    queryset), whether pages follow or precede it, and the query string. ETags include the
+    requesting user, whose role can shape the representation. The queryset must contain only
+    objects the requester may read: a 304 skips the object permission checks.
+    """
+    modified_field = 'updated_at'
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(self.object_validators(), super().retrieve, request, *args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(self.list_validators(), super().list, request, *args, **kwargs)
+
+    def object_validators(self):
+        """
+        ``(etag, last modified)`` of the requested object, ``(None, None)`` when it doesn't exist.
+        """
+        value = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+        modified = (self.filter_queryset(self.get_queryset()).filter(**{self.lookup_field: value})
+                    .values_list(self.modified_field, flat=True).first())
+        if modified is None:
+            return None, None
+        return self.make_etag(value, modified.isoformat()), modified
+
+    def list_validators(self):
+        queryset = self.filter_queryset(self.get_queryset()).values_list('pk', self.modified_field)
+        paginator = self.pagination_class() if self.pagination_class else None
+        page = paginator.paginate_queryset(queryset, self.request, view=self) if paginator else None
+        if page is None:
+            rows, links = list(queryset), None
+        else:
+            # A row added after the last one on the page adds a next link
+            rows, links = page, (paginator.has_next, paginator.has_previous)
+        rows = [(pk, modified.isoformat()) for pk, modified in rows]
+        # No Last-Modified, deleting an object doesn't move the latest modification
+        return self.make_etag(rows, links, self.request.get_full_path()), None
+
+    def make_etag(self, *parts):
+        digest = hashlib.sha1(repr((self.request.user.pk,) + parts).encode('utf-8')).hexdigest()
+        return f'W/"{digest}"'
+
+    def conditional(self, validators, handler, request, *args, **kwargs):
+        """
+        A 304 when the request's validators match, otherwise ``handler(request, ...)``.
+        """
+        etag, modified = validators
+        if etag is None:
+            return handler(request, *args, **kwargs)
+        timestamp = calendar.timegm(modified.utctimetuple()) if modified else None
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+        # Cacheable by the client only, and revalidated on every use
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
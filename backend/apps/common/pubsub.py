@@ -0,0 +1,310 @@
+"""
+In-process publish/subscribe, fed across worker processes by a broker.
+
+Each worker process has one Hub. Long-lived requests (see apps.common.sse) subscribe to
+channels and get a bounded queue each; the hub hands every published message to the queues
+of its channel without ever blocking the publisher. A subscriber that falls more than
+PUBSUB_QUEUE_SIZE messages behind loses its backlog and is flagged ``overflowed``, to resync
+from the REST API, instead of holding an unbounded amount of memory.
+
+Messages are published inside the writer's database transaction and delivered on commit:
+
+* ``postgres`` sends them with ``pg_notify`` (NOTIFY is transactional) and every worker runs
+  one listener on its own connection, which dispatches them to its hub;
+* ``local`` dispatches them to the publishing process' hub only, with ``on_commit``.
+  For a single process, and databases other than Postgres.
+
+Everything blocking goes through ``threading`` and ``select``, which gevent patches, so a
+waiting subscriber or the listener only park their greenlet.
+"""
+import json
+import logging
+import os
+import select
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from apps.common import metrics
+
+logger = logging.getLogger(__name__)
+
+_hubs = {}
+_hubs_lock = threading.Lock()
+
+
+class Subscription:
+    """
+    A subscriber's queue. ``get`` waits for messages, ``close`` unsubscribes.
+    """
+
+    def __init__(self, hub, channels, max_size):
+        self.hub = hub
+        self.channels = frozenset(channels)
+        self.max_size = max_size
+        self.overflowed = False
+        self.closed = False
+        self._queue = deque()
+        self._condition = threading.Condition()
+
+    @property
+    def pending(self):
+        return len(self._queue)
+
+    def put(self, channel, message):
+        with self._condition:
+            if len(self._queue) >= self.max_size:
+                self._queue.clear()
+                self.overflowed = True
+                self.hub.dropped += 1
+            else:
+                self._queue.append((channel, message))
+            self._condition.notify()
+
+    def reset(self):
+        """
+        Marks the subscriber as having missed messages, e.g. after the listener reconnected.
+        """
+        with self._condition:
+            self._queue.clear()
+            self.overflowed = True
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """
+        ``(messages, overflowed)``: the queued ``(channel, message)`` pairs, waiting up to
+        ``timeout`` seconds for the first one, and whether messages were lost before them.
+        """
+        with self._condition:
+            if not self._queue and not self.overflowed and not self.closed:
+                self._condition.wait(timeout)
+            messages, overflowed = list(self._queue), self.overflowed
+            self._queue.clear()
+            self.overflowed = False
+        return messages, overflowed
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify()
+        self.hub.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class Hub:
+
+    def __init__(self, max_subscribers=500, queue_size=100):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self._channels = {}
+        self._lock = threading.Lock()
+        self.subscribers = 0
+        self.dispatched = self.dropped = 0
+
+    def subscribe(self, channels):
+        """
+        A Subscription to ``channels``, or None when the process holds ``max_subscribers`` already.
+        """
+        subscription = Subscription(self, channels, self.queue_size)
+        with self._lock:
+            if self.subscribers >= self.max_subscribers:
+                return None
+            self.subscribers += 1
+            for channel in subscription.channels:
+                self._channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            removed = False
+            for channel in subscription.channels:
+                subscribers = self._channels.get(channel)
+                if subscribers is not None and subscription in subscribers:
+                    subscribers.discard(subscription)
+                    removed = True
+                    if not subscribers:
+                        del self._channels[channel]
+            if removed:
+                self.subscribers -= 1
+
+    def dispatch(self, channel, message):
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put(channel, message)
+        self.dispatched += len(subscribers)
+
+    def reset(self):
+        with self._lock:
+            subscribers = {subscription for channel in self._channels.values() for subscription in channel}
+        for subscription in subscribers:
+            subscription.reset()
+
+
+class LocalBroker:
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.ready = threading.Event()
+        self.ready.set()
+
+    def start(self):
+        pass
+
+    def publish(self, channel, message, using=DEFAULT_DB_ALIAS):
+        transaction.on_commit(lambda: self.hub.dispatch(channel, message), using=using)
+
+
+class PostgresBroker:
+    """
+    NOTIFY on the writer's connection, LISTEN on one dedicated connection per process.
+    Postgres caps payloads at 8000 bytes, messages are meant to be small.
+    """
+
+    def __init__(self, hub, alias=DEFAULT_DB_ALIAS, channel='app_events', poll_timeout=5.0):
+        self.hub = hub
+        self.alias = alias
+        self.channel = channel
+        self.poll_timeout = poll_timeout
+        # Set while the listener is connected
+        self.ready = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message, using=DEFAULT_DB_ALIAS):
+        payload = json.dumps([channel, message], separators=(',', ':'))
+        with connections[using].cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, payload])
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.listen, name='pubsub-listener', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """
+        Ends the listener (within ``poll_timeout``) and closes its connection.
+        """
+        self._stopping.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def listen(self):
+        import psycopg2
+
+        backoff = 0.5
+        while not self._stopping.is_set():
+            try:
+                connection = self.connect()
+            except psycopg2.Error:
+                logger.warning('pubsub: cannot connect to listen, retrying in %.1fs', backoff, exc_info=True)
+                self._stopping.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+                continue
+            backoff = 0.5
+            self.ready.set()
+            try:
+                self.receive(connection)
+            except (OSError, psycopg2.Error):
+                logger.warning('pubsub: listener connection lost', exc_info=True)
+            finally:
+                self.ready.clear()
+                try:
+                    connection.close()
+                except psycopg2.Error:
+                    pass
+            if not self._stopping.is_set():
+                # Whatever was published while reconnecting is lost
+                self.hub.reset()
+
+    def connect(self):
+        import psycopg2
+
+        wrapper = connections[self.alias]
+        # Not from the pool (apps.common.db.pool): this connection is held for the process' lifetime
+        connection = psycopg2.connect(**wrapper.get_connection_params())
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {wrapper.ops.quote_name(self.channel)}')
+        return connection
+
+    def receive(self, connection):
+        while not self._stopping.is_set():
+            if select.select([connection], [], [], self.poll_timeout) == ([], [], []):
+                # Nothing for a while, make sure the connection is still alive
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+            connection.poll()
+            while connection.notifies:
+                notify = connection.notifies.pop(0)
+                try:
+                    channel, message = json.loads(notify.payload)
+                except ValueError:
+                    logger.warning('pubsub: ignoring malformed payload %r', notify.payload[:200])
+                    continue
+                self.hub.dispatch(channel, message)
+
+
+def get_hub():
+    """
+    This process' hub and broker. Created (and the listener started) on first use, in the
+    worker, so a preloaded master never starts a listener its forks would share.
+    """
+    pid = os.getpid()
+    entry = _hubs.get(pid)
+    if entry is None:
+        with _hubs_lock:
+            entry = _hubs.get(pid)
+            if entry is None:
+                _hubs.clear()
+                hub = Hub(max_subscribers=settings.PUBSUB_MAX_SUBSCRIBERS, queue_size=settings.PUBSUB_QUEUE_SIZE)
+                entry = _hubs[pid] = (hub, make_broker(hub))
+    return entry
+
+
+def make_broker(hub):
+    if settings.PUBSUB_BROKER == 'postgres' and connections[DEFAULT_DB_ALIAS].vendor == 'postgresql':
+        return PostgresBroker(hub)
+    return LocalBroker(hub)
+
+
+def publish(channel, message, using=DEFAULT_DB_ALIAS):
+    """
+    Sends ``message`` (JSON-serializable) to the subscribers of ``channel`` in every worker
+    once the current transaction on ``using`` commits.
+    """
+    get_hub()[1].publish(channel, message, using=using)
+
+
+def subscribe(channels):
+    """
+    A Subscription to ``channels`` in this process (see Hub.subscribe), the listener started.
+    """
+    hub, broker = get_hub()
+    broker.start()
+    return hub.subscribe(channels)
+
+
+def collect(field):
+    def values():
+        entry = _hubs.get(os.getpid())
+        return {(): getattr(entry[0], field)} if entry else {}
+    return values
+
+
+metrics.registry.gauge('pubsub_subscribers', 'Open event stream subscriptions', [], collect('subscribers'))
+metrics.registry.gauge('pubsub_dispatched_total', 'Messages handed to subscribers', [], collect('dispatched'),
+                       kind='counter')
+metrics.registry.gauge('pubsub_dropped_total', 'Subscriber backlogs dropped for falling behind', [],
+                       collect('dropped'), kind='counter')
@@ -0,0 +1,118 @@
+"""
+Read replica routing.
+
+Requests opt in through ReplicaReadMixin: safe-method requests pick a replica round-robin,
+skipping ones that are unreachable or lag more than REPLICA_MAX_LAG, and every query of the
+request reads from it. Writes always go to the primary, and a client that has just written
+reads from the primary for REPLICA_PIN_SECONDS (a cookie), so it sees its own writes.
+Without DATABASE_REPLICAS everything stays on ``default``.
+"""
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = 'db_primary'
+
+# Greenlet-local under gevent (threading.local is monkey patched)
+_local = threading.local()
+_rotation = itertools.count()
+_health = {}
+
+
+def replica_lag(alias):
+    """
+    Seconds the replica is behind, 0 when it has replayed everything it received.
+    """
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        connection.ensure_connection()
+        return 0.0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+            'ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END'
+        )
+        return float(cursor.fetchone()[0])
+
+
+def is_healthy(alias):
+    now = time.monotonic()
+    checked = _health.get(alias)
+    if checked and now - checked[0] < settings.REPLICA_CHECK_INTERVAL:
+        return checked[1]
+    try:
+        lag = replica_lag(alias)
+        healthy = lag <= settings.REPLICA_MAX_LAG
+        if not healthy:
+            logger.warning('Replica %s is %.1fs behind, skipping it', alias, lag)
+    except DatabaseError:
+        logger.warning('Replica %s is unreachable, skipping it', alias, exc_info=True)
+        healthy = False
+    _health[alias] = (now, healthy)
+    return healthy
+
+
+def mark_unhealthy(alias):
+    _health[alias] = (time.monotonic(), False)
+
+
+def choose_replica():
+    """
+    The next healthy replica in round-robin order, or None for the primary.
+    """
+    replicas = settings.DATABASE_REPLICAS
+    if not replicas:
+        return None
+    start = next(_rotation)
+    for offset in range(len(replicas)):
+        alias = replicas[(start + offset) % len(replicas)]
+        if is_healthy(alias):
+            return alias
+    return None
+
+
+@contextmanager
+def read_from(alias):
+    """
+    Routes the reads inside the block to ``alias`` (None: the primary).
+    """
+    previous = getattr(_local, 'alias', None)
+    _local.alias = alias
+    try:
+        yield
+    finally:
+        _local.alias = previous
+
+
+def from_primary(instance):
+    """
+    ``instance`` itself if it was loaded from the primary, otherwise a fresh copy from it.
+    """
+    if instance._state.db in (None, DEFAULT_DB_ALIAS):
+        return instance
+    return type(instance)._default_manager.using(DEFAULT_DB_ALIAS).get(pk=instance.pk)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        return getattr(_local, 'alias', None)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
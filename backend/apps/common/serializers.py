@@ -0,0 +1,47 @@
+from django.conf import settings
+from rest_framework import serializers
+
+from apps.common.metrics import span
+
+
+class TimedSerializerMixin:
+    """
+    Reports the time spent building ``.data`` as the serialize timing of
+    InstrumentationMiddleware. Pair with ``Meta.list_serializer_class = TimedListSerializer``
+    to cover ``many=True`` as well.
+    """
+
+    @property
+    def data(self):
+        with span('serialize'):
+            return super().data
+
+
+class TimedListSerializer(TimedSerializerMixin, serializers.ListSerializer):
+    pass
+
+
+def batch_items(data):
+    """
+    The items of a batch request body: a JSON array of at most API_MAX_BATCH_SIZE items.
+    """
+    if not isinstance(data, list):
+        raise serializers.ValidationError({'non_field_errors': ['Expected a list of items.']})
+    if len(data) > settings.API_MAX_BATCH_SIZE:
+        raise serializers.ValidationError(
+            {'non_field_errors': [f'At most {settings.API_MAX_BATCH_SIZE} items per batch.']})
+    return data
+
+
+def item_ids(items, name):
+    """
+    The integer ``name`` values of not yet validated batch items, to load what they
+    reference with one query.
+    """
+    ids = set()
+    for item in items:
+        try:
+            ids.add(int(item.get(name)))
+        except (AttributeError, TypeError, ValueError):
+            pass
+    return ids
@@ -0,0 +1,82 @@
+"""
+Server-Sent Events responses fed by apps.common.pubsub subscriptions.
+
+The stream sends a comment every SSE_HEARTBEAT seconds, so proxies keep the connection open
+and a gone client is noticed at the next write, and ends after SSE_MAX_SECONDS: EventSource
+reconnects on its own (after the ``retry`` delay), which re-authenticates and re-checks access.
+"""
+import time
+
+import orjson
+
+from django.conf import settings
+from django.db import connections
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+
+RETRY_MS = 3000
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets DRF negotiate ``Accept: text/event-stream``; the stream itself bypasses rendering,
+    this only renders error responses.
+    """
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return format_event('error', data)
+
+
+def format_event(event, data, event_id=None):
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    lines.append(f'event: {event}')
+    lines.append('data: ' + orjson.dumps(data).decode('utf-8'))
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+def iter_events(subscription, encode, last=None, heartbeat=None, max_seconds=None):
+    """
+    Yields the SSE frames of a subscription. ``encode(channel, message)`` returns the frame
+    bytes for a message (``b''`` skips it), the stream ends after a message ``last(message)``
+    is true for.
+    """
+    heartbeat = heartbeat or settings.SSE_HEARTBEAT
+    deadline = time.monotonic() + (max_seconds or settings.SSE_MAX_SECONDS)
+    try:
+        yield f'retry: {RETRY_MS}\n\n'.encode('utf-8')
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            messages, overflowed = subscription.get(timeout=min(heartbeat, remaining))
+            if subscription.closed:
+                return
+            frames = []
+            if overflowed:
+                # Events were lost (slow client, broker reconnect): the client reloads from the API
+                frames.append(format_event('reset', {}))
+            for channel, message in messages:
+                frames.append(encode(channel, message))
+                if last is not None and last(message):
+                    yield b''.join(frames)
+                    return
+            yield b''.join(frames) or b': ping\n\n'
+    finally:
+        subscription.close()
+
+
+def event_stream_response(subscription, encode, last=None, **kwargs):
+    """
+    StreamingHttpResponse for ``iter_events``. The request's database connections are
+    closed first: the stream doesn't query and must not hold a pooled connection for its lifetime.
+    """
+    connections.close_all()
+    response = StreamingHttpResponse(iter_events(subscription, encode, last=last, **kwargs),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # nginx must pass events through as they come
+    response['X-Accel-Buffering'] = 'no'
+    return response
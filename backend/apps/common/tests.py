@@ -0,0 +1,480 @@
+import io
+import json
+import re
+import tempfile
+import threading
+from base64 import urlsafe_b64encode
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from uuid import UUID
+from unittest import mock, skipUnless
+
+import psycopg2
+from psycopg2 import extensions, extras
+
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from apps.budgets.models import Budget, Category, Transaction
+from apps.budgets.serializers import TransactionSerializer
+from apps.common import metrics, pubsub, routers
+from apps.common.bulk import can_copy, copy_rows
+from apps.common.db.pool import ConnectionPool, PoolTimeout
+from apps.common.management.commands import prestart
+from apps.common.pagination import EstimatedCountPaginator, estimated_count
+from apps.common.renderers import FastJSONRenderer
+from apps.users.models import User
+from apps.users.serializers import FastUserSerializer, UserSerializer
+
+
+def cursor(reverse, position):
+    payload = json.dumps([int(reverse), position], separators=(',', ':'))
+    return urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+class KeysetPaginationTests(TestCase):
+    """
+    The users list pages on ``(registered_at, id)``: ties on the first key are broken by the
+    second, cursors walk both ways and a cursor the pagination didn't issue is a 404.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        for i in range(7):
+            User.objects.create_user(email=f'page{i}@example.com', password='secret-pw')
+        # Three rows share a registration time, the id orders them
+        tied = datetime(2021, 1, 1, tzinfo=dt_timezone.utc)
+        User.objects.filter(email__in=['page1@example.com', 'page2@example.com', 'page5@example.com']).update(
+            registered_at=tied)
+        self.ordered = list(User.objects.order_by('registered_at', 'id').values_list('email', flat=True))
+
+    def page(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def emails(self, page):
+        return [user['email'] for user in page['results']]
+
+    def test_walk_forward_and_back(self):
+        pages, url = [], '/api/users?page_size=2'
+        while url:
+            page = self.page(url)
+            pages.append(page)
+            url = page['next']
+        self.assertEqual([email for page in pages for email in self.emails(page)], self.ordered)
+        self.assertEqual(len(pages), 4)
+        self.assertIsNone(pages[0]['previous'])
+
+        # Back from the last page, each previous link lands on the page before
+        for before, page in zip(reversed(pages[:-1]), reversed(pages[1:])):
+            self.assertEqual(self.emails(self.page(page['previous'])), self.emails(before))
+
+    def test_ties_on_the_first_key(self):
+        # A cursor on the first tied row continues with the others, by id
+        tied = list(User.objects.filter(registered_at=datetime(2021, 1, 1, tzinfo=dt_timezone.utc))
+                    .order_by('id').values_list('registered_at', 'id'))
+        position = [tied[0][0].isoformat(), str(tied[0][1])]
+        page = self.page(f'/api/users?page_size=2&cursor={cursor(False, position)}')
+        index = self.ordered.index(User.objects.get(pk=tied[0][1]).email)
+        self.assertEqual(self.emails(page), self.ordered[index + 1:index + 3])
+
+    def test_invalid_cursors(self):
+        for value in ['not-base64!', urlsafe_b64encode(b'{"a": 1}').decode('ascii'),
+                      cursor(False, ['2021-01-01T00:00:00+00:00']),
+                      cursor(False, ['yesterday', '1']),
+                      cursor(False, ['2021-01-01T00:00:00+00:00', 'one'])]:
+            response = self.client.get(f'/api/users?cursor={value}')
+            self.assertEqual(response.status_code, 404, value)
+
+
+class EstimatedCountTests(TestCase):
+
+    def setUp(self):
+        for i in range(3):
+            User.objects.create_user(email=f'count{i}@example.com', password='secret-pw')
+        self.queryset = User.objects.order_by('id')
+
+    @override_settings(ESTIMATED_COUNT_THRESHOLD=1000)
+    def test_estimate_above_the_threshold(self):
+        with mock.patch('apps.common.pagination.estimated_count', return_value=5000):
+            with self.assertNumQueries(0):
+                self.assertEqual(EstimatedCountPaginator(self.queryset, 100).count, 5000)
+        with mock.patch('apps.common.pagination.estimated_count', return_value=10):
+            self.assertEqual(EstimatedCountPaginator(self.queryset, 100).count, 3)
+
+    def test_exact_without_estimate(self):
+        if connection.vendor != 'postgresql':
+            self.assertIsNone(estimated_count(self.queryset))
+        self.assertEqual(EstimatedCountPaginator(self.queryset, 100).count, 3)
+
+
+class InstrumentationTests(TestCase):
+    """
+    Request timings in the Server-Timing header and as Prometheus histograms on /metrics.
+    """
+    sample = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[a-z_]+="[^"]*"(,[a-z_]+="[^"]*")*\})? -?[0-9.e+-]+$')
+
+    def setUp(self):
+        User.objects.create_user(email='timed@example.com', password='secret-pw')
+
+    def timings(self, response):
+        return dict(re.match(r'(\w+);dur=([0-9.]+)', timing).groups()
+                    for timing in response['Server-Timing'].split(', '))
+
+    def metric(self, line_start):
+        body = self.client.get('/metrics').content.decode('utf-8')
+        values = [line.rsplit(' ', 1)[1] for line in body.splitlines() if line.startswith(line_start)]
+        return float(values[0]) if values else 0.0
+
+    def test_server_timing(self):
+        response = self.client.get('/api/users')
+        self.assertEqual(response.status_code, 200)
+        timings = self.timings(response)
+        self.assertEqual(set(timings), {'db', 'serialize', 'total'})
+        self.assertLessEqual(float(timings['db']), float(timings['total']))
+        self.assertRegex(response['Server-Timing'], r'db;dur=[0-9.]+;desc="[1-9]\d* queries"')
+
+    @override_settings(INSTRUMENTATION_SAMPLE_RATE=0.0)
+    def test_unsampled_requests_skip_sql_timing(self):
+        queries = 'http_request_db_queries_count{route="user-list",method="GET"}'
+        before = self.metric(queries)
+        self.assertEqual(set(self.timings(self.client.get('/api/users'))), {'serialize', 'total'})
+        self.assertEqual(self.metric(queries), before)
+
+    @override_settings(SERVER_TIMING=False)
+    def test_header_off(self):
+        self.assertNotIn('Server-Timing', self.client.get('/api/users'))
+
+    def test_exposition(self):
+        count = 'http_request_duration_seconds_count{route="user-list",method="GET"}'
+        before = self.metric(count)
+        self.client.get('/api/users')
+        self.assertEqual(self.metric(count), before + 1)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        lines = response.content.decode('utf-8').splitlines()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', lines)
+        for line in lines:
+            if not line.startswith('#'):
+                self.assertRegex(line, self.sample)
+
+    def test_histogram_buckets(self):
+        histogram = metrics.Histogram('test_seconds', 'Test', ['route'], buckets=(0.001, 0.005, 0.1))
+        for value in [0.001, 0.003, 0.004, 2.0]:
+            histogram.observe(('a',), value)
+        lines = histogram.render().splitlines()
+        self.assertEqual(lines, [
+            '# HELP test_seconds Test',
+            '# TYPE test_seconds histogram',
+            # Upper bounds are inclusive, counts cumulative
+            'test_seconds_bucket{route="a",le="0.001"} 1',
+            'test_seconds_bucket{route="a",le="0.005"} 3',
+            'test_seconds_bucket{route="a",le="0.1"} 3',
+            'test_seconds_bucket{route="a",le="+Inf"} 4',
+            'test_seconds_sum{route="a"} 2.008',
+            'test_seconds_count{route="a"} 4',
+        ])
+
+
+class FastRenderingTests(TestCase):
+    """
+    The fast list path and FastJSONRenderer must give the bytes of DRF's serializers and JSONRenderer.
+    """
+
+    def setUp(self):
+        for i, (first, last) in enumerate([('Ann', 'Lee'), ('Zoë', 'Ünal'), ('Line\u2028sep', 'Para\u2029sep')]):
+            User.objects.create_user(email=f'fast{i}@example.com', password='secret-pw', first_name=first,
+                                     last_name=last)
+        # A registration time with microseconds
+        User.objects.filter(email='fast0@example.com').update(
+            registered_at=datetime(2021, 3, 28, 1, 30, 0, 123456, tzinfo=dt_timezone.utc))
+
+    def test_users_fast_path(self):
+        queryset = User.objects.order_by('registered_at', 'id')
+        drf = JSONRenderer().render(UserSerializer(queryset, many=True).data)
+        fast = FastJSONRenderer().render(FastUserSerializer().serialize(queryset.values(*FastUserSerializer.columns)))
+        self.assertEqual(fast, drf)
+
+        response = APIClient().get('/api/users')
+        expected = OrderedDict([('next', None), ('previous', None),
+                                ('results', UserSerializer(queryset, many=True).data)])
+        self.assertEqual(response.content, JSONRenderer().render(expected))
+
+    def test_decimals_and_datetimes(self):
+        owner = User.objects.get(email='fast0@example.com')
+        budget = Budget.objects.create(name='Home', owner=owner)
+        category = Category.objects.create(budget=budget, name='Food')
+        for amount in ['0.10', '12.00', '99999.99']:
+            Transaction.objects.create(budget=budget, category=category, kind=Transaction.EXPENSE,
+                                       amount=Decimal(amount), date=date(2021, 5, 1), description='Ünïcode')
+        data = TransactionSerializer(Transaction.objects.order_by('id'), many=True).data
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+        # Values as they are, before serializer fields turn them into strings
+        raw = {
+            'amounts': [Decimal('0.10'), Decimal('-3'), Decimal('1E+2')],
+            'at': [datetime(2021, 5, 1, 12, 0, 0, 5, tzinfo=dt_timezone(timedelta(hours=2))),
+                   datetime(2021, 5, 1, 12, 0)],
+            'day': date(2021, 5, 1),
+            'uuid': UUID('12345678-1234-5678-1234-567812345678'),
+            'text': 'Zoë \u2028',
+            1: None,
+        }
+        self.assertEqual(FastJSONRenderer().render(raw), JSONRenderer().render(raw))
+
+
+class CopyRowsTests(TestCase):
+
+    def test_can_copy(self):
+        postgres = mock.Mock(vendor='postgresql')
+        self.assertFalse(can_copy(mock.Mock(vendor='sqlite')))
+        self.assertEqual(can_copy(postgres), extensions.get_wait_callback() is None)
+        with mock.patch.object(extensions, 'get_wait_callback', return_value=extras.wait_select):
+            self.assertFalse(can_copy(postgres))
+
+    def test_copy(self):
+        owner = User.objects.create_user(email='copy@example.com', password='secret-pw')
+        budget = Budget.objects.create(name='Home', owner=owner)
+        names = ['Food', 'Rent, "flat"', 'Line\nbreak', '', '\\N', '\\.', 'Zoë']
+        self.assertEqual(copy_rows(Category, ['budget_id', 'name'], [(budget.pk, name) for name in names],
+                                   batch_size=2), len(names))
+        self.assertEqual(list(budget.categories.order_by('id').values_list('name', flat=True)), names)
+
+    @skipUnless(connection.vendor == 'postgresql', 'psycopg2 wait callbacks')
+    def test_copy_with_a_wait_callback(self):
+        # The gevent workers install one, copy_expert refuses to run under it
+        self.assertIsNone(extensions.get_wait_callback())
+        extensions.set_wait_callback(extras.wait_select)
+        try:
+            self.test_copy()
+        finally:
+            extensions.set_wait_callback(None)
+
+
+class FakeConnection:
+    """
+    The parts of a psycopg2 connection the pool uses. ``broken`` ones fail their health check.
+    """
+
+    def __init__(self):
+        self.closed = 0
+        self.autocommit = True
+        self.broken = False
+        self.info = mock.Mock(transaction_status=extensions.TRANSACTION_STATUS_IDLE)
+        self.rolled_back = 0
+
+    def cursor(self):
+        cursor = mock.MagicMock()
+        cursor.__enter__.return_value = cursor
+        if self.broken:
+            cursor.execute.side_effect = psycopg2.OperationalError('server closed the connection unexpectedly')
+        return cursor
+
+    def rollback(self):
+        self.rolled_back += 1
+        self.info.transaction_status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+class ConnectionPoolTests(TestCase):
+
+    def setUp(self):
+        self.connections = []
+
+    def connect(self):
+        self.connections.append(FakeConnection())
+        return self.connections[-1]
+
+    def pool(self, **kwargs):
+        return ConnectionPool('test', **dict({'max_size': 2, 'timeout': 0.05, 'check_after': 0}, **kwargs))
+
+    def test_acquire_and_release(self):
+        pool = self.pool()
+        first = pool.acquire(self.connect)
+        pool.acquire(self.connect)
+        self.assertEqual((pool.size, pool.in_use, pool.idle, pool.opened), (2, 2, 0, 2))
+        pool.release(first)
+        self.assertEqual((pool.size, pool.in_use, pool.idle), (2, 1, 1))
+        # Reused, not opened again
+        self.assertIs(pool.acquire(self.connect), first)
+        self.assertEqual(pool.opened, 2)
+
+    def test_release_rolls_back(self):
+        pool = self.pool()
+        connection = pool.acquire(self.connect)
+        connection.autocommit = False
+        connection.info.transaction_status = extensions.TRANSACTION_STATUS_INTRANS
+        pool.release(connection)
+        self.assertEqual((connection.rolled_back, connection.autocommit, pool.idle), (1, True, 1))
+
+    def test_timeout(self):
+        pool = self.pool(max_size=1)
+        connection = pool.acquire(self.connect)
+        with self.assertRaises(PoolTimeout):
+            pool.acquire(self.connect)
+        self.assertEqual((pool.timeouts, pool.waiting, pool.in_use), (1, 0, 1))
+
+        # A waiter gets the connection another request hands back
+        pool.timeout = 5
+        release = threading.Timer(0.05, pool.release, args=(connection,))
+        release.start()
+        self.assertIs(pool.acquire(self.connect), connection)
+        release.join()
+        self.assertEqual(pool.opened, 1)
+
+    def test_broken_connections_are_replaced(self):
+        pool = self.pool()
+        connection = pool.acquire(self.connect)
+        pool.release(connection)
+        connection.broken = True
+        replacement = pool.acquire(self.connect)
+        self.assertIsNot(replacement, connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual((pool.size, pool.opened), (1, 2))
+
+        # Closed while checked out: dropped on release
+        replacement.close()
+        pool.release(replacement)
+        self.assertEqual((pool.size, pool.in_use, pool.idle), (0, 0, 0))
+
+    def test_failed_connect_frees_the_slot(self):
+        pool = self.pool(max_size=1)
+        with self.assertRaises(psycopg2.OperationalError):
+            pool.acquire(mock.Mock(side_effect=psycopg2.OperationalError('could not connect')))
+        self.assertEqual((pool.size, pool.in_use), (0, 0))
+        pool.acquire(self.connect)
+
+    def test_expired_connections(self):
+        pool = self.pool(max_lifetime=0)
+        connection = pool.acquire(self.connect)
+        pool.release(connection)
+        self.assertTrue(connection.closed)
+        self.assertEqual(pool.size, 0)
+
+        pool = self.pool(max_idle=0)
+        connection = pool.acquire(self.connect)
+        pool.release(connection)
+        self.assertIsNot(pool.acquire(self.connect), connection)
+        self.assertTrue(connection.closed)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'LISTEN/NOTIFY is Postgres only')
+class PostgresBrokerTests(TransactionTestCase):
+    """
+    Messages go out with the writer's commit, to the listener of every process.
+    """
+
+    def setUp(self):
+        self.hub = pubsub.Hub()
+        self.broker = pubsub.PostgresBroker(self.hub, channel='test_events', poll_timeout=0.1)
+        self.subscription = self.hub.subscribe(['budget-1'])
+        self.broker.start()
+        self.addCleanup(self.broker.stop)
+        self.assertTrue(self.broker.ready.wait(5))
+
+    def test_delivered_on_commit(self):
+        with transaction.atomic():
+            self.broker.publish('budget-1', {'op': 'saved'})
+            self.broker.publish('budget-2', {'op': 'saved'})
+            self.assertEqual(self.subscription.get(timeout=0.3), ([], False))
+        self.assertEqual(self.subscription.get(timeout=5), ([('budget-1', {'op': 'saved'})], False))
+
+    def test_rolled_back(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.broker.publish('budget-1', {'op': 'saved'})
+            raise RuntimeError
+        self.broker.publish('budget-1', {'op': 'deleted'})
+        self.assertEqual(self.subscription.get(timeout=5), ([('budget-1', {'op': 'deleted'})], False))
+
+    def test_stop(self):
+        listener = self.broker._thread
+        self.broker.stop()
+        # The listener closes its connection on the way out
+        self.assertFalse(listener.is_alive())
+        self.assertFalse(self.broker.ready.is_set())
+        self.broker.publish('budget-1', {'op': 'saved'})
+        self.assertEqual(self.subscription.get(timeout=0.3), ([], False))
+
+
+class PrestartTests(TestCase):
+
+    def test_skips_what_has_not_changed(self):
+        with tempfile.TemporaryDirectory() as static_root, override_settings(STATIC_ROOT=static_root):
+            for expected in [['collectstatic'], []]:
+                out = io.StringIO()
+                with mock.patch.object(prestart, 'call_command') as called:
+                    call_command('prestart', stdout=out)
+                self.assertEqual([args[0] for args, _ in called.call_args_list], expected)
+                self.assertIn('No migrations to apply', out.getvalue())
+
+
+class ReplicaRouterTests(TransactionTestCase):
+    """
+    With a replica configured, safe API requests read from it, writes go to the primary and
+    pin the client to the primary, so it reads its own writes.
+    """
+
+    def setUp(self):
+        # A second SQLite database standing in for the replica, with rows of its own
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connections.databases['replica1'] = {'ENGINE': 'django.db.backends.sqlite3',
+                                             'NAME': f'{directory.name}/replica.sqlite3'}
+        connections.ensure_defaults('replica1')
+        connections.prepare_test_settings('replica1')
+        self.addCleanup(self.remove_replica)
+        with connections['replica1'].schema_editor() as editor:
+            editor.create_model(User)
+
+        routers._health.clear()
+        User.objects.create_user(email='primary@example.com', password='secret-pw')
+        User.objects.db_manager('replica1').create_user(email='replica@example.com', password='secret-pw')
+        self.client = APIClient()
+
+    def remove_replica(self):
+        connections['replica1'].close()
+        del connections['replica1']
+        del connections.databases['replica1']
+        routers._health.clear()
+
+    def emails(self):
+        response = self.client.get('/api/users')
+        self.assertEqual(response.status_code, 200)
+        return sorted(user['email'] for user in response.data['results'])
+
+    @override_settings(DATABASE_REPLICAS=['replica1'], REPLICA_PIN_SECONDS=5)
+    def test_routing(self):
+        self.assertEqual(self.emails(), ['replica@example.com'])
+
+        response = self.client.post('/api/users', {'email': 'new@example.com', 'password': 'secret-pw'},
+                                    format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(User.objects.using('default').filter(email='new@example.com').exists())
+        self.assertFalse(User.objects.using('replica1').filter(email='new@example.com').exists())
+        self.assertEqual(response.cookies[routers.PIN_COOKIE]['max-age'], 5)
+
+        # Pinned to the primary by the cookie, then back on the replica once it expires
+        self.assertEqual(self.emails(), ['new@example.com', 'primary@example.com'])
+        del self.client.cookies[routers.PIN_COOKIE]
+        self.assertEqual(self.emails(), ['replica@example.com'])
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_failed_writes_do_not_pin(self):
+        response = self.client.post('/api/users', {'email': 'not-an-email'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+        self.assertEqual(self.emails(), ['replica@example.com'])
+
+    @override_settings(DATABASE_REPLICAS=['replica1'])
+    def test_unhealthy_replica(self):
+        routers.mark_unhealthy('replica1')
+        self.assertEqual(self.emails(), ['primary@example.com'])
@@ -0,0 +1,11 @@
+from django.http import HttpResponse
+
+from apps.common import metrics
+
+
+def metrics_view(request):
+    """
+    Prometheus text exposition of the InstrumentationMiddleware histograms.
+    Values are per gunicorn worker process; not routed through nginx.
+    """
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
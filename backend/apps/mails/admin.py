@@ -0,0 +1,11 @@
+from django.contrib import admin
+
+from apps.mails.models import Mail
+
+
+@admin.register(Mail)
+class MailAdmin(admin.ModelAdmin):
+    list_display = ['subject', 'status', 'attempts', 'created_at', 'sent_at']
+    list_filter = ['status']
+    readonly_fields = ['attempts', 'last_error', 'created_at', 'sent_at']
+    ordering = ['-created_at']
@@ -0,0 +1,6 @@
+from django.apps import AppConfig
+
+
+class MailsConfig(AppConfig):
+    name = 'apps.mails'
+    verbose_name = 'Mails'
@@ -0,0 +1,125 @@
+import io
+import socketserver
+import threading
+import time
+
+from django.core.mail import send_mail
+from django.core.management import call_command
+from django.test import Client
+from django.test.utils import override_settings
+
+from apps.common.benchmarks import register_micro, timed
+from apps.mails.models import Mail
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """
+    Local SMTP stand-in that accepts every message and counts connections and messages.
+    It greets new connections after ``handshake`` seconds, the round trips a remote relay costs.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, handshake=0.0):
+        super().__init__(('127.0.0.1', 0), SMTPHandler)
+        self.handshake = handshake
+        self.connections = 0
+        self.messages = 0
+        self._lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def count(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        self.server.count('connections')
+        time.sleep(self.server.handshake)
+        self.reply('220 sink')
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line[:4].upper()
+            if command == b'EHLO':
+                self.reply('250-sink', '250 8BITMIME')
+            elif command == b'DATA':
+                self.reply('354 go ahead')
+                while self.rfile.readline() not in (b'.\r\n', b''):
+                    pass
+                self.server.count('messages')
+                self.reply('250 queued')
+            elif command == b'QUIT':
+                self.reply('221 bye')
+                return
+            else:
+                self.reply('250 ok')
+
+    def reply(self, *lines):
+        self.wfile.write(''.join(f'{line}\r\n' for line in lines).encode('ascii'))
+
+
+@register_micro('mails-outbox')
+def outbox_delivery(context, mails=200, resets=200, handshake_ms=20):
+    """
+    Latency of POST /api/users/password_reset/ (the mail is only queued), and mails/second
+    delivered to a local SMTP sink by send_mails over one reused connection, against
+    ``send_mail`` opening a connection per message as the endpoint used to. The sink takes
+    ``handshake_ms`` to greet a connection; on loopback connections would otherwise be free.
+    """
+    client = Client()
+    latencies = []
+    for i in range(resets):
+        elapsed, _ = timed(lambda: client.post('/api/users/password_reset/',
+                                               {'email': context.users[i % len(context.users)]['email']},
+                                               content_type='application/json'), repeat=1)
+        latencies.append(elapsed)
+    Mail.objects.all().delete()
+
+    result = {
+        'mails': mails,
+        'handshake_ms': handshake_ms,
+        'reset_mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+    }
+    sink = SMTPSink(handshake_ms / 1000)
+    smtp = {'EMAIL_BACKEND': 'django.core.mail.backends.smtp.EmailBackend', 'EMAIL_HOST': '127.0.0.1',
+            'EMAIL_PORT': sink.port, 'EMAIL_USE_TLS': False}
+    with sink, override_settings(**smtp):
+        Mail.objects.bulk_create(Mail(subject='Bench', message='Body', from_email='bench@example.com',
+                                      recipients=[f'bench{i}@example.com']) for i in range(mails))
+        started = time.perf_counter()
+        call_command('send_mails', once=True, stdout=io.StringIO())
+        outbox_time = time.perf_counter() - started
+        result.update({
+            'outbox_mails_per_s': round(mails / outbox_time, 1),
+            'outbox_connections': sink.connections,
+            'outbox_delivered': sink.messages,
+        })
+
+        sink.connections = sink.messages = 0
+        started = time.perf_counter()
+        for i in range(mails):
+            send_mail('Bench', 'Body', 'bench@example.com', [f'bench{i}@example.com'])
+        direct_time = time.perf_counter() - started
+        result.update({
+            'direct_mails_per_s': round(mails / direct_time, 1),
+            # What a reset request used to wait for
+            'direct_mean_ms': round(direct_time / mails * 1000, 3),
+            'direct_connections': sink.connections,
+        })
+    result['speedup'] = round(direct_time / outbox_time, 2)
+    return result
@@ -0,0 +1,84 @@
+import time
+from datetime import timedelta
+
+from django.core.mail import EmailMessage, get_connection
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from apps.mails.models import Mail
+
+
+class Command(BaseCommand):
+    help = 'Delivers queued mails from the outbox over a single reused SMTP connection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--max-attempts', type=int, default=5)
+        parser.add_argument('--backoff', type=float, default=30.0,
+                            help='Base delay in seconds, doubled after every failed attempt')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Sleep between polls when the outbox is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Drain the outbox and exit instead of polling forever')
+
+    def handle(self, *args, **options):
+        self.connection = get_connection()
+        try:
+            while True:
+                sent = self.send_batch(options['batch_size'], options['max_attempts'], options['backoff'])
+                if sent:
+                    continue
+                if options['once']:
+                    break
+                # Nothing due, drop the SMTP connection instead of letting the server time it out
+                self.connection.close()
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.connection.close()
+
+    def send_batch(self, batch_size, max_attempts, backoff):
+        """
+        Claims up to ``batch_size`` due mails and sends them. Rows stay locked
+        (SKIP LOCKED) until the batch is committed, so several workers can run side by side.
+        Returns the number of processed mails.
+        """
+        with transaction.atomic():
+            mails = list(Mail.objects.due()
+                         .select_for_update(skip_locked=True)
+                         .order_by('next_attempt_at')[:batch_size])
+            if not mails:
+                return 0
+
+            for mail in mails:
+                self.send(mail, max_attempts, backoff)
+            Mail.objects.bulk_update(mails, ['status', 'attempts', 'last_error', 'next_attempt_at', 'sent_at'])
+
+        sent = sum(mail.status == Mail.SENT for mail in mails)
+        self.stdout.write(f'Sent {sent}/{len(mails)} mails')
+        return len(mails)
+
+    def send(self, mail, max_attempts, backoff):
+        message = EmailMessage(subject=mail.subject,
+                               body=mail.message,
+                               from_email=mail.from_email,
+                               to=mail.recipients,
+                               connection=self.connection)
+        mail.attempts += 1
+        try:
+            self.connection.open()
+            self.connection.send_messages([message])
+        except Exception as e:
+            # The connection may be left in an unknown state, start over with the next mail
+            self.connection.close()
+            mail.last_error = str(e)
+            if mail.attempts >= max_attempts:
+                mail.status = Mail.FAILED
+            else:
+                mail.next_attempt_at = timezone.now() + timedelta(seconds=backoff * 2 ** (mail.attempts - 1))
+        else:
+            mail.status = Mail.SENT
+            mail.sent_at = timezone.now()
+            mail.last_error = ''
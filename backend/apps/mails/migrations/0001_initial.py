@@ -0,0 +1,39 @@
+# Generated by Django 3.2.25 on 2026-10-18 21:52
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Mail',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=255, verbose_name='Subject')),
+                ('message', models.TextField(verbose_name='Message')),
+                ('from_email', models.CharField(max_length=255, verbose_name='From')),
+                ('recipients', models.JSONField(default=list, verbose_name='Recipients')),
+                ('status', models.CharField(choices=[['pending', 'Pending'], ['sent', 'Sent'], ['failed', 'Failed']], default='pending', max_length=10, verbose_name='Status')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Attempts')),
+                ('last_error', models.TextField(blank=True, verbose_name='Last error')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Next attempt at')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created at')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Sent at')),
+            ],
+            options={
+                'verbose_name': 'Mail',
+                'verbose_name_plural': 'Mails',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='mail',
+            index=models.Index(fields=['status', 'next_attempt_at'], name='mails_status_next_attempt_idx'),
+        ),
+    ]
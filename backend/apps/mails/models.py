@@ -0,0 +1,53 @@
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
+
+
+class MailManager(models.Manager):
+    def queue(self, subject, message, recipient_list, from_email=None):
+        """
+        Stores a message in the outbox. Delivery is done by the send_mails command,
+        so callers only pay for a single INSERT (inside their own transaction).
+        """
+        return self.create(subject=subject,
+                           message=message,
+                           from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+                           recipients=list(recipient_list))
+
+    def due(self):
+        return self.filter(status=Mail.PENDING, next_attempt_at__lte=timezone.now())
+
+
+class Mail(models.Model):
+    PENDING = 'pending'
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        [PENDING, 'Pending'],
+        [SENT, 'Sent'],
+        [FAILED, 'Failed'],
+    ]
+
+    subject = models.CharField(verbose_name='Subject', max_length=255)
+    message = models.TextField(verbose_name='Message')
+    from_email = models.CharField(verbose_name='From', max_length=255)
+    recipients = models.JSONField(verbose_name='Recipients', default=list)
+
+    status = models.CharField(verbose_name='Status', max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(verbose_name='Attempts', default=0)
+    last_error = models.TextField(verbose_name='Last error', blank=True)
+    next_attempt_at = models.DateTimeField(verbose_name='Next attempt at', default=timezone.now)
+    created_at = models.DateTimeField(verbose_name='Created at', auto_now_add=True)
+    sent_at = models.DateTimeField(verbose_name='Sent at', null=True, blank=True)
+
+    objects = MailManager()
+
+    class Meta:
+        verbose_name = 'Mail'
+        verbose_name_plural = 'Mails'
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='mails_status_next_attempt_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.subject} -> {", ".join(self.recipients)}'
@@ -0,0 +1,102 @@
+import io
+import smtplib
+import threading
+from unittest import mock
+
+from django.core import mail as outbox
+from django.core.mail.backends import locmem
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.utils import timezone
+
+from apps.mails.management.commands.send_mails import Command
+from apps.mails.models import Mail
+
+
+class FailingBackend(locmem.EmailBackend):
+    """
+    The locmem backend behind a relay that drops every connection.
+    """
+
+    def send_messages(self, messages):
+        raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+
+
+def queue(count):
+    for i in range(count):
+        Mail.objects.queue('Reset', 'Body', [f'user{i}@example.com'])
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class SendMailsTests(TestCase):
+
+    def send_mails(self, **options):
+        call_command('send_mails', once=True, stdout=io.StringIO(), **options)
+
+    def test_delivers_the_outbox(self):
+        queue(3)
+        self.send_mails(batch_size=2)
+        self.assertEqual(sorted(message.to[0] for message in outbox.outbox),
+                         ['user0@example.com', 'user1@example.com', 'user2@example.com'])
+        self.assertEqual(Mail.objects.filter(status=Mail.SENT, attempts=1, sent_at__isnull=False).count(), 3)
+        # Nothing left due
+        self.send_mails()
+        self.assertEqual(len(outbox.outbox), 3)
+
+    @override_settings(EMAIL_BACKEND='apps.mails.tests.FailingBackend')
+    def test_backoff_then_give_up(self):
+        queue(1)
+        clock = timezone.now()
+        delays = []
+        with mock.patch.object(timezone, 'now', side_effect=lambda: clock):
+            for _ in range(3):
+                self.send_mails(max_attempts=3, backoff=30)
+                mail = Mail.objects.get()
+                if mail.status != Mail.PENDING:
+                    break
+                delays.append((mail.next_attempt_at - clock).total_seconds())
+                # Not due before its time
+                self.send_mails(max_attempts=3, backoff=30)
+                self.assertEqual(Mail.objects.get().attempts, mail.attempts)
+                clock = mail.next_attempt_at
+        self.assertEqual(delays, [30, 60])
+        self.assertEqual((mail.status, mail.attempts), (Mail.FAILED, 3))
+        self.assertIn('Connection unexpectedly closed', mail.last_error)
+        self.assertEqual(outbox.outbox, [])
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class ClaimTests(TransactionTestCase):
+    """
+    Mails locked by another worker's batch are skipped, not waited for.
+    """
+
+    @skipUnlessDBFeature('has_select_for_update_skip_locked')
+    def test_skips_locked_mails(self):
+        queue(4)
+        locked = list(Mail.objects.order_by('id').values_list('id', flat=True)[:2])
+        claimed, release = threading.Event(), threading.Event()
+
+        def other_worker():
+            try:
+                with transaction.atomic():
+                    list(Mail.objects.select_for_update().filter(id__in=locked))
+                    claimed.set()
+                    release.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=other_worker)
+        thread.start()
+        try:
+            self.assertTrue(claimed.wait(10))
+            command = Command(stdout=io.StringIO())
+            command.connection = locmem.EmailBackend()
+            self.assertEqual(command.send_batch(batch_size=10, max_attempts=5, backoff=30), 2)
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(set(Mail.objects.filter(status=Mail.SENT).values_list('id', flat=True)),
+                         set(Mail.objects.exclude(id__in=locked).values_list('id', flat=True)))
+        self.assertEqual(len(outbox.outbox), 2)
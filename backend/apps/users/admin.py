@@ -1,10 +1,32 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
 from django.contrib.auth.models import Group
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.utils.text import smart_split, unescape_string_literal
 
+from apps.common.exports import stream_export
+from apps.common.pagination import EstimatedCountPaginator
 from apps.users.models import User
 from apps.users.forms import UserChangeForm, UserCreationForm
 
+EXPORT_COLUMNS = ['id', 'email', 'first_name', 'last_name', 'is_active', 'is_staff', 'registered_at', 'last_login']
+# Trigram indexes can't serve shorter search terms
+SEARCH_MIN_LENGTH = 3
+
+
+class UserChangeList(ChangeList):
+
+    def get_ordering(self, request, queryset):
+        ordering = super().get_ordering(request, queryset)
+        # A sort on one column gets ties broken by pk in the same direction, instead of by the
+        # default ordering, so both directions are one scan of a (column, id) index such as
+        # users_last_name_id_idx
+        if len(self.params.get(ORDER_VAR, '').split('.')) == 1 and ordering and isinstance(ordering[0], str):
+            column = ordering[0]
+            if not self.lookup_opts.get_field(column.lstrip('-')).unique:
+                return [column, '-pk' if column.startswith('-') else 'pk']
+        return ordering
+
 
 class UserAdmin(BaseUserAdmin):
     form = UserChangeForm
@@ -26,9 +48,34 @@ class UserAdmin(BaseUserAdmin):
         [None, {'classes': ['wide'],
                 'fields': ['email', 'first_name', 'last_name', 'password1', 'password2']}],
     ]
-    search_fields = ['email']
+    # Served by the trigram indexes of apps.users.signals.create_search_indexes
+    search_fields = ['email', 'first_name', 'last_name']
     ordering = ['email']
+    paginator = EstimatedCountPaginator
+    # Skips the second, unfiltered COUNT(*) of searches
+    show_full_result_count = False
     readonly_fields = ['last_login', 'registered_at']
+    actions = ['export_csv', 'export_ndjson']
+
+    def get_changelist(self, request, **kwargs):
+        return UserChangeList
+
+    def get_search_results(self, request, queryset, search_term):
+        terms = [unescape_string_literal(term) if term[0] in '"\'' and term[-1] == term[0] else term
+                 for term in smart_split(search_term)]
+        if any(len(term) < SEARCH_MIN_LENGTH for term in terms):
+            messages.warning(request, f'Search terms need at least {SEARCH_MIN_LENGTH} characters.')
+            return queryset.none(), False
+        return super().get_search_results(request, queryset, search_term)
+
+    @admin.action(description='Export selected users to CSV')
+    def export_csv(self, request, queryset):
+        # Select "all" on the changelist to stream every user, rows are never loaded at once
+        return stream_export(queryset.order_by('id'), EXPORT_COLUMNS, 'csv', 'users')
+
+    @admin.action(description='Export selected users to NDJSON')
+    def export_ndjson(self, request, queryset):
+        return stream_export(queryset.order_by('id'), EXPORT_COLUMNS, 'ndjson', 'users')
 
 
 # Now register the new UserAdmin...
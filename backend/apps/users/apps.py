@@ -1,6 +1,11 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class UsersConfig(AppConfig):
     name = 'apps.users'
     verbose_name = 'Users'
+
+    def ready(self):
+        from apps.users.signals import create_search_indexes
+        post_migrate.connect(create_search_indexes, sender=self)
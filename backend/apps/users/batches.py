@@ -0,0 +1,47 @@
+"""
+Batch writes of users (``POST /api/users/batch/``, admins only): passwords are hashed in
+parallel on the hashing pool, then one bulk_create and one bulk_update for the whole batch.
+"""
+from django.db import router
+from django.utils import timezone
+
+from apps.users.hashers import make_passwords
+from apps.users.models import User
+
+FIELDS = ['email', 'first_name', 'last_name', 'password', 'updated_at']
+
+
+def save_batch(items, existing, using=None, batch_size=1000):
+    """
+    Writes validated UserBatchSerializer items: items with an ``id`` update the user of
+    ``existing`` (``{id: User}``, locked by the caller), the others are created. Must run in
+    an atomic block. Returns the users in item order.
+    """
+    using = using or router.db_for_write(User)
+    now = timezone.now()
+    # New users without a password get an unusable one, existing ones keep theirs
+    hashed = iter(make_passwords([attrs.get('password') for attrs in items
+                                  if 'id' not in attrs or 'password' in attrs]))
+
+    created, updated, rows = [], [], []
+    for attrs in items:
+        values = {name: attrs[name] for name in ['email', 'first_name', 'last_name'] if name in attrs}
+        if 'id' in attrs:
+            user = existing[attrs['id']]
+            if 'password' in attrs:
+                user.password = next(hashed)
+            for name, value in values.items():
+                setattr(user, name, value)
+            # bulk_update doesn't apply auto_now, and conditional GETs depend on it
+            user.updated_at = now
+            updated.append(user)
+        else:
+            user = User(password=next(hashed), is_active=True, **values)
+            created.append(user)
+        rows.append(user)
+
+    User.objects.using(using).bulk_create(created, batch_size=batch_size)
+    User.objects.using(using).bulk_update(updated, FIELDS, batch_size=batch_size)
+    for user in updated:
+        user.invalidate_cache()
+    return rows
@@ -0,0 +1,399 @@
+import io
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+import requests
+
+from PIL import Image
+
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from rest_framework.renderers import JSONRenderer
+
+from apps.common.benchmarks import (
+    BENCHMARK_EMAIL_DOMAIN, BENCHMARK_PASSWORD, Scenario, gunicorn, percentile, register, register_micro,
+    server_database_url, timed,
+)
+from apps.common.pagination import estimated_count
+from apps.common.renderers import FastJSONRenderer
+from apps.users.models import User
+from apps.users.serializers import FastUserSerializer, UserSerializer
+from apps.users.tokens import issue_tokens
+
+
+def _user(context, i):
+    return context.users[i % len(context.users)]
+
+
+@register
+class ListUsers(Scenario):
+    name = 'users-list'
+
+    def request(self, i):
+        return 'GET', '/api/users?page_size=50', None, None
+
+
+@register
+class RetrieveUser(Scenario):
+    name = 'users-retrieve'
+
+    def request(self, i):
+        return 'GET', f'/api/users/{_user(self.context, i)["id"]}/', None, None
+
+
+@register
+class Profile(Scenario):
+    name = 'users-profile'
+
+    def setup(self):
+        user = User.objects.get(pk=self.context.users[0]['id'])
+        self.headers = {'Authorization': 'Bearer ' + issue_tokens(user)['access']}
+
+    def request(self, i):
+        return 'GET', '/api/users/profile/', None, self.headers
+
+
+@register
+class Login(Scenario):
+    name = 'users-login'
+
+    def request(self, i):
+        return 'POST', '/api/users/login/', {'email': _user(self.context, i)['email'],
+                                             'password': BENCHMARK_PASSWORD}, None
+
+
+@register
+class Register(Scenario):
+    name = 'users-register'
+    expected_statuses = (201,)
+
+    def setup(self):
+        self.run = uuid4().hex[:8]
+
+    def request(self, i):
+        return 'POST', '/api/users/register/', {'email': f'bench-register-{self.run}-{i}@{BENCHMARK_EMAIL_DOMAIN}',
+                                                'password': BENCHMARK_PASSWORD,
+                                                'first_name': 'Bench', 'last_name': 'Register'}, None
+
+
+@register
+class PasswordReset(Scenario):
+    name = 'users-password-reset'
+
+    def request(self, i):
+        return 'POST', '/api/users/password_reset/', {'email': _user(self.context, i)['email']}, None
+
+
+@register
+class PasswordChange(Scenario):
+    name = 'users-password-change'
+    # Every token works once; with fewer seeded users than requests the rest measure the 404 path
+    expected_statuses = (200, 404)
+
+    def setup(self):
+        self.tokens = [str(token) for token in User.objects.filter(
+            pk__in=[user['id'] for user in self.context.users]).order_by('id').values_list('token', flat=True)]
+
+    def request(self, i):
+        return 'POST', '/api/users/password_change/', {'token': self.tokens[i % len(self.tokens)],
+                                                       'password': BENCHMARK_PASSWORD}, None
+
+
+@register_micro('users-deep-pages')
+def deep_pages(context, page_size=50, samples=5):
+    """
+    Latency of user list pages by depth, following the ``next`` cursors through all seeded
+    users (e.g. ``--users 1000000``). Keyset pages seek to the cursor through the
+    ``(registered_at, id)`` index, so the last pages should cost what the first ones do; the
+    same pages read with OFFSET are timed alongside, their cost growing with the depth.
+    """
+    client = Client()
+    queryset = User.objects.order_by('registered_at', 'id')
+    url, latencies = f'/api/users?page_size={page_size}', []
+    while url:
+        elapsed, response = timed(lambda: client.get(url), repeat=1)
+        latencies.append(elapsed)
+        url = response.data['next']
+
+    pages = len(latencies)
+    result = {'users': queryset.count(), 'page_size': page_size, 'pages': pages}
+    # The mean of ``samples`` pages around each depth, first to last
+    for label, page in [('first', 0), ('middle', pages // 2), ('last', pages - samples)]:
+        page = max(page, 0)
+        window = latencies[page:page + samples]
+        start = page * page_size
+        offset_time, _ = timed(lambda: list(queryset.values_list('id', flat=True)[start:start + page_size]))
+        result.update({
+            f'{label}_page_ms': round(sum(window) / len(window) * 1000, 3),
+            f'{label}_offset_query_ms': round(offset_time * 1000, 3),
+        })
+    result['last_to_first'] = round(result['last_page_ms'] / result['first_page_ms'], 2)
+    return result
+
+
+@register_micro('users-serializer')
+def serializer_throughput(context):
+    """
+    Rows/second of UserSerializer + JSONRenderer against FastUserSerializer + FastJSONRenderer
+    over all seeded users, including the query. Both outputs must be byte-identical.
+    """
+    queryset = User.objects.order_by('registered_at', 'id')
+
+    def drf():
+        return JSONRenderer().render(UserSerializer(queryset.all(), many=True).data)
+
+    def fast():
+        rows = queryset.values(*FastUserSerializer.columns)
+        return FastJSONRenderer().render(FastUserSerializer().serialize(rows))
+
+    drf_time, drf_bytes = timed(drf)
+    fast_time, fast_bytes = timed(fast)
+    rows = queryset.count()
+    return {
+        'rows': rows,
+        'drf_rows_per_s': round(rows / drf_time, 1),
+        'fast_rows_per_s': round(rows / fast_time, 1),
+        'speedup': round(drf_time / fast_time, 2),
+        'identical': drf_bytes == fast_bytes,
+    }
+
+
+@register_micro('users-avatar')
+def avatar_upload(context, uploads=20):
+    """
+    Latency of avatar uploads (hash + store only, thumbnails are made by process_avatars)
+    and bytes a client downloads for the 40px avatar before and after processing.
+    """
+    media_root = tempfile.mkdtemp()
+    try:
+        with override_settings(MEDIA_ROOT=media_root):
+            client = Client()
+            latencies = []
+            for i in range(uploads):
+                image = io.BytesIO()
+                Image.new('RGB', (2400, 1600), (i * 10 % 256, 80, 160)).save(image, 'JPEG', quality=95)
+                image.seek(0)
+                image.name = f'avatar{i}.jpg'
+                user_id = context.users[i % len(context.users)]['id']
+                body = encode_multipart(BOUNDARY, {'avatar': image})
+                elapsed, _ = timed(lambda: client.generic('PATCH', f'/api/users/{user_id}/', body,
+                                                          content_type=MULTIPART_CONTENT), repeat=1)
+                latencies.append(elapsed)
+
+            user = User.objects.get(pk=context.users[0]['id'])
+            original_bytes = user.avatar.size
+            call_command('process_avatars', once=True, stdout=io.StringIO())
+            user.refresh_from_db()
+            thumbnail_bytes = user.avatar.storage.size(user.avatar_thumbnails['40'])
+    finally:
+        shutil.rmtree(media_root, ignore_errors=True)
+
+    latencies.sort()
+    return {
+        'uploads': uploads,
+        'upload_p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+        'upload_p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'avatar_bytes_original': original_bytes,
+        'avatar_bytes_40px': thumbnail_bytes,
+    }
+
+
+@register_micro('users-conditional-get')
+def conditional_polling(context, polls=200):
+    """
+    Bytes and latency per poll of an unchanged user and user list page, re-downloaded every
+    time and revalidated with If-None-Match (answered with a 304 before serialization).
+    """
+    client = Client()
+    paths = {'retrieve': f'/api/users/{context.users[0]["id"]}/', 'list': '/api/users?page_size=50'}
+    result = {'polls': polls}
+    for label, path in paths.items():
+        etag = client.get(path)['ETag']
+        for mode, headers in [('full', {}), ('conditional', {'HTTP_IF_NONE_MATCH': etag})]:
+            latencies, size, statuses = [], 0, set()
+            for _ in range(polls):
+                elapsed, response = timed(lambda: client.get(path, **headers), repeat=1)
+                latencies.append(elapsed)
+                size += len(response.content)
+                statuses.add(response.status_code)
+            latencies.sort()
+            result.update({
+                f'{label}_{mode}_status': sorted(statuses),
+                f'{label}_{mode}_bytes_per_poll': size // polls,
+                f'{label}_{mode}_p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+                f'{label}_{mode}_p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            })
+    return result
+
+
+@register_micro('users-admin')
+def admin_changelist(context):
+    """
+    Latency and queries of the User admin changelist (first and a deep page, sorted by full
+    name both ways, searched) over all seeded users, e.g. ``--users 1000000``, and the cost of
+    the exact COUNT(*) against the planner estimate the paginator uses above the threshold.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {User._meta.db_table}')
+    admin_user = User.objects.create_superuser(f'bench-admin-{uuid4().hex[:8]}@{BENCHMARK_EMAIL_DOMAIN}',
+                                               BENCHMARK_PASSWORD)
+    client = Client()
+    client.force_login(admin_user)
+    # Column 0 is the action checkbox, 1 the full name
+    pages = {
+        'first_page': '',
+        'deep_page': '?p=100',
+        'by_name': '?o=1',
+        'by_name_desc': '?o=-1',
+        'search': '?q=User12',
+    }
+    result = {'users': User.objects.count()}
+    for label, query in pages.items():
+        with CaptureQueriesContext(connection) as queries:
+            elapsed, response = timed(lambda: client.get('/admin/users/user/' + query), repeat=1)
+        result.update({
+            f'{label}_status': response.status_code,
+            f'{label}_ms': round(elapsed * 1000, 3),
+            f'{label}_queries': len(queries),
+        })
+    queryset = User.objects.all()
+    exact_time, _ = timed(queryset.count, repeat=1)
+    estimate_time, estimate = timed(lambda: estimated_count(queryset), repeat=1)
+    result.update({
+        'exact_count_ms': round(exact_time * 1000, 3),
+        'estimated_count_ms': round(estimate_time * 1000, 3),
+        'estimated_count': estimate,
+    })
+    return result
+
+
+@register_micro('users-batch')
+def batch_writes(context, sizes=(1, 100, 10000)):
+    """
+    Items/second creating users through the admin POST /api/users/batch/ with payloads of each
+    of ``sizes`` items (no passwords, hashing would dominate), and the writes of a single
+    POST /api/users/ (one INSERT, the password hashed before the save).
+    """
+    admin = User.objects.create_user(email=f'bench-admin-{uuid4().hex[:8]}@{BENCHMARK_EMAIL_DOMAIN}',
+                                     password=BENCHMARK_PASSWORD, is_staff=True)
+    headers = {'HTTP_AUTHORIZATION': 'Bearer ' + issue_tokens(admin)['access']}
+    client = Client()
+    run = uuid4().hex[:8]
+    result, statuses = {}, []
+    for size in sizes:
+        payload = [{'email': f'bench-batch-{run}-{size}-{i}@{BENCHMARK_EMAIL_DOMAIN}', 'first_name': 'Bench',
+                    'last_name': f'Batch{i}'} for i in range(size)]
+        elapsed, response = timed(lambda: client.post('/api/users/batch/', payload, content_type='application/json',
+                                                      **headers), repeat=1)
+        statuses.append(response.status_code)
+        result[f'batch_{size}_items_per_s'] = round(size / elapsed, 1)
+
+    with CaptureQueriesContext(connection) as queries:
+        statuses.append(client.post('/api/users/', {'email': f'bench-single-{run}@{BENCHMARK_EMAIL_DOMAIN}',
+                                                    'password': BENCHMARK_PASSWORD},
+                                    content_type='application/json').status_code)
+    result['single_create_writes'] = sum(1 for query in queries.captured_queries
+                                         if query['sql'].startswith(('INSERT', 'UPDATE')))
+    result['errors'] = sum(1 for code in statuses if code != 201)
+    return result
+
+
+@register_micro('users-login-storm')
+def login_storm(context, storm=16, samples=200, timeout=60):
+    """
+    Latency of token-authenticated profile requests to one gevent gunicorn worker while
+    ``storm`` clients log in back to back, with PBKDF2 run inline in the worker
+    (PASSWORD_HASHING_WORKERS=0, as before) and in the hashing pool. Logins shed with 429 are
+    counted. The server runs in its own process, so the database must be reachable from it:
+    Postgres, or SQLite with ``--no-isolate``.
+    """
+    if shutil.which('gunicorn') is None:
+        return {'skipped': 'gunicorn not on PATH'}
+    database_url = server_database_url()
+    if database_url is None:
+        return {'skipped': 'the benchmark database is in-memory SQLite, use Postgres or --no-isolate'}
+
+    user = User.objects.get(pk=context.users[0]['id'])
+    headers = {'Authorization': 'Bearer ' + issue_tokens(user)['access']}
+    emails = [seeded['email'] for seeded in context.users]
+    result = {'storm_clients': storm, 'samples': samples}
+    for label, hashing_workers in [('inline', 0), ('pooled', settings.PASSWORD_HASHING_WORKERS or 2)]:
+        env = {'DATABASE_URL': database_url, 'PASSWORD_HASHING_WORKERS': str(hashing_workers)}
+        with gunicorn(['--worker-class', 'gevent', '--workers', '1'], env=env, timeout=timeout) as (url, first_200):
+            if first_200 is None:
+                result[f'{label}_error'] = 'server did not start'
+                continue
+            stopped = threading.Event()
+            statuses = {}
+            lock = threading.Lock()
+
+            def log_in(n):
+                session = requests.Session()
+                i = n
+                while not stopped.is_set():
+                    credentials = {'email': emails[i % len(emails)], 'password': BENCHMARK_PASSWORD}
+                    code = session.post(f'{url}/api/users/login/', json=credentials).status_code
+                    with lock:
+                        statuses[code] = statuses.get(code, 0) + 1
+                    i += storm
+
+            session = requests.Session()
+            latencies = []
+            with ThreadPoolExecutor(max_workers=storm) as executor:
+                futures = [executor.submit(log_in, n) for n in range(storm)]
+                try:
+                    # Let the storm build up first
+                    time.sleep(1)
+                    for _ in range(samples):
+                        elapsed, _ = timed(lambda: session.get(f'{url}/api/users/profile/', headers=headers), repeat=1)
+                        latencies.append(elapsed)
+                finally:
+                    stopped.set()
+                for future in futures:
+                    future.result()
+            latencies.sort()
+            result.update({
+                f'{label}_profile_p50_ms': round(percentile(latencies, 0.5) * 1000, 3),
+                f'{label}_profile_p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+                f'{label}_logins': statuses.get(200, 0),
+                f'{label}_logins_shed': statuses.get(429, 0),
+            })
+    return result
+
+
+@register_micro('users-token-auth')
+def token_auth(context, calls=200):
+    """
+    Queries and latency per GET /api/users/profile/ authenticated with an access token (served
+    from its claims) and with a session cookie (session and user loaded on every request).
+    """
+    user = User.objects.get(pk=context.users[0]['id'])
+    token_client = Client(HTTP_AUTHORIZATION='Bearer ' + issue_tokens(user)['access'])
+    session_client = Client()
+    session_client.force_login(user)
+    result = {'calls': calls}
+    for label, client in [('token', token_client), ('session', session_client)]:
+        statuses = set()
+
+        def run():
+            for _ in range(calls):
+                statuses.add(client.get('/api/users/profile/').status_code)
+
+        with CaptureQueriesContext(connection) as queries:
+            elapsed, _ = timed(run, repeat=1)
+        result.update({
+            f'{label}_status': sorted(statuses),
+            f'{label}_queries_per_call': round(len(queries) / calls, 2),
+            f'{label}_mean_ms': round(elapsed / calls * 1000, 3),
+        })
+    return result
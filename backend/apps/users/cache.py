@@ -0,0 +1,6 @@
+from django.conf import settings
+
+from apps.common.cache import VersionedCache
+
+# Serialized UserSerializer payloads, invalidated from User.save/delete
+user_cache = VersionedCache('users:payload', timeout=settings.USER_CACHE_TIMEOUT)
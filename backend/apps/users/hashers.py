@@ -0,0 +1,112 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, get_hasher, make_password
+
+from rest_framework.exceptions import Throttled
+
+
+class PasswordHashingOverloaded(Throttled):
+    default_detail = 'Too many password operations in progress, try again shortly.'
+
+
+def _encode(password, salt, iterations):
+    return PBKDF2PasswordHasher().encode(password, salt, iterations)
+
+
+class HashingPool:
+    """
+    Runs password hashing in a small process pool, so a CPU-bound PBKDF2 round does not
+    block the gevent loop of the gunicorn worker. Waiting on the future goes through
+    threading primitives, which gevent patches, so other greenlets keep running.
+
+    At most ``max_pending`` operations may be queued or running per worker; above that
+    the request is rejected with 429 instead of piling up.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self.pending = 0
+
+    @property
+    def workers(self):
+        return settings.PASSWORD_HASHING_WORKERS
+
+    @property
+    def max_pending(self):
+        return settings.PASSWORD_HASHING_MAX_PENDING
+
+    def get_executor(self):
+        # Executors do not survive fork (gunicorn --preload), create one per process
+        if self._pid != os.getpid():
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            self._pid = os.getpid()
+        return self._executor
+
+    def run(self, fn, *args):
+        if not self.workers:
+            return fn(*args)
+
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise PasswordHashingOverloaded(wait=1)
+            self.pending += 1
+            executor = self.get_executor()
+        try:
+            return executor.submit(fn, *args).result()
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def map(self, fn, *iterables):
+        """
+        ``list(map(fn, *iterables))`` spread over all the pool's processes, counted as one
+        pending operation.
+        """
+        if not self.workers:
+            return list(map(fn, *iterables))
+
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise PasswordHashingOverloaded(wait=1)
+            self.pending += 1
+            executor = self.get_executor()
+        try:
+            return list(executor.map(fn, *iterables, chunksize=8))
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+
+pool = HashingPool()
+
+
+class PooledPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    Drop-in replacement for PBKDF2PasswordHasher (same algorithm name and hash format)
+    that offloads ``encode`` to the hashing pool. ``verify`` goes through ``encode``,
+    so logins are offloaded too.
+    """
+
+    def encode(self, password, salt, iterations=None):
+        return pool.run(_encode, password, salt, iterations or self.iterations)
+
+
+def make_passwords(passwords):
+    """
+    ``make_password`` for many passwords (None gives an unusable one), hashed in parallel.
+    """
+    hasher = get_hasher()
+    if not isinstance(hasher, PooledPBKDF2PasswordHasher):
+        return [make_password(password) for password in passwords]
+    usable = [n for n, password in enumerate(passwords) if password is not None]
+    encoded = pool.map(_encode, [passwords[n] for n in usable], [hasher.salt() for _ in usable],
+                       [hasher.iterations] * len(usable))
+    result = [make_password(None) if password is None else None for password in passwords]
+    for n, value in zip(usable, encoded):
+        result[n] = value
+    return result
@@ -0,0 +1,68 @@
+import io
+import time
+
+from PIL import Image, ImageOps
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.users.models import User
+from apps.users.storage import avatar_storage, thumbnail_name
+
+
+class Command(BaseCommand):
+    help = 'Generates AVATAR_SIZES thumbnails for newly uploaded avatars'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--interval', type=float, default=2.0,
+                            help='Sleep between polls when there is nothing to process')
+        parser.add_argument('--once', action='store_true',
+                            help='Process pending avatars and exit instead of polling forever')
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                if self.process_batch(options['batch_size']):
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+
+    def process_batch(self, batch_size):
+        with transaction.atomic():
+            users = list(User.objects.filter(avatar_pending=True)
+                         .select_for_update(skip_locked=True)
+                         .order_by('id')[:batch_size])
+            for user in users:
+                try:
+                    user.avatar_thumbnails = self.make_thumbnails(user.avatar.name)
+                except (OSError, ValueError) as e:
+                    # Broken or non-image upload, keep serving the original
+                    self.stderr.write(f'User {user.pk}: cannot process {user.avatar.name}: {e}')
+                    user.avatar_thumbnails = {}
+                user.avatar_pending = False
+                user.save(update_fields=['avatar_thumbnails', 'avatar_pending', 'updated_at'])
+        if users:
+            self.stdout.write(f'Processed {len(users)} avatars')
+        return len(users)
+
+    def make_thumbnails(self, name):
+        extension = settings.AVATAR_FORMAT.lower()
+        with avatar_storage.open(name) as f:
+            image = Image.open(f)
+            image.load()
+        image = ImageOps.exif_transpose(image).convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+
+        thumbnails = {}
+        for size in settings.AVATAR_SIZES:
+            thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+            buffer = io.BytesIO()
+            thumbnail.save(buffer, settings.AVATAR_FORMAT, quality=85)
+            thumbnails[str(size)] = avatar_storage.save(thumbnail_name(name, size, extension),
+                                                        ContentFile(buffer.getvalue()))
+        return thumbnails
@@ -0,0 +1,43 @@
+from django.db import migrations
+
+INDEX = 'users_user_email_lower_uniq'
+# Expression indexes, which Django 3.2 can't declare on the model
+VENDORS = ['postgresql', 'sqlite']
+
+
+def create_index(apps, schema_editor):
+    """
+    Case-insensitive unique index on email. Emails that only differ in letter case would
+    make it fail halfway, they are reported first so the accounts can be merged or renamed.
+    """
+    connection = schema_editor.connection
+    if connection.vendor not in VENDORS:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT LOWER(email), COUNT(*) FROM users_user GROUP BY LOWER(email) HAVING COUNT(*) > 1 '
+            'ORDER BY LOWER(email) LIMIT 20'
+        )
+        duplicates = cursor.fetchall()
+        if duplicates:
+            raise RuntimeError(
+                'These emails belong to several users in different letter case, merge or rename the '
+                'accounts and migrate again: ' + ', '.join(f'{email} ({count})' for email, count in duplicates)
+            )
+        cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {INDEX} ON users_user (LOWER(email))')
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor in VENDORS:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
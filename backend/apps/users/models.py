@@ -1,9 +1,13 @@
 from uuid import uuid4
 
 from django.contrib.auth.models import BaseUserManager, AbstractBaseUser, PermissionsMixin
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Lower
 from django.utils import timezone
 
+from apps.users.cache import user_cache
+from apps.users.storage import avatar_storage, avatar_upload_to
+
 
 class UserManager(BaseUserManager):
     def _create_user(self, email, password, is_staff, is_superuser, **extra_fields):
@@ -21,6 +25,13 @@ class UserManager(BaseUserManager):
         user.save(using=self._db)
         return user
 
+    def filter_email(self, email):
+        """
+        Case-insensitive email lookup written as lower(email) = %s,
+        so it is served by the users_user_email_lower_uniq index.
+        """
+        return self.annotate(email_lower=Lower('email')).filter(email_lower=(email or '').lower())
+
     def create_user(self, email=None, password=None, **extra_fields):
         is_staff = extra_fields.pop('is_staff', False)
         is_superuser = extra_fields.pop('is_superuser', False)
@@ -34,13 +45,18 @@ class User(AbstractBaseUser, PermissionsMixin):
     email = models.EmailField(verbose_name='Email', unique=True, max_length=255)
     first_name = models.CharField(verbose_name='First name', max_length=30, default='first')
     last_name = models.CharField(verbose_name='Last name', max_length=30, default='last')
-    avatar = models.ImageField(verbose_name='Avatar', blank=True)
-    token = models.UUIDField(verbose_name='Token', default=uuid4, editable=False)
+    avatar = models.ImageField(verbose_name='Avatar', blank=True, upload_to=avatar_upload_to, storage=avatar_storage)
+    # Thumbnail file names keyed by size, filled in by the process_avatars worker
+    avatar_thumbnails = models.JSONField(verbose_name='Avatar thumbnails', default=dict, blank=True, editable=False)
+    avatar_pending = models.BooleanField(verbose_name='Avatar pending', default=False, editable=False)
+    token = models.UUIDField(verbose_name='Token', default=uuid4, editable=False, db_index=True)
 
     is_admin = models.BooleanField(verbose_name='Admin', default=False)
     is_active = models.BooleanField(verbose_name='Active', default=True)
     is_staff = models.BooleanField(verbose_name='Staff', default=False)
     registered_at = models.DateTimeField(verbose_name='Registered at', auto_now_add=timezone.now)
+    # Validator for conditional GETs (apps.common.mixins.ConditionalGetMixin)
+    updated_at = models.DateTimeField(verbose_name='Updated at', auto_now=True)
 
     # Fields settings
     EMAIL_FIELD = 'email'
@@ -51,17 +67,42 @@ class User(AbstractBaseUser, PermissionsMixin):
     class Meta:
         verbose_name = 'User'
         verbose_name_plural = 'Users'
+        indexes = [
+            models.Index(fields=['registered_at', 'id'], name='users_registered_at_id_idx'),
+            models.Index(fields=['id'], name='users_avatar_pending_idx', condition=models.Q(avatar_pending=True)),
+            models.Index(fields=['updated_at'], name='users_updated_at_idx'),
+            # Admin changelist sorted by full name, see UserAdmin
+            models.Index(fields=['last_name', 'id'], name='users_last_name_id_idx'),
+        ]
 
     @property
     def full_name(self):
         return f'{self.first_name} {self.last_name}'
     full_name.fget.short_description = 'Full name'
+    full_name.fget.admin_order_field = 'last_name'
 
     @property
     def short_name(self):
         return f'{self.last_name} {self.first_name[0]}.'
     short_name.fget.short_description = 'Short name'
 
+    def save(self, *args, **kwargs):
+        # A new upload (not yet written to storage) needs fresh thumbnails
+        if not self.avatar or not self.avatar._committed:
+            self.avatar_thumbnails = {}
+            self.avatar_pending = bool(self.avatar)
+        super().save(*args, **kwargs)
+        self.invalidate_cache()
+
+    def delete(self, *args, **kwargs):
+        self.invalidate_cache()
+        return super().delete(*args, **kwargs)
+
+    def invalidate_cache(self):
+        # Bumped once the write is committed, see VersionedCache
+        pk = self.pk
+        transaction.on_commit(lambda: user_cache.bump(pk))
+
     def get_full_name(self):
         return self.full_name
 
@@ -1,19 +1,52 @@
 from rest_framework import serializers
 
 from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.utils import timezone
 
+from apps.common.serializers import TimedListSerializer, TimedSerializerMixin
 from apps.users.models import User
+from apps.users.storage import avatar_storage
 
 
-class UserSerializer(serializers.ModelSerializer):
+def default_avatar_url():
+    return settings.STATIC_URL + 'images/default_avatar.png'
+
+
+def avatar_map_builder():
+    """
+    Returns ``build(name, thumbnails)`` giving ``{'original': url, '40': url, ...}`` for every
+    size in AVATAR_SIZES. Sizes still being processed point at the original.
+    """
+    url = avatar_storage.url
+    default = default_avatar_url()
+    sizes = [str(size) for size in settings.AVATAR_SIZES]
+    defaults = dict.fromkeys(['original'] + sizes, default)
+
+    def build(name, thumbnails):
+        if not name:
+            return dict(defaults)
+        original = url(name)
+        result = {'original': original}
+        for size in sizes:
+            result[size] = url(thumbnails[size]) if size in thumbnails else original
+        return result
+    return build
+
+
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     registered_at = serializers.DateTimeField(format='%H:%M %d.%m.%Y', read_only=True)
 
     avatar = serializers.SerializerMethodField(read_only=True)
+    avatars = serializers.SerializerMethodField(read_only=True)
     full_name = serializers.SerializerMethodField(read_only=True)
     short_name = serializers.SerializerMethodField(read_only=True)
 
     def get_avatar(self, obj):
-        return obj.avatar.url if obj.avatar else settings.STATIC_URL + 'images/default_avatar.png'
+        return obj.avatar.url if obj.avatar else default_avatar_url()
+
+    def get_avatars(self, obj):
+        return avatar_map_builder()(obj.avatar.name, obj.avatar_thumbnails)
 
     def get_full_name(self, obj):
         return obj.full_name
@@ -23,11 +56,79 @@ class UserSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = User
-        fields = ['email', 'avatar', 'full_name', 'short_name', 'registered_at']
+        fields = ['email', 'avatar', 'avatars', 'full_name', 'short_name', 'registered_at']
+        list_serializer_class = TimedListSerializer
+
+
+class FastUserSerializer:
+    """
+    Read-only equivalent of UserSerializer for ``.values()`` rows (see FastListMixin).
+    Settings, storage and formats are looked up once and every row goes through one
+    plain function, which is several times faster than ModelSerializer on large lists.
+    Output must stay identical to UserSerializer.
+    """
+    columns = ['id', 'email', 'avatar', 'avatar_thumbnails', 'first_name', 'last_name', 'registered_at']
+
+    def __init__(self):
+        avatar_map = avatar_map_builder()
+        tz = timezone.get_current_timezone()
+        date_format = UserSerializer._declared_fields['registered_at'].format
+
+        def to_representation(row):
+            first_name, last_name = row['first_name'], row['last_name']
+            avatars = avatar_map(row['avatar'], row['avatar_thumbnails'])
+            return {
+                'email': row['email'],
+                'avatar': avatars['original'],
+                'avatars': avatars,
+                'full_name': f'{first_name} {last_name}',
+                'short_name': f'{last_name} {first_name[0]}.',
+                'registered_at': row['registered_at'].astimezone(tz).strftime(date_format),
+            }
+        self.to_representation = to_representation
+
+    def serialize(self, rows):
+        return list(map(self.to_representation, rows))
 
 
 class UserWriteSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = User
-        fields = ['email', 'password', 'first_name', 'last_name']
+        fields = ['email', 'password', 'first_name', 'last_name', 'avatar']
+        extra_kwargs = {'password': {'write_only': True}}
+
+    def validate_password(self, value):
+        # Hashed before the model is saved, so a create or update is a single write
+        return make_password(value)
+
+
+class UserBatchSerializer(serializers.ModelSerializer):
+    """
+    One item of an admin user batch (UserViewSet.batch): created without ``id``, updated with one.
+    Emails are checked against ``context['emails']`` (``{lower(email): user id}``, loaded once
+    for the batch) instead of a query per item. Without a password, new users get an unusable one.
+    """
+    id = serializers.IntegerField(required=False)
+    email = serializers.EmailField(max_length=255)
+    password = serializers.CharField(write_only=True, required=False)
+
+    class Meta:
+        model = User
+        fields = ['id', 'email', 'password', 'first_name', 'last_name']
+
+    def validate(self, attrs):
+        if 'id' in attrs:
+            if attrs['id'] not in self.context['existing']:
+                raise serializers.ValidationError({'id': 'Not found.'})
+            if attrs['id'] in self.context['seen_ids']:
+                raise serializers.ValidationError({'id': 'Duplicate id in this batch.'})
+            self.context['seen_ids'].add(attrs['id'])
+        attrs['email'] = User.objects.normalize_email(attrs['email'])
+        email = attrs['email'].lower()
+        if email in self.context['seen']:
+            raise serializers.ValidationError({'email': 'Duplicate email in this batch.'})
+        self.context['seen'].add(email)
+        if self.context['emails'].get(email, attrs.get('id')) != attrs.get('id'):
+            raise serializers.ValidationError({'email': 'user with this Email already exists.'})
+        return attrs
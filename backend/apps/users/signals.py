@@ -0,0 +1,18 @@
+from django.db import connections
+
+
+def create_search_indexes(sender, using, **kwargs):
+    """
+    Trigram indexes for the admin search, matching the ``UPPER(<column>::text) LIKE`` that
+    icontains compiles to. Postgres only, Django 3.2 can't declare opclass expression indexes.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for column in ['email', 'first_name', 'last_name']:
+            cursor.execute(
+                f'CREATE INDEX IF NOT EXISTS users_user_{column}_trgm_idx ON users_user '
+                f'USING gin (UPPER({column}::text) gin_trgm_ops)'
+            )
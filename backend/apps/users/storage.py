@@ -0,0 +1,44 @@
+import hashlib
+import os
+
+from django.core.files.storage import FileSystemStorage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Storage for files named after their content hash: an existing name already holds
+    the same bytes, so it is reused instead of being suffixed or overwritten.
+    Such files never change and can be served with immutable cache headers.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        return name
+
+    def _save(self, name, content):
+        if self.exists(name):
+            return name
+        return super()._save(name, content)
+
+
+def content_hash(file):
+    digest = hashlib.sha256()
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def avatar_upload_to(instance, filename):
+    """
+    avatars/<2 hex>/<sha256>.<ext>, thumbnails are stored next to it as <sha256>_<size>.<format>.
+    """
+    digest = content_hash(instance.avatar.file)
+    extension = os.path.splitext(filename)[1].lower()
+    return f'avatars/{digest[:2]}/{digest}{extension}'
+
+
+def thumbnail_name(name, size, extension):
+    return f'{os.path.splitext(name)[0]}_{size}.{extension}'
+
+
+avatar_storage = ContentAddressedStorage()
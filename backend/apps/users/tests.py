@@ -0,0 +1,411 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from PIL import Image
+
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, check_password, make_password
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.db.migrations.executor import MigrationExecutor
+from django.test.utils import CaptureQueriesContext
+
+from rest_framework.test import APIClient
+
+from apps.common.pagination import EstimatedCountPaginator
+from apps.mails.models import Mail
+from apps.users.cache import user_cache
+from apps.users.hashers import HashingPool, make_passwords
+from apps.users.models import User
+from apps.users.serializers import UserSerializer
+from apps.users.storage import avatar_storage
+from apps.users.tokens import issue_tokens
+
+
+class UserCacheTests(TransactionTestCase):
+    """
+    Cached payloads are invalidated when the write commits, not when it is made: a reader
+    can't store pre-commit data under the new version.
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='cached@example.com', password='secret-pw', first_name='Old')
+
+    def payload(self, pk):
+        def compute():
+            user = User.objects.filter(pk=pk).first()
+            return UserSerializer(user).data if user else {}
+        return user_cache.get_or_set(pk, compute)
+
+    def test_edit_shows_after_commit(self):
+        self.assertEqual(self.payload(self.user.pk)['full_name'], 'Old last')
+        with transaction.atomic():
+            self.user.first_name = 'New'
+            self.user.save()
+            self.assertEqual(self.payload(self.user.pk)['full_name'], 'Old last')
+        self.assertEqual(self.payload(self.user.pk)['full_name'], 'New last')
+
+    def test_rolled_back_edit_keeps_payload(self):
+        version = user_cache.get_version(self.user.pk)
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            self.user.first_name = 'New'
+            self.user.save()
+            raise RuntimeError
+        self.assertEqual(user_cache.get_version(self.user.pk), version)
+        self.assertEqual(self.payload(self.user.pk)['full_name'], 'Old last')
+
+    def test_delete_shows_after_commit(self):
+        pk = self.user.pk
+        self.assertEqual(self.payload(pk)['email'], 'cached@example.com')
+        with transaction.atomic():
+            self.user.delete()
+            self.assertEqual(self.payload(pk)['email'], 'cached@example.com')
+        self.assertEqual(self.payload(pk), {})
+
+
+class EmailIndexMigrationTests(TransactionTestCase):
+    """
+    The lower(email) index migration stops, with the emails named, on case duplicates.
+    """
+    before, after = [('users', '0001_initial')], [('users', '0002_email_lower_uniq')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+
+    def test_case_duplicates(self):
+        self.migrate(self.before)
+        try:
+            User.objects.create_user(email='Twice@example.com', password='secret-pw')
+            duplicate = User.objects.create_user(email='twice@example.com', password='secret-pw')
+            with self.assertRaisesMessage(RuntimeError, 'twice@example.com (2)'):
+                self.migrate(self.after)
+            duplicate.delete()
+        finally:
+            self.migrate(self.after)
+        with self.assertRaises(IntegrityError):
+            User.objects.create_user(email='TWICE@example.com', password='secret-pw')
+
+
+class UserQueryCountTests(TestCase):
+    """
+    Pins the statements of the account actions, savepoints included. A duplicate email, in any
+    letter case, is turned away by the lower(email) index in the INSERT, without a lookup first.
+    """
+    password = 'secret-pw'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='Known@Example.com', password=self.password)
+
+    def test_register(self):
+        # SAVEPOINT, INSERT, RELEASE
+        with self.assertNumQueries(3):
+            response = self.client.post('/api/users/register/', {'email': 'new@example.com', 'password': 'pw'},
+                                        format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_register_duplicate_in_any_case(self):
+        for email in ['Known@Example.com', 'known@example.com', 'KNOWN@EXAMPLE.COM']:
+            # SAVEPOINT, failed INSERT, ROLLBACK TO and RELEASE SAVEPOINT
+            with self.assertNumQueries(4):
+                response = self.client.post('/api/users/register/', {'email': email, 'password': 'pw'}, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.data, {'status': 210})
+        self.assertEqual(User.objects.count(), 1)
+
+    def test_login(self):
+        # The user by email, then the session login() opens (6) and last_login; the tokens are signed, not stored
+        with self.assertNumQueries(9):
+            response = self.client.post('/api/users/login/', {'email': self.user.email,
+                                                              'password': self.password}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('access', response.data)
+
+    def test_login_wrong_password(self):
+        with self.assertNumQueries(1):
+            response = self.client.post('/api/users/login/', {'email': self.user.email, 'password': 'wrong'},
+                                        format='json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_password_reset(self):
+        # The user by lower(email), the queued mail
+        with self.assertNumQueries(2):
+            response = self.client.post('/api/users/password_reset/', {'email': 'KNOWN@example.com'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Mail.objects.count(), 1)
+
+    def test_password_change(self):
+        token = self.user.token
+        # The user by token, then the UPDATE
+        with self.assertNumQueries(2):
+            response = self.client.post('/api/users/password_change/', {'token': str(token), 'password': 'new-pw'},
+                                        format='json')
+        self.assertEqual(response.status_code, 200)
+        updated_at = self.user.updated_at
+        self.user.refresh_from_db()
+        self.assertNotEqual(self.user.token, token)
+        self.assertTrue(self.user.check_password('new-pw'))
+        self.assertGreater(self.user.updated_at, updated_at)
+
+        with self.assertNumQueries(1):
+            response = self.client.post('/api/users/password_change/', {'token': str(token), 'password': 'again'},
+                                        format='json')
+        self.assertEqual(response.status_code, 404)
+
+
+class ConditionalListTests(TestCase):
+    """
+    List ETags cover the rows of the requested page only, read with the page's own LIMIT.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.users = [User.objects.create_user(email=f'user{i}@example.com', password='secret-pw') for i in range(3)]
+
+    def etag(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def status(self, path, etag):
+        return self.client.get(path, HTTP_IF_NONE_MATCH=etag).status_code
+
+    def test_not_modified(self):
+        etag = self.etag('/api/users?page_size=2')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.status('/api/users?page_size=2', etag), 304)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('LIMIT 3', queries[0]['sql'])
+        # Every page has its own
+        self.assertEqual(self.status('/api/users?page_size=1', etag), 200)
+
+    def test_changes_on_the_page(self):
+        etag = self.etag('/api/users?page_size=2')
+
+        # Beyond the page
+        self.users[2].first_name = 'Changed'
+        self.users[2].save()
+        self.assertEqual(self.status('/api/users?page_size=2', etag), 304)
+
+        self.users[0].first_name = 'Changed'
+        self.users[0].save()
+        self.assertEqual(self.status('/api/users?page_size=2', etag), 200)
+
+    def test_next_page_appears(self):
+        etag = self.etag('/api/users?page_size=3')
+        User.objects.create_user(email='late@example.com', password='secret-pw')
+        # Same rows, but there is a next page now
+        self.assertEqual(self.status('/api/users?page_size=3', etag), 200)
+
+
+class BatchTests(TestCase):
+    """
+    Admin batches write nothing unless every item is valid, errors come back in item order.
+    """
+
+    def setUp(self):
+        self.admin = User.objects.create_user(email='admin@example.com', password='secret-pw', is_staff=True)
+        self.user = User.objects.create_user(email='member@example.com', password='secret-pw', first_name='Old')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + issue_tokens(self.admin)['access'])
+
+    def batch(self, items):
+        return self.client.post('/api/users/batch/', items, format='json')
+
+    def test_create_and_update(self):
+        response = self.batch([{'email': 'new@example.com', 'password': 'pw'},
+                               {'id': self.user.pk, 'email': self.user.email, 'first_name': 'New'}])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['ids'][1], self.user.pk)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.first_name, 'New')
+        self.assertTrue(User.objects.get(email='new@example.com').check_password('pw'))
+
+    def test_repeated_id(self):
+        response = self.batch([{'id': self.user.pk, 'email': self.user.email, 'first_name': 'First'},
+                               {'id': self.user.pk, 'email': 'other@example.com', 'first_name': 'Second'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data[0], {})
+        self.assertEqual([str(error) for error in response.data[1]['id']], ['Duplicate id in this batch.'])
+        self.user.refresh_from_db()
+        self.assertEqual((self.user.email, self.user.first_name), ('member@example.com', 'Old'))
+
+
+@override_settings(PASSWORD_HASHING_WORKERS=1, PASSWORD_HASHING_MAX_PENDING=1)
+class HashingPoolTests(TestCase):
+    """
+    Hashes made in the pool are the stock PBKDF2 ones, and with the pool busy further
+    password operations are turned away with 429 instead of queueing.
+    """
+
+    def setUp(self):
+        self.pool = HashingPool()
+        patcher = mock.patch('apps.users.hashers.pool', self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(lambda: self.pool._executor and self.pool._executor.shutdown())
+
+    def test_same_hashes_as_pbkdf2(self):
+        stock = PBKDF2PasswordHasher()
+        pooled = make_password('secret-pw', salt='fixedsalt')
+        self.assertEqual(pooled, stock.encode('secret-pw', 'fixedsalt'))
+        self.assertEqual(self.pool._pid, os.getpid())
+        self.assertTrue(check_password('secret-pw', stock.encode('secret-pw', stock.salt())))
+        self.assertFalse(check_password('wrong', pooled))
+        hashed = make_passwords(['one', None, 'two'])
+        self.assertTrue(check_password('one', hashed[0]) and check_password('two', hashed[2]))
+        self.assertFalse(hashed[1].startswith(stock.algorithm))
+
+    def test_sheds_load_with_429(self):
+        User.objects.create_user(email='busy@example.com', password='secret-pw')
+        busy = threading.Thread(target=self.pool.run, args=(time.sleep, 1))
+        busy.start()
+        try:
+            while not self.pool.pending:
+                time.sleep(0.01)
+            response = APIClient().post('/api/users/login/', {'email': 'busy@example.com', 'password': 'secret-pw'},
+                                        format='json')
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '1')
+        finally:
+            busy.join()
+        self.assertEqual(self.pool.pending, 0)
+        response = APIClient().post('/api/users/login/', {'email': 'busy@example.com', 'password': 'secret-pw'},
+                                    format='json')
+        self.assertEqual(response.status_code, 200)
+
+
+class TokenTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        # Payloads cached by other tests may sit under a reused pk, their bumps never committed
+        user_cache.cache.clear()
+        self.user = User.objects.create_user(email='tokens@example.com', password='secret-pw', first_name='Claims')
+
+    def refresh(self, tokens):
+        return self.client.post('/api/users/token_refresh/', {'refresh': tokens['refresh']}, format='json')
+
+    def test_profile_from_claims(self):
+        tokens = issue_tokens(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer ' + tokens['access'])
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/users/profile/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, UserSerializer(self.user).data)
+        self.assertEqual(response.data['full_name'], 'Claims last')
+
+    def test_password_change_revokes_refresh_tokens(self):
+        old = issue_tokens(self.user)
+        self.assertEqual(self.refresh(old).status_code, 200)
+
+        response = self.client.post('/api/users/password_change/', {'token': str(self.user.token),
+                                                                    'password': 'new-pw'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = self.refresh(old)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['detail'].code, 'token_revoked')
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.refresh(issue_tokens(self.user)).status_code, 200)
+
+
+class AvatarTests(TestCase):
+    """
+    Avatars are stored under their content hash, thumbnails are made by process_avatars.
+    """
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root, AVATAR_SIZES=[40, 80])
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.users = [User.objects.create_user(email=f'avatar{i}@example.com', password='secret-pw')
+                      for i in range(3)]
+
+    def image(self, color, size=(300, 200)):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, color).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def upload(self, user, content, name='me.PNG'):
+        user.avatar = SimpleUploadedFile(name, content, content_type='image/png')
+        user.save()
+        return user.avatar.name
+
+    def test_same_bytes_same_file(self):
+        red = self.image('red')
+        first = self.upload(self.users[0], red, 'first.PNG')
+        self.assertEqual(self.upload(self.users[1], red, 'second.png'), first)
+        self.assertRegex(first, r'^avatars/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        self.assertEqual(len(avatar_storage.listdir(os.path.dirname(first))[1]), 1)
+        with avatar_storage.open(first) as f:
+            self.assertEqual(f.read(), red)
+
+        self.assertNotEqual(self.upload(self.users[2], self.image('blue')), first)
+
+    def test_thumbnails(self):
+        name = self.upload(self.users[0], self.image('green'))
+        self.assertTrue(User.objects.get(pk=self.users[0].pk).avatar_pending)
+        # Until processed, every size is the original
+        self.assertEqual(set(UserSerializer(self.users[0]).data['avatars'].values()), {avatar_storage.url(name)})
+
+        call_command('process_avatars', once=True, stdout=io.StringIO())
+        user = User.objects.get(pk=self.users[0].pk)
+        self.assertFalse(user.avatar_pending)
+        self.assertEqual(set(user.avatar_thumbnails), {'40', '80'})
+        for size, thumbnail in user.avatar_thumbnails.items():
+            with avatar_storage.open(thumbnail) as f:
+                image = Image.open(f)
+                self.assertEqual((image.format, image.size), ('WEBP', (int(size), int(size))))
+            self.assertEqual(UserSerializer(user).data['avatars'][size], avatar_storage.url(thumbnail))
+
+    def test_broken_upload(self):
+        self.upload(self.users[0], b'not an image')
+        err = io.StringIO()
+        call_command('process_avatars', once=True, stdout=io.StringIO(), stderr=err)
+        user = User.objects.get(pk=self.users[0].pk)
+        self.assertEqual((user.avatar_thumbnails, user.avatar_pending), ({}, False))
+        self.assertIn('cannot process', err.getvalue())
+
+
+@override_settings(ESTIMATED_COUNT_THRESHOLD=1000)
+class AdminChangelistTests(TestCase):
+    """
+    The user changelist takes the planner's estimate over COUNT(*) once it is above the threshold.
+    """
+    url = '/admin/users/user/'
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(email='admin@example.com', password='secret-pw')
+        self.client.force_login(self.admin)
+
+    def count_queries(self, queries):
+        return [query['sql'] for query in queries if 'COUNT(' in query['sql'] and 'users_user' in query['sql']]
+
+    def test_estimated_count(self):
+        with mock.patch('apps.common.pagination.estimated_count', return_value=250000) as estimate, \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        changelist = response.context['cl']
+        self.assertIsInstance(changelist.paginator, EstimatedCountPaginator)
+        self.assertEqual(changelist.result_count, 250000)
+        self.assertIsNone(changelist.full_result_count)
+        estimate.assert_called_once()
+        self.assertEqual(self.count_queries(queries), [])
+
+    def test_exact_count_below_threshold(self):
+        with mock.patch('apps.common.pagination.estimated_count', return_value=10), \
+                CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.context['cl'].result_count, 1)
+        self.assertEqual(len(self.count_queries(queries)), 1)
@@ -0,0 +1,72 @@
+from django.utils.crypto import salted_hmac
+from django.utils.functional import cached_property
+
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTTokenUserAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from apps.users.cache import user_cache
+from apps.users.models import User
+from apps.users.serializers import UserSerializer
+
+
+class ClaimsUser(TokenUser):
+    """
+    Stateless request.user built from access token claims, no database access.
+    The profile claim is a UserSerializer payload frozen at the time the token was
+    issued, so it can be up to ACCESS_TOKEN_LIFETIME old.
+    """
+
+    @cached_property
+    def email(self):
+        return self.token.get('profile', {}).get('email', '')
+
+    @cached_property
+    def profile(self):
+        return self.token.get('profile', {})
+
+
+class QueryTokenAuthentication(JWTTokenUserAuthentication):
+    """
+    The access token as ``?token=``, for clients that can't send headers (EventSource).
+    Only for the views that need it: URLs end up in access logs.
+    """
+
+    def authenticate(self, request):
+        raw_token = request.query_params.get('token')
+        if not raw_token:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return self.get_user(validated_token), validated_token
+
+
+def token_generation(user):
+    """
+    Fingerprint of User.token. Rotating User.token (password_change) revokes all
+    refresh tokens; the raw value is never put in a token as it is the reset secret.
+    """
+    return salted_hmac('apps.users.tokens.generation', str(user.token)).hexdigest()[:20]
+
+
+def issue_tokens(user):
+    refresh = RefreshToken.for_user(user)
+    refresh['generation'] = token_generation(user)
+    refresh['is_staff'] = user.is_staff
+    refresh['is_superuser'] = user.is_superuser
+    refresh['profile'] = user_cache.get_or_set(user.pk, lambda: UserSerializer(user).data)
+    return {'refresh': str(refresh), 'access': str(refresh.access_token)}
+
+
+def refresh_tokens(raw_token):
+    try:
+        refresh = RefreshToken(raw_token)
+    except TokenError as e:
+        raise InvalidToken(e.args[0])
+
+    user = User.objects.filter(pk=refresh.get(api_settings.USER_ID_CLAIM), is_active=True).first()
+    if user is None or token_generation(user) != refresh.get('generation'):
+        raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+    return issue_tokens(user)
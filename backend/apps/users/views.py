@@ -3,47 +3,95 @@ from uuid import uuid4
 
 from django.contrib.auth import authenticate, login
 from django.conf import settings
-from django.core.mail import send_mail
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Lower
 from django.template.loader import render_to_string
 
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 
+from apps.common.mixins import ConditionalGetMixin, FastListMixin, ReplicaReadMixin
+from apps.common.routers import from_primary
+from apps.common.serializers import batch_items, item_ids
+from apps.mails.models import Mail
+from apps.users import batches
+from apps.users.cache import user_cache
 from apps.users.models import User
-from apps.users.serializers import UserSerializer, UserWriteSerializer
+from apps.users.serializers import FastUserSerializer, UserBatchSerializer, UserSerializer, UserWriteSerializer
+from apps.users.tokens import ClaimsUser, issue_tokens, refresh_tokens
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(ConditionalGetMixin, ReplicaReadMixin, FastListMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    fast_serializer_class = FastUserSerializer
     permission_classes = []
+    keyset_ordering = ('registered_at', 'id')
 
     def get_serializer_class(self):
         if self.action in ['list', 'retrieve']:
             return UserSerializer
         return UserWriteSerializer
 
-    def perform_create(self, serializer):
-        user = serializer.save()
-        user.set_password(self.request.data.get('password'))
-        user.save()
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(self.object_validators(), self.cached_retrieve, request, *args, **kwargs)
 
-    def perform_update(self, serializer):
-        user = serializer.save()
-        if 'password' in self.request.data:
-            user.set_password(self.request.data.get('password'))
-            user.save()
+    def cached_retrieve(self, request, *args, **kwargs):
+        user = self.get_object()
+        return Response(user_cache.get_or_set(user.pk, lambda: UserSerializer(from_primary(user)).data))
 
     def perform_destroy(self, instance):
         instance.is_active = False
         instance.save()
 
+    @action(methods=['POST'], detail=False, permission_classes=[IsAdminUser])
+    def batch(self, request):
+        """
+        Admins only: creates (items without ``id``) and updates (items with one) up to
+        API_MAX_BATCH_SIZE users in one database transaction. Nothing is written unless every
+        item is valid, otherwise 400 with the errors in item order (``{}`` for valid items).
+        Returns the ids in item order, null for created users where the database doesn't return them.
+        """
+        items = batch_items(request.data)
+        emails = {item['email'].lower() for item in items
+                  if isinstance(item, dict) and isinstance(item.get('email'), str)}
+        try:
+            with transaction.atomic():
+                existing = {user.pk: user for user in User.objects.select_for_update()
+                            .filter(pk__in=item_ids(items, 'id')).order_by('pk')}
+                taken = dict(User.objects.annotate(email_lower=Lower('email')).filter(email_lower__in=emails)
+                             .values_list('email_lower', 'id'))
+                serializer = UserBatchSerializer(data=items, many=True, context={
+                    'request': request, 'existing': existing, 'emails': taken, 'seen': set(),
+                    'seen_ids': set(),
+                })
+                if not serializer.is_valid():
+                    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+                users = batches.save_batch(serializer.validated_data, existing)
+        except IntegrityError:
+            # An email taken by a concurrent write since the check
+            return Response({'email': ['user with this Email already exists.']}, status=status.HTTP_400_BAD_REQUEST)
+        created = any('id' not in attrs for attrs in serializer.validated_data)
+        return Response({'ids': [user.pk for user in users]},
+                        status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
     @action(methods=['GET'], detail=False)
     def profile(self, request):
+        if isinstance(request.user, ClaimsUser):
+            # Validated against the token claims, without any query
+            profile = request.user.profile
+            return self.conditional((self.make_etag(profile), None),
+                                    lambda request: Response(status=status.HTTP_200_OK, data=profile), request)
         if request.user.is_authenticated:
-            serializer = self.serializer_class(request.user)
-            return Response(status=status.HTTP_200_OK, data=serializer.data)
+            user = request.user
+
+            def cached_profile(request):
+                data = user_cache.get_or_set(user.pk, lambda: self.serializer_class(from_primary(user)).data)
+                return Response(status=status.HTTP_200_OK, data=data)
+            return self.conditional((self.make_etag(user.pk, user.updated_at.isoformat()), user.updated_at),
+                                    cached_profile, request)
         return Response(status=status.HTTP_401_UNAUTHORIZED)
 
     @action(methods=['POST'], detail=False)
@@ -54,39 +102,39 @@ class UserViewSet(viewsets.ModelViewSet):
 
         if user:
             login(request, user)
-            return Response(status=status.HTTP_200_OK)
+            return Response(status=status.HTTP_200_OK, data=issue_tokens(user))
         return Response(status=status.HTTP_404_NOT_FOUND)
 
+    @action(methods=['POST'], detail=False)
+    def token_refresh(self, request, format=None):
+        if 'refresh' not in request.data:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        return Response(status=status.HTTP_200_OK, data=refresh_tokens(request.data['refresh']))
+
     @action(methods=['POST'], detail=False)
     def register(self, request):
-        last_name = request.data.get('last_name', None)
-        first_name = request.data.get('first_name', None)
         email = request.data.get('email', None)
         password = request.data.get('password', None)
-
-        if User.objects.filter(email__iexact=email).exists():
+        names = {field: request.data[field] for field in ['first_name', 'last_name']
+                 if request.data.get(field) is not None}
+
+        # A single INSERT, duplicates (in any letter case) are rejected by the lower(email) unique index
+        try:
+            with transaction.atomic():
+                user = User.objects.create_user(email=email, password=password, is_admin=False, **names)
+        except IntegrityError:
             return Response({'status': 210})
-
-        # user creation
-        user = User.objects.create(
-            email=email,
-            password=password,
-            last_name=last_name,
-            first_name=first_name,
-            is_admin=False,
-        )
         return Response(UserSerializer(user).data, status=status.HTTP_201_CREATED)
 
     @action(methods=['POST'], detail=False)
     def password_reset(self, request, format=None):
-        if User.objects.filter(email=request.data['email']).exists():
-            user = User.objects.get(email=request.data['email'])
+        user = User.objects.filter_email(request.data['email']).first()
+        if user:
             params = {'user': user, 'DOMAIN': settings.DOMAIN}
-            send_mail(
+            Mail.objects.queue(
                 subject='Password reset',
                 message=render_to_string('mail/password_reset.txt', params),
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[request.data['email']],
+                recipient_list=[user.email],
             )
             return Response(status=status.HTTP_200_OK)
         else:
@@ -94,11 +142,12 @@ class UserViewSet(viewsets.ModelViewSet):
 
     @action(methods=['POST'], detail=False)
     def password_change(self, request, format=None):
-        if User.objects.filter(token=request.data['token']).exists():
-            user = User.objects.get(token=request.data['token'])
-            user.set_password(request.data['password'])
-            user.token = uuid4()
-            user.save()
-            return Response(status=status.HTTP_200_OK)
-        else:
+        # The user by the indexed token, hashing only for a match; rotating the token makes the link
+        # single use and revokes refresh tokens, save() moves updated_at and the cached payload
+        user = User.objects.filter(token=request.data['token']).first()
+        if user is None:
             return Response(status=status.HTTP_404_NOT_FOUND)
+        user.set_password(request.data['password'])
+        user.token = uuid4()
+        user.save(update_fields=['password', 'token', 'updated_at'])
+        return Response(status=status.HTTP_200_OK)
@@ -1,4 +1,5 @@
 from rest_framework import routers
+from apps.budgets.views import BudgetViewSet, CategoryViewSet, MembershipViewSet, TransactionViewSet
 from apps.users.views import UserViewSet
 
 # Settings
@@ -7,3 +8,9 @@ api.trailing_slash = '/?'
 
 # Users API
 api.register(r'users', UserViewSet)
+
+# Budgets API
+api.register(r'budgets', BudgetViewSet, basename='budget')
+api.register(r'memberships', MembershipViewSet, basename='membership')
+api.register(r'categories', CategoryViewSet, basename='category')
+api.register(r'transactions', TransactionViewSet, basename='transaction')
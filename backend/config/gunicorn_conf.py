@@ -0,0 +1,33 @@
+"""
+gunicorn settings for scripts/gunicorn.sh.
+
+The application is loaded once in the master and the workers fork from it, instead of every
+worker importing Django, DRF and the project on its own. gevent patches the standard library
+before that: Django's connections and the ``threading.local`` state of apps.common have to be
+created greenlet-local.
+"""
+from gevent import monkey
+
+monkey.patch_all()
+
+import gc  # noqa: E402
+import os  # noqa: E402
+
+bind = '0.0.0.0:8000'
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+worker_class = 'gevent'
+# Concurrent requests per worker, event streams (PUBSUB_MAX_SUBSCRIBERS) included
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+preload_app = True
+
+
+def on_starting(server):
+    # Events published in one worker only reach the streams of the others through Postgres
+    if server.cfg.workers > 1 and os.environ.get('PUBSUB_BROKER', 'postgres') == 'local':
+        raise RuntimeError(f'PUBSUB_BROKER=local only delivers events within one worker, '
+                           f'use PUBSUB_BROKER=postgres with {server.cfg.workers} workers')
+
+
+def pre_fork(server, worker):
+    # Keeps the collector from touching (and so copying) the pages of objects loaded by the master
+    gc.freeze()
@@ -10,9 +10,6 @@ https://docs.djangoproject.com/en/dev/ref/settings/
 import environ
 from datetime import timedelta
 
-import sentry_sdk
-from sentry_sdk.integrations.django import DjangoIntegration
-
 ROOT_DIR = environ.Path(__file__) - 2
 
 # Load operating system environment variables and then prepare to use them
@@ -21,26 +18,31 @@ env = environ.Env()
 
 # See https://docs.sentry.io/platforms/python/guides/django/
 
-# Sentry Configuration
-sentry_sdk.init(
-    dsn=env.str('SENTRY_DSN'),
-    integrations=[DjangoIntegration()],
+# Sentry Configuration, the SDK (and the integrations it probes) is only imported when enabled
+SENTRY_DSN = env.str('SENTRY_DSN', default='')
+if SENTRY_DSN:
+    import sentry_sdk
+    from sentry_sdk.integrations.django import DjangoIntegration
+
+    sentry_sdk.init(
+        dsn=SENTRY_DSN,
+        integrations=[DjangoIntegration()],
 
-    # Set traces_sample_rate to 1.0 to capture 100%
-    # of transactions for performance monitoring.
-    # We recommend adjusting this value in production,
-    traces_sample_rate=1.0,
+        # Set traces_sample_rate to 1.0 to capture 100%
+        # of transactions for performance monitoring.
+        # We recommend adjusting this value in production,
+        traces_sample_rate=env.float('SENTRY_TRACES_SAMPLE_RATE', default=1.0),
 
-    # If you wish to associate users to errors (assuming you are using
-    # django.contrib.auth) you may enable sending PII data.
-    send_default_pii=True,
+        # If you wish to associate users to errors (assuming you are using
+        # django.contrib.auth) you may enable sending PII data.
+        send_default_pii=True,
 
-    # By default the SDK will try to use the SENTRY_RELEASE
-    # environment variable, or infer a git commit
-    # SHA as release, however you may want to set
-    # something more human-readable.
-    # release="myapp@1.0.0",
-)
+        # By default the SDK will try to use the SENTRY_RELEASE
+        # environment variable, or infer a git commit
+        # SHA as release, however you may want to set
+        # something more human-readable.
+        # release="myapp@1.0.0",
+    )
 
 
 # APP CONFIGURATION
@@ -62,7 +64,10 @@ THIRD_PARTY_APPS = [
 ]
 
 LOCAL_APPS = [
+    'apps.common',
+    'apps.mails',
     'apps.users',
+    'apps.budgets',
 ]
 
 # See: https://docs.djangoproject.com/en/dev/ref/settings/#installed-apps
@@ -71,6 +76,7 @@ INSTALLED_APPS = DJANGO_APPS + THIRD_PARTY_APPS + LOCAL_APPS
 # MIDDLEWARE CONFIGURATION
 # ------------------------------------------------------------------------------
 MIDDLEWARE = [
+    'apps.common.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -80,6 +86,11 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Share of requests whose SQL is timed and counted by InstrumentationMiddleware
+INSTRUMENTATION_SAMPLE_RATE = env.float('INSTRUMENTATION_SAMPLE_RATE', default=1.0)
+# Send the collected timings back in a Server-Timing response header
+SERVER_TIMING = env.bool('SERVER_TIMING', default=True)
+
 # DEBUG
 # ------------------------------------------------------------------------------
 # See: https://docs.djangoproject.com/en/dev/ref/settings/#debug
@@ -118,6 +129,66 @@ DATABASES = {
         'PORT': 5432,
     },
 }
+# e.g. sqlite:////tmp/budgettracker.sqlite3 for local benchmarks without Postgres
+if env.str('DATABASE_URL', default=''):
+    DATABASES['default'] = env.db('DATABASE_URL')
+
+# Read replicas (comma separated database URLs) for safe-method API requests, see apps.common.routers.
+# Tests mirror them to the primary.
+DATABASE_REPLICAS = []
+for number, url in enumerate(env.list('DATABASE_REPLICA_URLS', default=[]), start=1):
+    DATABASE_REPLICAS.append(f'replica{number}')
+    DATABASES[f'replica{number}'] = dict(env.db_url_config(url), TEST={'MIRROR': 'default'})
+DATABASE_ROUTERS = ['apps.common.routers.ReplicaRouter']
+# Seconds a client keeps reading from the primary after a write (read-your-writes)
+REPLICA_PIN_SECONDS = env.int('REPLICA_PIN_SECONDS', default=5)
+# A replica further behind than this (seconds) is skipped until the next check
+REPLICA_MAX_LAG = env.float('REPLICA_MAX_LAG', default=5.0)
+REPLICA_CHECK_INTERVAL = env.float('REPLICA_CHECK_INTERVAL', default=5.0)
+
+# Postgres connections are pooled per worker process and shared by its greenlets, see apps.common.db.pool.
+# Every gunicorn worker opens up to DATABASE_POOL_SIZE connections per database,
+# keep workers * DATABASE_POOL_SIZE below the server's max_connections.
+if env.bool('DATABASE_POOL', default=True):
+    for database in DATABASES.values():
+        if database['ENGINE'] in ('django.db.backends.postgresql', 'django.db.backends.postgresql_psycopg2'):
+            database['ENGINE'] = 'apps.common.db.postgresql'
+DATABASE_POOL_SIZE = env.int('DATABASE_POOL_SIZE', default=10)
+# Seconds a request waits for a free connection before failing
+DATABASE_POOL_TIMEOUT = env.float('DATABASE_POOL_TIMEOUT', default=10.0)
+DATABASE_POOL_MAX_IDLE = env.float('DATABASE_POOL_MAX_IDLE', default=300.0)
+DATABASE_POOL_MAX_LIFETIME = env.float('DATABASE_POOL_MAX_LIFETIME', default=3600.0)
+
+# CACHE CONFIGURATION
+# ------------------------------------------------------------------------------
+# See: https://docs.djangoproject.com/en/dev/ref/settings/#caches
+# Redis is expected to run with maxmemory and an LRU eviction policy,
+# without REDIS_URL (tests, local runs) a bounded in-process cache is used.
+REDIS_URL = env.str('REDIS_URL', default='')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': REDIS_URL,
+            'OPTIONS': {
+                'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            },
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {
+                'MAX_ENTRIES': 10000,
+            },
+        },
+    }
+
+# Seconds a serialized user payload is kept in the cache
+USER_CACHE_TIMEOUT = env.int('USER_CACHE_TIMEOUT', default=60 * 60)
+# Seconds a budget report snapshot (and each month of it) is kept in the cache
+REPORT_CACHE_TIMEOUT = env.int('REPORT_CACHE_TIMEOUT', default=24 * 60 * 60)
 
 # GENERAL CONFIGURATION
 # ------------------------------------------------------------------------------
@@ -166,6 +237,10 @@ MEDIA_ROOT = str(ROOT_DIR('media'))
 # See: https://docs.djangoproject.com/en/dev/ref/settings/#media-url
 MEDIA_URL = '/media/'
 
+# Square thumbnails (px) generated for every avatar by the process_avatars worker
+AVATAR_SIZES = [40, 80, 160]
+AVATAR_FORMAT = 'WEBP'
+
 # URL Configuration
 # ------------------------------------------------------------------------------
 ROOT_URLCONF = 'config.urls'
@@ -205,13 +280,18 @@ TEMPLATES = [
 # ------------------------------------------------------------------------------
 # See https://docs.djangoproject.com/en/dev/ref/settings/#password-hashers
 PASSWORD_HASHERS = [
-    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'apps.users.hashers.PooledPBKDF2PasswordHasher',
     'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
     'django.contrib.auth.hashers.Argon2PasswordHasher',
     'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
     'django.contrib.auth.hashers.BCryptPasswordHasher',
 ]
 
+# Processes per gunicorn worker used for PBKDF2 (0 hashes inline), and how many
+# hashing operations may wait for them before requests are rejected with 429
+PASSWORD_HASHING_WORKERS = env.int('PASSWORD_HASHING_WORKERS', default=2)
+PASSWORD_HASHING_MAX_PENDING = env.int('PASSWORD_HASHING_MAX_PENDING', default=32)
+
 # PASSWORD VALIDATION
 # https://docs.djangoproject.com/en/dev/ref/settings/#auth-password-validators
 # ------------------------------------------------------------------------------
@@ -240,15 +320,63 @@ AUTH_USER_MODEL = 'users.User'
 REST_FRAMEWORK = {
     'UPLOADED_FILES_USE_URL': False,
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework_simplejwt.authentication.JWTTokenUserAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.BasicAuthentication'
     ],
     'DEFAULT_PERMISSION_CLASSES': [],
+    'DEFAULT_RENDERER_CLASSES': [
+        'apps.common.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
         'rest_framework.parsers.FormParser',
         'rest_framework.parsers.MultiPartParser',
         'rest_framework.parsers.FileUploadParser'
-    ]
+    ],
+    'DEFAULT_FILTER_BACKENDS': ['apps.common.filters.FilterSetBackend'],
+    'DEFAULT_PAGINATION_CLASS': 'apps.common.pagination.KeysetPagination',
+    'PAGE_SIZE': env.int('API_PAGE_SIZE', default=50),
 }
 
+# Upper bound for the ?page_size= query param of paginated list endpoints
+API_MAX_PAGE_SIZE = env.int('API_MAX_PAGE_SIZE', default=500)
+
+# Upper bound for the items of one batch write (POST .../batch/)
+API_MAX_BATCH_SIZE = env.int('API_MAX_BATCH_SIZE', default=10000)
+
+# Above this many rows (planner estimate) admin changelists show estimated counts instead of COUNT(*)
+ESTIMATED_COUNT_THRESHOLD = env.int('ESTIMATED_COUNT_THRESHOLD', default=100000)
+
+# Live budget events (apps.common.pubsub): 'postgres' fans them out to every worker with
+# LISTEN/NOTIFY, at one NOTIFY per write (off Postgres, 'local' is used instead); 'local' delivers
+# them within the publishing process only, for a single worker (gunicorn refuses it with more).
+# Each gevent worker holds up to PUBSUB_MAX_SUBSCRIBERS event streams (keep it well below
+# gunicorn's worker_connections, streams occupy one each), a stream more than
+# PUBSUB_QUEUE_SIZE events behind is told to reload instead of buffering more.
+PUBSUB_BROKER = env.str('PUBSUB_BROKER', default='postgres')
+PUBSUB_MAX_SUBSCRIBERS = env.int('PUBSUB_MAX_SUBSCRIBERS', default=500)
+PUBSUB_QUEUE_SIZE = env.int('PUBSUB_QUEUE_SIZE', default=100)
+SSE_HEARTBEAT = env.float('SSE_HEARTBEAT', default=15.0)
+# Streams end (and EventSource reconnects) after this long, re-checking the token and access
+SSE_MAX_SECONDS = env.float('SSE_MAX_SECONDS', default=300.0)
+
+# archive_transactions moves the monthly transaction partitions older than this many months
+# to gzipped CSV files in TRANSACTION_ARCHIVE_DIR (Postgres)
+TRANSACTION_RETENTION_MONTHS = env.int('TRANSACTION_RETENTION_MONTHS', default=24)
+TRANSACTION_ARCHIVE_DIR = env.str('TRANSACTION_ARCHIVE_DIR', default=str(ROOT_DIR('archive')))
+
+# Rows fetched per round trip by streaming exports (server-side cursor on Postgres)
+EXPORT_CHUNK_SIZE = env.int('EXPORT_CHUNK_SIZE', default=2000)
+
+# SIMPLE JWT
+# ------------------------------------------------------------------------------
+# Access tokens are verified without database queries (see apps.users.tokens.ClaimsUser),
+# so their lifetime is how long a revoked or edited user may still be served from claims.
+SIMPLE_JWT = {
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=env.int('JWT_ACCESS_TOKEN_MINUTES', default=5)),
+    'REFRESH_TOKEN_LIFETIME': timedelta(days=env.int('JWT_REFRESH_TOKEN_DAYS', default=1)),
+    'SIGNING_KEY': SECRET_KEY,
+    'AUTH_HEADER_TYPES': ['Bearer'],
+    'TOKEN_USER_CLASS': 'apps.users.tokens.ClaimsUser',
+}
@@ -4,6 +4,7 @@ from django.contrib.auth import logout
 
 from django.conf.urls import include
 
+from apps.common.views import metrics_view
 from config.api import api
 
 
@@ -14,5 +15,6 @@ urlpatterns = [
     
     path('api/', include(api.urls)),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
+    path('metrics', metrics_view, name='metrics'),
     
 ]
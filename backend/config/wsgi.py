@@ -11,6 +11,7 @@ import os
 import sys
 
 from django.core.wsgi import get_wsgi_application
+from django.urls import get_resolver
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 # This allows easy placement of apps within the interior serenity directory.
@@ -23,6 +24,7 @@ sys.path.append(os.path.join(current_path, 'apps'))
 # setting points here.
 application = get_wsgi_application()
 
-from raven.contrib.django.raven_compat.middleware.wsgi import Sentry
-application = Sentry(application)
+# Import the URLconf (views, serializers) now instead of on the first request,
+# so gunicorn workers preloaded from config/gunicorn_conf.py fork with it
+get_resolver().url_patterns
 
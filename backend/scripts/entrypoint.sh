@@ -4,28 +4,23 @@ set -o errexit
 set -o pipefail
 cmd="$@"
 
-function postgres_ready(){
+# One interpreter polls until Postgres accepts connections, instead of one per attempt
 python << END
 import sys
+import time
 import psycopg2
 import environ
 
-try:
-    env = environ.Env()
-    dbname = env.str('POSTGRES_DB')
-    user = env.str('POSTGRES_USER')
-    password = env.str('POSTGRES_PASSWORD')
-    conn = psycopg2.connect(dbname=dbname, user=user, password=password, host='postgres', port=5432)
-except psycopg2.OperationalError:
-    sys.exit(-1)
-sys.exit(0)
+env = environ.Env()
+while True:
+    try:
+        psycopg2.connect(dbname=env.str('POSTGRES_DB'), user=env.str('POSTGRES_USER'),
+                         password=env.str('POSTGRES_PASSWORD'), host='postgres', port=5432).close()
+        break
+    except psycopg2.OperationalError:
+        print('Postgres is unavailable - sleeping', file=sys.stderr)
+        time.sleep(0.5)
 END
-}
-
-until postgres_ready; do
-  >&2 echo "Postgres is unavailable - sleeping"
-  sleep 1
-done
 
 >&2 echo "Postgres is up - continuing..."
 exec $cmd
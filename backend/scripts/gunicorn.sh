@@ -4,6 +4,5 @@ set -o errexit
 set -o pipefail
 set -o nounset
 
-python manage.py migrate
-python manage.py collectstatic --noinput --verbosity 0
-gunicorn config.wsgi -w 4 --worker-class gevent -b 0.0.0.0:8000 --chdir=/app
+python manage.py prestart
+exec gunicorn config.wsgi --config /app/config/gunicorn_conf.py --chdir=/app
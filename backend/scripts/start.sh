@@ -5,6 +5,5 @@ set -o pipefail
 set -o nounset
 set -o xtrace
 
-python manage.py migrate
-python manage.py collectstatic --noinput --verbosity 0
+python manage.py prestart
 python manage.py runserver_plus 0.0.0.0:8000
@@ -0,0 +1,49 @@
+#!/usr/bin/env bash
+# Moves the database of the postgres:10 volume into the postgres:12 one. A 12 server can't
+# start on 10 data files, so the compose files mount a new volume and this script dumps the
+# old one into it. The old volume is left as it was: remove it once the data is checked
+# (docker volume rm <name>), or go back by checking out the postgres:10 compose file.
+#
+# From the repository root, with the stack stopped (docker-compose down):
+#   scripts/upgrade_postgres.sh                          # docker-compose.yml
+#   scripts/upgrade_postgres.sh docker-compose-prod.yml
+# Set COMPOSE_PROJECT_NAME if the stack runs under another project name than the directory's.
+
+set -o errexit
+set -o pipefail
+set -o nounset
+
+compose_file=${1:-docker-compose.yml}
+if [[ $compose_file == *prod* ]]; then
+    old_volume=postgres_data
+else
+    old_volume=budgettracker_data
+fi
+project=${COMPOSE_PROJECT_NAME:-$(basename "$PWD" | tr '[:upper:]' '[:lower:]' | tr -cd '[:alnum:]')}
+old_volume=${project}_${old_volume}
+compose() {
+    docker-compose --file "$compose_file" "$@"
+}
+
+set -o allexport
+source .env
+set +o allexport
+
+docker volume inspect "$old_volume" > /dev/null
+old=$(docker run --detach --rm --volume "$old_volume":/var/lib/postgresql/data postgres:10-alpine)
+trap 'docker stop "$old" > /dev/null' EXIT
+# Creates the new volume, initialised with the database and user of .env
+compose up --detach postgres
+
+# Over TCP: while initialising, the server only listens on its socket
+until docker exec "$old" pg_isready --host 127.0.0.1 --username "$POSTGRES_USER" > /dev/null; do sleep 1; done
+until compose exec -T postgres pg_isready --host 127.0.0.1 --username "$POSTGRES_USER" > /dev/null; do sleep 1; done
+
+echo "Copying $POSTGRES_DB from $old_volume"
+docker exec "$old" pg_dump --username "$POSTGRES_USER" --no-owner "$POSTGRES_DB" \
+    | compose exec -T postgres psql --quiet --set ON_ERROR_STOP=1 --username "$POSTGRES_USER" --dbname "$POSTGRES_DB"
+
+# Partitions the transactions table and creates the indexes of post_migrate
+compose run --rm backend python manage.py migrate
+compose stop postgres
+echo "Done. $old_volume is unchanged, remove it once the new database is checked."